@@ -0,0 +1,135 @@
+"""
+Replay entry point: feeds a capture recorded by the gateway (config.CAPTURE_PATH) through NMEA parsing, Modbus
+register mapping, the change filters and the MQTT publisher, with the recorded timestamps.
+
+    python Replay.py captures/incident.cap                      # real time
+    python Replay.py captures/incident.cap --speed 20           # 20x faster than recorded
+    python Replay.py captures/week.cap --speed 0 --dry-run      # as fast as possible, without publishing
+
+Point configs/config.py at a test broker before replaying captures of a real ship.
+"""
+from iot_gateway.capture import MODBUS, NMEA, SESSION, read_capture
+from iot_gateway.modubs_tcp import ModbusClientHandler
+from iot_gateway.nmea_client import NmeaHandler, NmeaSentenceFramer
+from iot_gateway.nmea_sources import tag_source
+from iot_gateway.mqtt_publisher import MQTTPublisher
+from iot_gateway.sensor_registry import REGISTRY
+from configs import config
+import argparse
+import asyncio
+import os
+from utils.logger import get_logger
+
+logger = get_logger("iot_gatway_logger", file_name='logs/iot_gatway.log')
+
+
+async def replay(path: str, speed: float, publisher: MQTTPublisher | None) -> dict:
+    """
+    Replay a capture file.
+
+    The runs of the gateway recorded into the same file (SESSION records) are replayed one after the other without
+    the time between them. Modbus frames of devices that are not in the sensor registry are skipped.
+
+    Args:
+    -----
+    path(str): Capture file
+    speed(float): Replay speed relative to the recording, 0 replays as fast as possible
+    publisher(MQTTPublisher, optional): Publisher of the readings that pass the change filter, None for a dry run
+
+    Returns:
+    --------
+    dict: Counts of records, sessions, readings, readings that passed the filter, published messages and skipped
+    Modbus frames, the run time and the recorded time summed over the sessions
+    """
+    loop = asyncio.get_running_loop()
+    nmea_handler = NmeaHandler(config.NMEA_PORT, config.NMEA_HOST, send_valid_data=True, use_asyncio=True)
+    modbus_handler = ModbusClientHandler(host=config.MODBUS_HOST, port=config.MODUBS_PORT, unit_id=config.MODBUS_UNIT_ID, use_asyncio=True)
+    framers: dict[str, NmeaSentenceFramer] = {} # one per recorded stream, sentences can be cut between two records
+    stats = {"records": 0, "sessions": 0, "readings": 0, "passed": 0, "published": 0, "skipped": 0}
+    unknown_devices = set()
+    recorded_seconds = 0.0 # of the finished sessions
+    first = last = None # first and last timestamp of the current session
+    started = session_started = loop.time()
+    for timestamp, kind, source, payload in read_capture(path):
+        if kind == SESSION:
+            if first is not None:
+                recorded_seconds += last - first
+            first = None
+            stats["sessions"] += 1
+            framers.clear() # the streams of a run do not continue in the next one
+            continue
+        if first is None:
+            first, session_started = timestamp, loop.time()
+            stats["sessions"] = stats["sessions"] or 1 # captures without SESSION records are one session
+        last = timestamp
+        if speed:
+            delay = (timestamp - first) / speed - (loop.time() - session_started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        elif stats["records"] % 1000 == 0:
+            await asyncio.sleep(0) # let the publisher's tasks run
+        stats["records"] += 1
+        if kind == NMEA:
+            framer = framers.setdefault(source, NmeaSentenceFramer())
+            readings = nmea_handler.parse_block(framer.feed_block(payload), round(timestamp * 1e9), source=source,
+                                                device=tag_source(payload))
+        elif kind == MODBUS:
+            unit_id, start, values = payload
+            host, _, port = source.rpartition(":")
+            device = (host, int(port), unit_id)
+            if device not in REGISTRY.registers: # recorded from a device that is not in the registry (anymore)
+                if device not in unknown_devices:
+                    unknown_devices.add(device)
+                    logger.warning("Skipping the Modbus frames of %s unit %d, the device is not in the sensor registry", source, unit_id)
+                stats["skipped"] += 1
+                continue
+            decoder, sensor_ids = modbus_handler.decoder_for(*device, start, len(values))
+            readings = modbus_handler.evaluate_registers(sensor_ids, decoder.decode(values), round(timestamp * 1e9))
+        else:
+            continue
+        stats["readings"] += len(readings)
+        for reading in readings:
+            if reading.send_point:
+                stats["passed"] += 1
+                if publisher and await publisher.publish_async(reading):
+                    stats["published"] += 1
+    await modbus_handler.close()
+    stats["seconds"] = loop.time() - started
+    stats["recorded_seconds"] = recorded_seconds + (0 if first is None else last - first)
+    return stats
+
+
+async def main(args) -> None:
+    publisher = None
+    if not args.dry_run:
+        publisher = MQTTPublisher(
+            host=config.MQTT_BROKER_HOST,
+            port=config.MQTT_BROKER_PORT,
+            username=config.MQTT_BROKER_USERNAME,
+            password=config.MQTT_BROKER_PASSWORD,
+            client_id=f"ows-challenge-replay-{os.getpid()}"
+        )
+        await publisher.wait_connected(config.STARTUP_CONNECT_TIMEOUT)
+    flusher = asyncio.create_task(publisher.flush_batches()) if publisher else None
+    try:
+        stats = await replay(args.capture, args.speed, publisher)
+    finally:
+        if flusher:
+            flusher.cancel()
+        if publisher:
+            publisher.stop() # sends the open batches
+    rate = stats["readings"] / stats["seconds"] if stats["seconds"] else float("inf")
+    print(f"Replayed {stats['records']} records of {stats['sessions']} sessions ({stats['recorded_seconds']:.0f}s recorded) in {stats['seconds']:.2f}s: "
+          f"{stats['readings']} readings ({rate:,.0f}/s), {stats['passed']} passed the change filter, {stats['published']} published, "
+          f"{stats['skipped']} Modbus frames of unknown devices skipped")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a gateway capture through parsing, filtering and publishing")
+    parser.add_argument("capture", help="capture file recorded with config.CAPTURE_PATH")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed relative to the recording, 0 = as fast as possible")
+    parser.add_argument("--dry-run", action="store_true", help="do not connect to the broker, only parse and filter")
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        logger.info("Replay stopped due to KeyboardInterrupt.")
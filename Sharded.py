@@ -0,0 +1,30 @@
+"""
+Entry point of the sharded gateway for large sensor fleets.
+
+The Modbus devices of the sensor registry (configs/sensors.toml) and the NMEA streams of config.NMEA_STREAMS are split between
+SHARD_WORKERS worker processes, the readings are published by SHARD_PUBLISHERS publisher processes. Crashed
+processes are restarted by the supervisor. Use Main.py for a single process gateway.
+
+    python Sharded.py
+"""
+from iot_gateway.sharded_runtime import ShardSupervisor
+from iot_gateway.sensor_registry import REGISTRY
+from configs import config
+import signal
+import sys
+from utils.logger import get_logger
+
+logger = get_logger("iot_gatway_logger", file_name='logs/iot_gatway.log')
+
+
+if __name__ == "__main__": # required, the processes are spawned and import this module
+    logger.info("Starting sharded iot_gatway......")
+    supervisor = ShardSupervisor(REGISTRY.devices, config.NMEA_STREAMS)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0)) # stop the processes on a service stop as well
+    try:
+        supervisor.run()
+    except KeyboardInterrupt:
+        logger.info("Shutting down due to KeyboardInterrupt.")
+    finally:
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        supervisor.stop()
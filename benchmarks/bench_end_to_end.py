@@ -0,0 +1,118 @@
+"""
+End to end throughput benchmark of the gateway.
+
+Starts the local Modbus simulator, the NMEA streamer and the MQTT broker stand-in, runs the pipeline of Main.py
+against them in a child process for a fixed time and reports:
+- readings/s received by the broker
+- p50/p99 sensor to publish latency of the ROT readings (streamer write -> broker arrival)
+- CPU time and peak RSS of the gateway process
+
+Run from the repository root:
+    python -m benchmarks.bench_end_to_end --duration 20 --rate 200 --fragment 7 --corrupt 0.01
+"""
+import argparse
+import asyncio
+import json
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import os
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__))) # the child processes run in a temporary directory
+from simulators.modbus_server import ModbusSimulator
+from simulators.nmea_streamer import NmeaStreamer
+from simulators.mqtt_broker import MqttBrokerStub
+
+
+def run_gateway(args) -> None:
+    """
+    Child process: point the configuration to the local stand-ins and run Main.main() for the given duration.
+    """
+    from configs import config
+    config.MODBUS_HOST = config.NMEA_HOST = config.MQTT_BROKER_HOST = "127.0.0.1"
+    config.MODUBS_PORT = args.modbus_port
+    config.NMEA_PORT = args.nmea_port
+    config.MQTT_BROKER_PORT = args.mqtt_port
+    config.MQTT_USE_TLS = False
+    config.METRICS_PORT = 0 # any free port, the endpoint is not scraped here
+    config.OFFLINE_QUEUE_PATH = os.path.join(os.getcwd(), "outbound_queue.db")
+    import Main # the clients read the configuration when main() builds them
+
+    async def run_for(duration: float) -> None:
+        try:
+            await asyncio.wait_for(Main.main(), duration)
+        except asyncio.TimeoutError:
+            pass
+
+    asyncio.run(run_for(args.duration))
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    print(json.dumps({"cpu_seconds": usage.ru_utime + usage.ru_stime, "max_rss_kb": usage.ru_maxrss}))
+    os._exit(0) # do not wait for the paho network thread
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def benchmark(args) -> dict:
+    modbus = ModbusSimulator(register_count=16, update_interval=0.5)
+    nmea = NmeaStreamer(rate=args.rate, jitter=args.jitter, fragment=args.fragment,
+                        corrupt_ratio=args.corrupt, sequential=True)
+    broker = MqttBrokerStub()
+    modbus_port, nmea_port, mqtt_port = await modbus.start(), await nmea.start(), await broker.start()
+    with tempfile.TemporaryDirectory() as work_dir: # logs and the offline queue of the gateway go here
+        gateway = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "benchmarks.bench_end_to_end", "--gateway", "--duration", str(args.duration),
+            "--modbus-port", str(modbus_port), "--nmea-port", str(nmea_port), "--mqtt-port", str(mqtt_port),
+            cwd=work_dir, env={**os.environ, "PYTHONPATH": ROOT_DIR}, stdout=subprocess.PIPE)
+        output, _ = await gateway.communicate()
+    for server in (modbus, nmea, broker):
+        await server.stop()
+    usage = json.loads(output.decode().strip().splitlines()[-1])
+
+    latencies = []
+    for arrival, topic, payload in broker.received:
+        if not topic.endswith("/rot"):
+            continue
+        sent = nmea.sent_times.get(float(payload.split(b" ", 1)[0]))
+        if sent is not None:
+            latencies.append((arrival - sent) * 1000)
+    return {
+        "duration_s": args.duration,
+        "nmea_sentences_sent": nmea.sent,
+        "modbus_requests": modbus.requests,
+        "readings_received": len(broker.received),
+        "readings_per_s": len(broker.received) / args.duration,
+        "rot_latency_p50_ms": percentile(latencies, 0.50),
+        "rot_latency_p99_ms": percentile(latencies, 0.99),
+        "rot_latency_mean_ms": statistics.fmean(latencies) if latencies else float("nan"),
+        "gateway_cpu_s": usage["cpu_seconds"],
+        "gateway_cpu_percent": 100 * usage["cpu_seconds"] / args.duration,
+        "gateway_max_rss_mb": usage["max_rss_kb"] / 1024,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=20, help="seconds to run the gateway")
+    parser.add_argument("--rate", type=float, default=50, help="NMEA sentences per second")
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--fragment", type=int, default=0)
+    parser.add_argument("--corrupt", type=float, default=0.0)
+    parser.add_argument("--gateway", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--modbus-port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--nmea-port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--mqtt-port", type=int, help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+    if arguments.gateway:
+        run_gateway(arguments)
+    else:
+        started = time.time()
+        results = asyncio.run(benchmark(arguments))
+        for name, value in results.items():
+            print(f"{name:<24}: {value:,.2f}" if isinstance(value, float) else f"{name:<24}: {value:,}")
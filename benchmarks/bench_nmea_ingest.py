@@ -0,0 +1,109 @@
+"""
+UDP ingestion benchmark of the NMEA handler.
+
+A sender process plays a bridge network: IEC 61162-450 datagrams ("UdPbC" header, TAG block, several sentences)
+from several talkers (HEROT, TIROT, HEHDT, GPVTG), sent twice over two sockets like a redundant network. The
+handler reads them with NmeaHandler.stream_datagrams() and reports:
+- sentences/s offered and readings/s parsed
+- duplicates dropped by the source selection (about half of the offered sentences)
+- readings per talker and sensor, and the CPU time of the gateway side
+
+Run from the repository root:
+    python -m benchmarks.bench_nmea_ingest --rate 20000 --duration 5
+    python -m benchmarks.bench_nmea_ingest --group 239.192.0.1   # over multicast, needs a multicast route
+"""
+import argparse
+import asyncio
+import multiprocessing
+import resource
+import socket
+import time
+from iot_gateway.nmea_parser import nmea_checksum
+
+SENTENCES_PER_DATAGRAM = 4
+
+
+def sentence(body: str) -> bytes:
+    data = body.encode('ascii')
+    return b"$" + data + b"*" + f"{nmea_checksum(data):02X}".encode('ascii') + b"\r\n"
+
+
+def build_datagram(index: int) -> bytes:
+    value = (index % 2000) / 10
+    tag = f"s:GW0001,n:{index % 1000}".encode('ascii')
+    return (b"UdPbC\x00\\" + tag + b"*" + f"{nmea_checksum(tag):02X}".encode('ascii') + b"\\" +
+            sentence(f"HEROT,{value:.1f},A") + sentence(f"TIROT,{-value:.1f},A") +
+            sentence(f"HEHDT,{value:.1f},T") + sentence(f"GPVTG,{value:.1f},T,,M,{value / 10:.1f},N,,K,A"))
+
+
+def send(address: tuple, rate: float, duration: float) -> None:
+    """
+    Sender process: every datagram goes out over two sockets, the second one being the redundant path.
+    """
+    paths = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for _ in range(2)]
+    for path in paths:
+        path.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+    interval = SENTENCES_PER_DATAGRAM / rate
+    started = time.monotonic()
+    index = 0
+    while time.monotonic() - started < duration:
+        datagram = build_datagram(index)
+        for path in paths:
+            path.sendto(datagram, address)
+        index += 1
+        delay = started + index * interval - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def free_udp_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def benchmark(args) -> dict:
+    from iot_gateway.nmea_client import NmeaHandler
+    from iot_gateway import nmea_sources
+    port = free_udp_port()
+    handler = NmeaHandler(port, "127.0.0.1", send_valid_data=True, use_asyncio=True, sentence_types=("ROT", "HDT", "VTG"))
+    readings = {}
+
+    async def consume() -> None:
+        async for reading in handler.stream_datagrams(port, args.group, "0.0.0.0" if args.group else "127.0.0.1"):
+            key = f"{reading.source}:{reading.sensor}"
+            readings[key] = readings.get(key, 0) + 1
+
+    consumer = asyncio.create_task(consume())
+    await asyncio.sleep(0.1) # the socket is bound
+    datagrams, duplicates = nmea_sources.DATAGRAMS.value, nmea_sources.DUPLICATES.value
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    sender = multiprocessing.Process(target=send, args=((args.group or "127.0.0.1", port), args.rate, args.duration))
+    sender.start()
+    started = time.perf_counter()
+    await asyncio.get_running_loop().run_in_executor(None, sender.join)
+    await asyncio.sleep(0.2) # the last datagrams
+    seconds = time.perf_counter() - started
+    consumer.cancel()
+    await asyncio.gather(consumer, return_exceptions=True)
+    cpu = resource.getrusage(resource.RUSAGE_SELF)
+    total = sum(readings.values())
+    return {
+        "offered_sentences_per_s": 2 * args.rate,
+        "datagrams_received": nmea_sources.DATAGRAMS.value - datagrams,
+        "duplicates_dropped": nmea_sources.DUPLICATES.value - duplicates,
+        "readings": total,
+        "readings_per_s": total / seconds,
+        "cpu_percent": 100 * (cpu.ru_utime + cpu.ru_stime - usage.ru_utime - usage.ru_stime) / seconds,
+        **{f"readings {key}": count for key, count in sorted(readings.items())},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=10000, help="sentences per second per path")
+    parser.add_argument("--duration", type=float, default=5, help="seconds to send")
+    parser.add_argument("--group", default=None, help="multicast group, default is unicast to 127.0.0.1")
+    results = asyncio.run(benchmark(parser.parse_args()))
+    for name, value in results.items():
+        print(f"{name:<24}: {value:,.2f}" if isinstance(value, float) else f"{name:<24}: {value:,}")
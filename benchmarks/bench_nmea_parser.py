@@ -0,0 +1,59 @@
+"""
+Microbenchmark of the NMEA parser, sentences per second.
+
+Compares the bytes level parsers (nmea_parser.parse_sentence per sentence and nmea_parser.parse_buffer per received
+block) with the previous str based parse_signal, which is kept here as the reference implementation. parse_sentence
+is expected to be on par with it, the speed up comes from parse_buffer.
+
+Run from the repository root:
+    python -m benchmarks.bench_nmea_parser
+"""
+import operator
+import timeit
+from functools import reduce
+from iot_gateway.nmea_parser import nmea_checksum, parse_buffer, parse_sentence
+
+SENTENCES = 10_000
+BLOCK_SIZE = 50 # sentences per received TCP block
+
+
+def legacy_parse_signal(message: str):
+    """
+    The previous parser: str decoding, reduce() checksum per character and repeated splits.
+    """
+    def calculate_checksum(data: str) -> int:
+        return reduce(operator.xor, (ord(s) for s in data[1:]), 0)
+
+    if not message.startswith('$') or '*' not in message:
+        return None
+    data, checksum = message.split("*")
+    if int(checksum, base=16) != calculate_checksum(data):
+        return None
+    fields = data.split(",")
+    return fields[0][1:3], fields[0][3:], float(fields[1]), fields[2]
+
+
+def build_sentences() -> list:
+    sentences = []
+    for index in range(SENTENCES):
+        body = f"GPROT,{(index % 600) / 10 - 30:.1f},A".encode('ascii')
+        sentences.append(b"$" + body + b"*" + f"{nmea_checksum(body):02X}".encode('ascii'))
+    return sentences
+
+
+def run(name: str, parse, items: list, sentences: int, repeat: int = 5) -> float:
+    best = min(timeit.repeat(lambda: [parse(item) for item in items], number=1, repeat=repeat))
+    rate = sentences / best
+    print(f"{name:<32}: {rate:12,.0f} sentences/s")
+    return rate
+
+
+if __name__ == "__main__":
+    sentences = build_sentences()
+    decoded = [sentence.decode('ascii') for sentence in sentences]
+    blocks = [b"\r\n".join(sentences[index:index + BLOCK_SIZE]) + b"\r\n" for index in range(0, SENTENCES, BLOCK_SIZE)]
+    rot_only = {b"ROT"}
+    legacy = run("legacy parse_signal (str)", legacy_parse_signal, decoded, SENTENCES)
+    single = run("parse_sentence (bytes)", lambda sentence: parse_sentence(sentence, rot_only), sentences, SENTENCES)
+    block = run(f"parse_buffer ({BLOCK_SIZE} per block)", lambda data: parse_buffer(data, rot_only), blocks, SENTENCES)
+    print(f"speed up: parse_sentence {single / legacy:.1f}x, parse_buffer {block / legacy:.1f}x")
@@ -0,0 +1,58 @@
+"""
+Measures the memory cost of a single reading.
+
+Compares the compact Reading (__slots__, float timestamp) with the previous dict backed datapoint that held a
+datetime and a reference to the previous datapoint.
+
+Run from the repository root:
+    python -m benchmarks.bench_reading_memory
+"""
+import time
+import tracemalloc
+from datetime import datetime
+from iot_gateway.readings import Reading
+
+READINGS = 100_000
+
+
+class LegacyDatapoint:
+    """
+    The previous datapoint layout: a plain object with a datetime and a link to the previous datapoint.
+    """
+    def __init__(self, sensor, value, previous_datapoint):
+        self.sensor = sensor
+        self.value = value
+        self.previous_datapoint = previous_datapoint
+        self.changed = True
+        self.send_point = True
+        self.timestamp = datetime.now()
+
+
+def measure(build) -> float:
+    """
+    Return the bytes allocated per reading by build(), which must keep all readings alive.
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return (after - before) / READINGS
+
+
+def build_legacy():
+    previous = None
+    for index in range(READINGS): # every datapoint keeps the whole chain alive
+        previous = LegacyDatapoint("ROT", float(index), previous)
+    return previous
+
+
+def build_readings():
+    now = time.time()
+    return [Reading("ROT", float(index), "deg", timestamp=now) for index in range(READINGS)]
+
+
+if __name__ == "__main__":
+    print(f"Legacy datapoint chain : {measure(build_legacy):8.1f} bytes/reading")
+    print(f"Reading objects        : {measure(build_readings):8.1f} bytes/reading")
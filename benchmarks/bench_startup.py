@@ -0,0 +1,113 @@
+"""
+Startup benchmark of the gateway.
+
+Reports, over several runs:
+- import time of Main.py in a fresh interpreter, and whether the import started a thread or created a file
+- time to first publish: from spawning the gateway process until the MQTT broker stand-in receives the first sensor
+  reading, with the local Modbus simulator and NMEA streamer running
+
+Run from the repository root:
+    python -m benchmarks.bench_startup --runs 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__))) # the child processes run in a temporary directory
+from simulators.modbus_server import ModbusSimulator
+from simulators.nmea_streamer import NmeaStreamer
+from simulators.mqtt_broker import MqttBrokerStub
+
+IMPORT_PROBE = """
+import json, os, threading, time
+started = time.perf_counter()
+import Main
+seconds = time.perf_counter() - started
+print(json.dumps({"seconds": seconds, "threads": threading.active_count(), "files": os.listdir(".")}))
+"""
+
+
+def run_gateway(args) -> None:
+    """
+    Child process: point the configuration to the local stand-ins and run Main.main() until it is killed.
+    """
+    from configs import config
+    config.MODBUS_HOST = config.NMEA_HOST = config.MQTT_BROKER_HOST = "127.0.0.1"
+    config.MODUBS_PORT = args.modbus_port
+    config.NMEA_PORT = args.nmea_port
+    config.MQTT_BROKER_PORT = args.mqtt_port
+    config.MQTT_USE_TLS = False
+    config.METRICS_PORT = 0
+    config.OFFLINE_QUEUE_PATH = os.path.join(os.getcwd(), "outbound_queue.db")
+    config.HISTORY_STORE_PATH = os.path.join(os.getcwd(), "history")
+    import Main
+    asyncio.run(Main.main())
+
+
+def measure_import() -> dict:
+    with tempfile.TemporaryDirectory() as work_dir:
+        output = subprocess.run([sys.executable, "-c", IMPORT_PROBE], cwd=work_dir, check=True,
+                                capture_output=True, text=True, env={**os.environ, "PYTHONPATH": ROOT_DIR}).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+async def measure_first_publish(args, modbus_port: int, nmea_port: int, mqtt_port: int, broker: MqttBrokerStub) -> float:
+    broker.received.clear()
+    with tempfile.TemporaryDirectory() as work_dir:
+        started = time.time()
+        gateway = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "benchmarks.bench_startup", "--gateway",
+            "--modbus-port", str(modbus_port), "--nmea-port", str(nmea_port), "--mqtt-port", str(mqtt_port),
+            cwd=work_dir, env={**os.environ, "PYTHONPATH": ROOT_DIR}, stdout=subprocess.DEVNULL)
+        deadline = started + args.timeout
+        first = None
+        while first is None and time.time() < deadline:
+            await asyncio.sleep(0.005)
+            first = next((arrival for arrival, topic, _ in broker.received if "/gateway/" not in topic), None)
+        gateway.kill()
+        await gateway.wait()
+    return float("nan") if first is None else first - started
+
+
+async def benchmark(args) -> dict:
+    imports = [measure_import() for _ in range(args.runs)]
+    modbus = ModbusSimulator(register_count=16, update_interval=0.5)
+    nmea = NmeaStreamer(rate=args.rate, sequential=True)
+    broker = MqttBrokerStub()
+    modbus_port, nmea_port, mqtt_port = await modbus.start(), await nmea.start(), await broker.start()
+    first_publish = [await measure_first_publish(args, modbus_port, nmea_port, mqtt_port, broker) for _ in range(args.runs)]
+    for server in (modbus, nmea, broker):
+        await server.stop()
+    import_seconds = [result["seconds"] for result in imports]
+    return {
+        "runs": args.runs,
+        "import_median_ms": statistics.median(import_seconds) * 1000,
+        "import_max_ms": max(import_seconds) * 1000,
+        "import_threads": max(result["threads"] for result in imports),
+        "import_files_created": sum(len(result["files"]) for result in imports),
+        "first_publish_median_ms": statistics.median(first_publish) * 1000,
+        "first_publish_max_ms": max(first_publish) * 1000,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="measurements of each kind")
+    parser.add_argument("--rate", type=float, default=10, help="NMEA sentences per second")
+    parser.add_argument("--timeout", type=float, default=15, help="seconds to wait for the first publish of a run")
+    parser.add_argument("--gateway", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--modbus-port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--nmea-port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--mqtt-port", type=int, help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+    if arguments.gateway:
+        run_gateway(arguments)
+    else:
+        results = asyncio.run(benchmark(arguments))
+        for name, value in results.items():
+            print(f"{name:<24}: {value:,.2f}" if isinstance(value, float) else f"{name:<24}: {value:,}")
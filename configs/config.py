@@ -2,8 +2,22 @@ MODBUS_HOST = "localhost"
 MODBUS_IP = "127.0.0.1" 
 MODUBS_PORT= 8889
 MODBUS_UNIT_ID=1
+MODBUS_MAX_REGISTER_GAP = 8 # unused registers allowed between two polled registers before a new read request is started
+POLL_ADAPTIVE = True # Adapt the Modbus poll intervals to how fast the values change, False polls at the fixed poll_interval
+POLL_MIN_INTERVAL = 0.5 # Seconds, shortest adaptive poll interval (a register can override it with "min_interval")
+POLL_MAX_INTERVAL = 30 # Seconds, longest adaptive poll interval, must stay below MIN_ELAPSED_TIME (register "max_interval")
+POLL_DEADBAND_FRACTION = 0.5 # A moving value is polled about every time it moves this fraction of its deadband
+POLL_BACKOFF_FACTOR = 1.5 # Max growth of the poll interval per poll while the values are steady
 NMEA_HOST="localhost"
 NMEA_PORT=8888
+NMEA_SENTENCE_TYPES = ("ROT",) # Sentence types turned into readings, see iot_gateway/nmea_parser.py for the registered types
+NMEA_DATAGRAM_SOURCES = [] # UDP sources read by Main.py besides the TCP stream, eg. [{"port": 60001, "group": "239.192.0.1", "interface": "0.0.0.0"}] for an IEC 61162-450 multicast group
+NMEA_SOURCE_TIMEOUT = 2.0 # Seconds a talker and sentence type stays with its source before a redundant source takes over, 0 keeps the sentences of every source
+NMEA_UDP_BATCH = 256 # Maximum datagrams read and parsed together per wakeup
+NMEA_UDP_RECEIVE_BUFFER = 4 * 1024 * 1024 # SO_RCVBUF of the UDP sockets, holds the datagrams of a burst between two batches
+NMEA_STREAMS = [{"host": NMEA_HOST, "port": NMEA_PORT, "rate": 10}] # NMEA streams of the sharded runtime (Sharded.py), rate = expected sentences per second, add "protocol": "udp" (with "group" and "interface") for UDP sources
+SENSOR_REGISTRY_PATH = "configs/sensors.toml" # Devices, registers, scaling, units, thresholds and topics of all sensors
+SENSOR_REGISTRY_RELOAD_INTERVAL = 5 # Seconds between checks of the sensor registry file for changes, 0 disables hot reloading
 MIN_TEMPERATURE_CHANGE=1 #C
 MIN_ELAPSED_TIME = 5 #mins
 MIN_ROT_CHANGE=1 #degrees
@@ -11,4 +25,43 @@ MQTT_BROKER_HOST="a7fb406d74d6425f98e1bb4b6da01446.s1.eu.hivemq.cloud"
 MQTT_BROKER_PORT=8883
 MQTT_BROKER_USERNAME=None # credentials are in the email body
 MQTT_BROKER_PASSWORD=None # credentials are in the email body
+MQTT_USE_TLS = True # HiveMQ cloud requires TLS, local brokers usually do not
 MAX_ELAPSED_TIME = 10 # Max elapsed time of inactivity in minutes
+RECONNECT_MIN_DELAY = 0.5 # Seconds, first reconnect delay of the Modbus, NMEA and MQTT connections (doubles per failed attempt, with jitter)
+RECONNECT_MAX_DELAY = 30 # Seconds, upper bound of the reconnect delay
+STARTUP_CONNECT_TIMEOUT = 5 # Seconds the gateway waits at startup for the broker and the Modbus connections before polling anyway
+CIRCUIT_FAILURE_THRESHOLD = 3 # Consecutive connection failures before reads of an endpoint fail fast until its next retry
+MQTT_MAX_INFLIGHT = 200 # Max number of unacknowledged QoS 1 messages
+MQTT_BACKPRESSURE_POLICY = "block" # "block" waits for a free slot, "drop" discards the reading when the in-flight window is full
+MQTT_PAYLOAD_FORMAT = "text" # "text" (one message per reading) or a batch format: "struct", "json", "msgpack", "cbor"
+MQTT_BATCH_BY = "sensor" # "sensor" publishes a batch per sensor topic, "crane" packs all sensors into <static_text>/batch
+MQTT_BATCH_MAX_READINGS = 50 # A batch is published when it holds this many readings...
+MQTT_BATCH_WINDOW = 5.0 # ...or this many seconds after its first reading
+OFFLINE_QUEUE_PATH = "data/outbound_queue.db" # SQLite store-and-forward queue used while the broker is offline
+OFFLINE_QUEUE_MAX_BYTES = 100 * 1024 * 1024 # 100 MB
+OFFLINE_QUEUE_MAX_AGE = 48 # hours
+OFFLINE_QUEUE_REPLAY_RATE = 500 # messages per second sent from the queue after reconnecting
+AGGREGATION_INTERVAL = 60 # Seconds, window of the min/max/mean/std/slope/integral summaries published to <sensor topic>/stats, 0 disables them
+CAPTURE_PATH = None # Record the raw NMEA bytes and Modbus register frames to this file for Replay.py, eg. "data/capture.cap"
+HISTORY_STORE_PATH = "data/history" # On disk history of every reading (one directory of segment files per sensor), None disables it
+HISTORY_STORE_SEGMENT_RECORDS = 65536 # Readings per segment file (17 bytes each, about 1.1 MB)
+HISTORY_STORE_MAX_AGE = 30 # days of history kept, 0 keeps everything
+HISTORY_STORE_FLUSH_INTERVAL = 5.0 # Seconds the readings are collected in memory before they are appended to disk
+HISTORY_QUERY_MAX_POINTS = 5000 # Maximum points in an MQTT history response, longer ranges have to be downsampled
+CLOCK_SYNC_INTERVAL = 60 # Seconds between two measurements of the wall clock against the monotonic clock the readings are stamped with
+METRICS_HOST = "127.0.0.1" # Interface of the Prometheus text endpoint (GET /metrics)
+METRICS_PORT = 9108 # None disables the endpoint
+METRICS_MQTT_INTERVAL = 60 # Seconds between metric snapshots published to <static_text>/gateway/$SYS/metrics, 0 disables it
+LOG_LEVEL = "INFO"
+LOG_FLUSH_INTERVAL = 1.0 # Seconds the log writer collects records before writing them in one batch (errors are written right away)
+LOG_MAX_BYTES = 10 * 1024 * 1024 # Rotate a log file at 10 MB
+LOG_ROTATE_INTERVAL = 24 # Rotate a log file after this many hours
+LOG_BACKUP_COUNT = 5 # Rotated files kept per log file
+LOG_RATE_LIMIT_INTERVAL = 60 # Seconds of the rate limit window for repeated log messages
+LOG_RATE_LIMIT_BURST = 10 # Records of the same message per logger allowed in a window, 0 disables rate limiting
+SHARD_WORKERS = 0 # Worker processes of Sharded.py, 0 = one per CPU core left after the publishers
+SHARD_PUBLISHERS = 1 # MQTT publisher processes of Sharded.py, each one has its own connection and outbound queue
+SHARD_FLUSH_INTERVAL = 0.01 # Seconds a worker collects readings before sending them to its publisher
+SHARD_BUFFER_SIZE = 10000 # Readings a worker keeps while its publisher is not reachable
+SHARD_PUBLISH_QUEUE_SIZE = 1000 # Batches a publisher process accepts before the workers have to wait
+SHARD_MAX_RESTART_DELAY = 30 # Seconds, upper bound of the restart backoff of crashed processes
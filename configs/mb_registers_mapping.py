@@ -1,4 +0,0 @@
-mapping ={0:"Luffing motor 1 temperature (PS Winch)",
-          1:"Luffing motor 2 temerature (STB Winch)",
-          2:"Luffing motor 3 temperature (PS Winch)",
-          3:"Luffing motor 4 temperature (STB Winch)"}
\ No newline at end of file
@@ -1,7 +0,0 @@
-static_text="ows-challenge/mv-sinking-boat/main-crane"
-
-measurements_mapping={"Luffing motor 1 temperature (PS Winch)":f"{static_text}/luffing/temp-mot-1",
-          "Luffing motor 2 temerature (STB Winch)":f"{static_text}/luffing/temp-mot-2",
-          "Luffing motor 3 temperature (PS Winch)":f"{static_text}/luffing/temp-mot-3",
-          "Luffing motor 4 temperature (STB Winch)":f"{static_text}/luffing/temp-mot-4",
-          "ROT":f"{static_text}/rot"}
\ No newline at end of file
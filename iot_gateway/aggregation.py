@@ -0,0 +1,135 @@
+import math
+from .readings import Reading
+
+
+def seconds_to_next_window(now: float, interval: float) -> float:
+    """
+    Seconds from now (epoch seconds) to the end of the current window, windows are aligned to the wall clock (eg.
+    an interval of 60 closes them at every full minute UTC).
+    """
+    return interval - now % interval
+
+
+class SensorWindow:
+    """
+    Running statistics of one sensor over one window, updated in O(1) time and memory per reading.
+
+    The mean and variance use Welford's algorithm, the slope is the least squares fit of value over time (from
+    running sums with the time relative to the first reading) and the integral uses the trapezoidal rule between
+    consecutive readings. Invalid readings are only counted.
+
+    Attributes:
+    - unit(str): Unit of the readings.
+    - count(int): Valid readings in the window.
+    - invalid(int): Invalid readings in the window.
+    """
+    __slots__ = ("unit", "count", "invalid", "mean", "m2", "min", "max", "start", "end", "last_value",
+                 "integral", "sum_t", "sum_tt", "sum_tv")
+
+    def __init__(self, unit: str) -> None:
+        self.unit = unit
+        self.count = 0
+        self.invalid = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.start = self.end = 0.0
+        self.last_value = 0.0
+        self.integral = 0.0 # value * seconds
+        self.sum_t = self.sum_tt = self.sum_tv = 0.0
+
+    def add(self, value: float, timestamp: float) -> None:
+        if not self.count:
+            self.start = timestamp
+        elif timestamp > self.end:
+            self.integral += (self.last_value + value) / 2 * (timestamp - self.end)
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        t = timestamp - self.start
+        self.sum_t += t
+        self.sum_tt += t * t
+        self.sum_tv += t * value
+        self.end = timestamp
+        self.last_value = value
+
+    @property
+    def stddev(self) -> float:
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    @property
+    def slope(self) -> float:
+        """
+        Least squares rate of change in unit per minute, 0 with fewer than two distinct timestamps.
+        """
+        denominator = self.count * self.sum_tt - self.sum_t * self.sum_t
+        if denominator <= 1e-12:
+            return 0.0
+        sum_v = self.mean * self.count
+        return (self.count * self.sum_tv - self.sum_t * sum_v) / denominator * 60
+
+    def summary(self) -> dict:
+        """
+        Returns:
+        --------
+        dict: Compact summary of the window. "integral" is in unit * minutes, eg. the degrees turned for a
+        rate of turn in deg/min.
+        """
+        summary = {"unit": self.unit, "start": round(self.start, 3), "end": round(self.end, 3), "count": self.count,
+                   "invalid": self.invalid}
+        if self.count:
+            summary.update(min=self.min, max=self.max, mean=round(self.mean, 4), std=round(self.stddev, 4),
+                           slope=round(self.slope, 4), integral=round(self.integral / 60, 4))
+        return summary
+
+
+class WindowAggregator:
+    """
+    Tumbling window statistics of every sensor, fed with all readings (also the ones the change filter drops).
+
+    Windows are kept per sensor and source (Reading.source, the NMEA talker id), so the readings of two instruments
+    that share a sensor name (eg. the ROT of two gyros) are not mixed into one slope or integral. flush() closes the windows of all sensors and starts new ones, MQTTPublisher.publish_summaries() calls it
+    every AGGREGATION_INTERVAL seconds, aligned to the wall clock.
+    """
+    def __init__(self) -> None:
+        self._windows: dict[tuple, SensorWindow] = {} # (sensor, source) -> window
+
+    def __len__(self) -> int:
+        return len(self._windows)
+
+    def add(self, reading: Reading) -> None:
+        key = (reading.sensor, reading.source)
+        window = self._windows.get(key)
+        if window is None:
+            window = self._windows[key] = SensorWindow(reading.unit)
+        if reading.is_valid:
+            window.add(reading.value, reading.timestamp)
+        else:
+            window.invalid += 1
+
+    def extend(self, readings: list) -> None:
+        for reading in readings:
+            if reading:
+                self.add(reading)
+
+    def flush(self) -> list:
+        """
+        Returns:
+        --------
+        list: (sensor, summary dict) of every sensor and source that had readings since the last flush, the summary
+        names the source when the readings had one
+        """
+        windows, self._windows = self._windows, {}
+        summaries = []
+        for (sensor, source), window in windows.items():
+            summary = window.summary()
+            if source:
+                summary["source"] = source
+            summaries.append((sensor, summary))
+        return summaries
@@ -0,0 +1,224 @@
+import asyncio
+import struct
+import time
+from utils.logger import get_logger
+from utils import metrics
+from .connection_manager import CircuitBreaker, ConnectionPool
+
+logger = get_logger("modbus_logger", file_name='logs/modbus_client.log')
+
+REQUEST_SECONDS = metrics.histogram("gateway_modbus_request_seconds", "Round trip time of Modbus read requests")
+REQUEST_TIMEOUTS = metrics.counter("gateway_modbus_errors_total", "Failed Modbus read requests", reason="timeout")
+REQUEST_EXCEPTIONS = metrics.counter("gateway_modbus_errors_total", "Failed Modbus read requests", reason="exception")
+CONNECTION_ERRORS = metrics.counter("gateway_modbus_errors_total", "Failed Modbus read requests", reason="connection")
+
+MBAP_HEADER = struct.Struct(">HHHB") # transaction id, protocol id, length, unit id
+READ_HOLDING_REGISTERS_REQUEST = struct.Struct(">BHH") # function code, start address, quantity
+READ_HOLDING_REGISTERS = 0x03
+MAX_REGISTERS_PER_READ = 125 # Modbus spec limit for function code 0x03
+
+CLIENT_POOL = ConnectionPool() # (host, port) -> AsyncModbusClient shared by every user of the endpoint
+
+
+class AsyncModbusClient:
+    """
+    An asyncio native Modbus TCP client built on asyncio streams.
+
+    Requests are written to the socket without waiting for the previous response, and every response is matched
+    back to its request by the MBAP transaction id. This allows many reads (also for different unit ids behind the
+    same gateway) to be in flight on a single connection at the same time.
+
+    The connection is opened on the first read. When it is lost (or stops answering: `failure_threshold`
+    consecutive timeouts) it is reopened in the background with an exponential backoff, and reads fail right away
+    while the circuit breaker of the endpoint is open, so a dead device does not hold up its pollers.
+
+    Attributes:
+    - host(str): The Modbus Server host name.
+    - port(int): The Modbus port.
+    - unit_id(int): The default device id used when a read does not specify one.
+    - timeout(float): Seconds to wait for a connection or for a single response.
+    """
+    def __init__(self, host: str, port: int, unit_id: int = 1, timeout: float = 1.0) -> None:
+        self.host = host
+        self.port = port
+        self.unit_id = unit_id
+        self.timeout = timeout
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._receive_task: asyncio.Task | None = None
+        self._pending: dict[int, asyncio.Future] = {}
+        self._transaction_id = 0
+        self._timeouts = 0 # consecutive timeouts, the connection is considered dead after breaker.failure_threshold
+        self._opening: asyncio.Task | None = None # concurrent readers share a single connection attempt
+        self._reconnect_task: asyncio.Task | None = None
+        self.breaker = CircuitBreaker(f"modbus {host}:{port}")
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def open(self) -> bool:
+        """
+        Open the TCP connection to the Modbus server and start the response dispatcher.
+
+        Returns:
+        --------
+        bool: True if the connection is open, False if it failed or the circuit breaker refused the attempt.
+        """
+        if self.is_open:
+            return True
+        if self._opening is None or self._opening.done():
+            if not self.breaker.allow():
+                return False
+            self._opening = asyncio.create_task(self._connect())
+        return await asyncio.shield(self._opening)
+
+    async def _connect(self) -> bool:
+        try:
+            self._reader, self._writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            self.breaker.record_failure(e or "timeout")
+            return False
+        self.breaker.record_success()
+        self._timeouts = 0
+        self._receive_task = asyncio.create_task(self._receive_loop())
+        logger.info(f"Connection to Modbus Server on host '{self.host}' port '{self.port}' is successful")
+        return True
+
+    async def _reconnect(self) -> None:
+        """
+        Reopen a lost connection in the background, waiting for the backoff delay before every attempt.
+        """
+        while not self.is_open:
+            await asyncio.sleep(self.breaker.retry_in)
+            await self.open()
+        self._reconnect_task = None
+
+    def _connection_lost(self, reason: str) -> None:
+        if self._writer:
+            self._writer.close()
+        self._reader = self._writer = None
+        self._fail_pending()
+        self.breaker.record_failure(reason)
+        if self._reconnect_task is None:
+            self._reconnect_task = asyncio.create_task(self._reconnect())
+
+    async def close(self) -> None:
+        """
+        Close the connection and fail every request that is still waiting for a response.
+        """
+        for task in (self._reconnect_task, self._opening):
+            if task and not task.done():
+                task.cancel()
+        self._reconnect_task = self._opening = None
+        if self._receive_task:
+            self._receive_task.cancel()
+            self._receive_task = None
+        if self._writer:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+        self._reader = self._writer = None
+        self._fail_pending()
+
+    def _fail_pending(self) -> None:
+        for future in self._pending.values():
+            if not future.done():
+                future.set_result(None)
+        self._pending.clear()
+
+    def _next_transaction_id(self) -> int:
+        self._transaction_id = (self._transaction_id + 1) & 0xFFFF
+        while self._transaction_id in self._pending: # skip ids that are still in flight after a wrap around
+            self._transaction_id = (self._transaction_id + 1) & 0xFFFF
+        return self._transaction_id
+
+    async def _receive_loop(self) -> None:
+        """
+        Read responses from the socket and resolve the future of the matching transaction id.
+        """
+        try:
+            while True:
+                header = await self._reader.readexactly(MBAP_HEADER.size)
+                transaction_id, _, length, _ = MBAP_HEADER.unpack(header)
+                pdu = await self._reader.readexactly(length - 1)
+                future = self._pending.pop(transaction_id, None)
+                if future is None or future.done(): # response to a request that already timed out
+                    continue
+                future.set_result((pdu, time.monotonic_ns())) # receive time of the response at the socket
+        except asyncio.IncompleteReadError:
+            reason = "closed by the server"
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            reason = e
+        self._receive_task = None
+        self._connection_lost(reason)
+
+    async def read_holding_registers(self, register_address: int, number_of_registers: int, unit_id: int | None = None) -> list | None:
+        """
+        Read holding registers (function code 3, Hex 0x03) without blocking the event loop.
+
+        Args:
+        -----
+        register_address(int): The Starting address of the register to read from.
+        number_of_registers(int): The number of registers to read (max 125).
+        unit_id(int, optional): The device id, defaults to the client unit id.
+
+        Returns:
+        --------
+        list | None: The register values, or None if the read failed (same contract as pyModbusTCP).
+        """
+        values, _ = await self.read_holding_registers_timed(register_address, number_of_registers, unit_id)
+        return values
+
+    async def read_holding_registers_timed(self, register_address: int, number_of_registers: int, unit_id: int | None = None) -> tuple:
+        """
+        Same as read_holding_registers(), with the time.monotonic_ns() the response was received at the socket.
+
+        Returns:
+        --------
+        tuple: (register values or None, receive time in monotonic nanoseconds or 0)
+        """
+        if not 1 <= number_of_registers <= MAX_REGISTERS_PER_READ:
+            logger.error("Invalid number of registers %d, must be between 1 and %d", number_of_registers, MAX_REGISTERS_PER_READ)
+            return None, 0
+        if not self.is_open and not await self.open():
+            CONNECTION_ERRORS.inc()
+            return None, 0
+        unit_id = self.unit_id if unit_id is None else unit_id
+        transaction_id = self._next_transaction_id()
+        pdu = READ_HOLDING_REGISTERS_REQUEST.pack(READ_HOLDING_REGISTERS, register_address, number_of_registers)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[transaction_id] = future
+        started = time.perf_counter()
+        self._writer.write(MBAP_HEADER.pack(transaction_id, 0, len(pdu) + 1, unit_id) + pdu)
+        try:
+            response = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self._pending.pop(transaction_id, None)
+            REQUEST_TIMEOUTS.inc()
+            logger.error("Timeout reading %d registers at %d from unit %d", number_of_registers, register_address, unit_id)
+            self._timeouts += 1
+            if self._timeouts >= self.breaker.failure_threshold and self._receive_task: # the connection is open but dead
+                self._receive_task.cancel()
+                self._receive_task = None
+                self._connection_lost(f"{self._timeouts} consecutive timeouts")
+            return None, 0
+        if not response: # the connection was lost while waiting
+            CONNECTION_ERRORS.inc()
+            return None, 0
+        response, received_ns = response
+        self._timeouts = 0
+        REQUEST_SECONDS.observe(time.perf_counter() - started)
+        if response[0] & 0x80: # exception response
+            REQUEST_EXCEPTIONS.inc()
+            logger.error("Modbus exception code %d reading registers at %d from unit %d", response[1], register_address, unit_id)
+            return None, 0
+        byte_count = response[1]
+        if byte_count != 2 * number_of_registers:
+            logger.error("Unexpected Modbus response length %d for %d registers", byte_count, number_of_registers)
+            return None, 0
+        return list(struct.unpack(f">{number_of_registers}H", response[2:2 + byte_count])), received_ns
@@ -0,0 +1,105 @@
+"""
+Capture files of the raw device traffic, recorded by the gateway and fed back through the pipeline by Replay.py.
+
+File layout: the magic b"GWCAP1\\n" followed by records of
+    header:  timestamp (float64 epoch seconds), kind (uint8), payload length (uint32), little endian
+    payload: source length (uint8) + utf-8 source, then
+             NMEA:   the bytes as received from the stream (sentences may be cut anywhere)
+             MODBUS: unit id (uint8), start address (uint16), register values (uint16 each)
+             SESSION: nothing, the source is empty
+
+The source is "host:port" of the stream or Modbus server, so several devices can share one capture. Every gateway
+start appends a SESSION record, so the runs recorded into the same file can be told apart (the time between two runs
+is not part of the recording and the streams of a run do not continue in the next one).
+"""
+import asyncio
+import struct
+import threading
+import time
+
+MAGIC = b"GWCAP1\n"
+RECORD_HEADER = struct.Struct("<dBI")
+MODBUS_HEADER = struct.Struct("<BH")
+NMEA, MODBUS, SESSION = 1, 2, 3
+
+
+class CaptureWriter:
+    """
+    Appends records to a capture file through a large write buffer, so recording costs a memory copy on the hot
+    path. The buffer is written when it is full and on flush()/close().
+
+    Attributes:
+    - path(str): Path of the capture file, an existing capture is appended to after a SESSION record.
+    """
+    def __init__(self, path: str, buffer_size: int = 1024 * 1024) -> None:
+        self.path = path
+        self._file = open(path, "ab", buffering=buffer_size)
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        self._lock = threading.Lock()
+        self.records = 0
+        self._write(SESSION, "", b"", None)
+
+    def _write(self, kind: int, source: str, payload: bytes, timestamp: float | None) -> None:
+        source = source.encode()[:255]
+        body = bytes((len(source),)) + source + payload
+        with self._lock:
+            if self._file.closed: # recorders still running while the gateway shuts down
+                return
+            self._file.write(RECORD_HEADER.pack(time.time() if timestamp is None else timestamp, kind, len(body)) + body)
+            self.records += 1
+
+    def write_nmea(self, source: str, data: bytes, timestamp: float | None = None) -> None:
+        self._write(NMEA, source, data, timestamp)
+
+    def write_modbus(self, source: str, unit_id: int, start: int, values: list, timestamp: float | None = None) -> None:
+        self._write(MODBUS, source, MODBUS_HEADER.pack(unit_id, start) + struct.pack(f"<{len(values)}H", *values), timestamp)
+
+    def flush(self) -> None:
+        with self._lock:
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+    async def run(self, interval: float = 5.0) -> None:
+        """
+        Write the buffered records to disk every interval on a worker thread, closes the file when cancelled.
+        """
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                await asyncio.to_thread(self.flush)
+        finally:
+            self.close()
+
+
+def read_capture(path: str):
+    """
+    A generator over the records of a capture file, a record cut off at the end of the file is ignored.
+
+    Yields:
+    -------
+    tuple: (timestamp, NMEA, source, data), (timestamp, MODBUS, source, (unit id, start address, values)) or
+    (timestamp, SESSION, "", b"") at the start of every recorded run
+    """
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"'{path}' is not a gateway capture file")
+        while True:
+            header = file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            timestamp, kind, length = RECORD_HEADER.unpack(header)
+            body = file.read(length)
+            if len(body) < length:
+                return
+            source = body[1:1 + body[0]].decode()
+            payload = body[1 + body[0]:]
+            if kind == MODBUS:
+                unit_id, start = MODBUS_HEADER.unpack_from(payload)
+                values = list(struct.unpack_from(f"<{(len(payload) - MODBUS_HEADER.size) // 2}H", payload, MODBUS_HEADER.size))
+                yield timestamp, kind, source, (unit_id, start, values)
+            else:
+                yield timestamp, kind, source, payload
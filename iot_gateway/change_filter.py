@@ -0,0 +1,105 @@
+import numpy as np
+from utils import metrics
+
+
+class DeadbandFilter:
+    """
+    Columnar change detection (deadband + heartbeat) for many sensors at once.
+
+    Every registered sensor gets a row in NumPy arrays holding its threshold, heartbeat, last sent value and last
+    sent time. A whole batch of readings is evaluated with a few array operations instead of comparing reading
+    objects one by one. A reading is sent when:
+    - the sensor has never been sent, or
+    - the value changed more than the threshold since the last sent value, or
+    - the heartbeat time elapsed since the last sent reading.
+
+    Attributes:
+    - capacity(int): Initial number of sensor rows, the arrays grow when more sensors are registered.
+    - name(str): Label of the pass/drop counters of this filter in the metrics.
+    """
+    def __init__(self, capacity: int = 16, name: str = "default") -> None:
+        self.sensors: dict[str, int] = {}
+        self.passed = metrics.counter("gateway_filter_readings_total", "Readings evaluated by the change filter", filter=name, result="passed")
+        self.dropped = metrics.counter("gateway_filter_readings_total", "Readings evaluated by the change filter", filter=name, result="dropped")
+        self.threshold = np.zeros(capacity)
+        self.heartbeat = np.zeros(capacity)
+        self.last_value = np.zeros(capacity)
+        self.last_time = np.zeros(capacity)
+        self.has_value = np.zeros(capacity, dtype=bool)
+
+    def _grow(self) -> None:
+        capacity = 2 * len(self.threshold)
+        for name in ("threshold", "heartbeat", "last_value", "last_time", "has_value"):
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:len(column)] = column
+            setattr(self, name, grown)
+
+    def register(self, sensor: str, threshold: float, heartbeat: float) -> int:
+        """
+        Add a sensor (or update its limits) and return its row index.
+
+        Args:
+        -----
+        sensor(str): Sensor name
+        threshold(float): Minimum change since the last sent value that triggers a send
+        heartbeat(float): Seconds after which a reading is sent even if it did not change
+
+        Returns:
+        --------
+        int: Row index to use with evaluate()
+        """
+        index = self.sensors.get(sensor)
+        if index is None:
+            index = len(self.sensors)
+            if index == len(self.threshold):
+                self._grow()
+            self.sensors[sensor] = index
+        self.threshold[index] = threshold
+        self.heartbeat[index] = heartbeat
+        return index
+
+    def evaluate(self, indices, values, timestamps) -> np.ndarray:
+        """
+        Decide which readings of a batch should be sent and remember them as the last sent readings.
+
+        Readings of the same sensor inside one batch are evaluated in order, so each is compared with the
+        reading sent right before it.
+
+        Args:
+        -----
+        indices(array-like): Sensor row index of each reading
+        values(array-like): Reading values
+        timestamps(array-like): Reading times as epoch seconds
+
+        Returns:
+        --------
+        np.ndarray: Boolean send mask with one entry per reading
+        """
+        indices = np.asarray(indices, dtype=np.intp)
+        values = np.asarray(values, dtype=np.float64)
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        if len(np.unique(indices)) == len(indices): # common case, every sensor appears once
+            return self._evaluate_unique(indices, values, timestamps)
+        order = np.argsort(indices, kind="stable")
+        sorted_indices = indices[order]
+        group_start = np.r_[0, np.flatnonzero(np.diff(sorted_indices)) + 1]
+        rank = np.empty(len(indices), dtype=np.intp)
+        rank[order] = np.arange(len(indices)) - np.repeat(group_start, np.diff(np.r_[group_start, len(indices)]))
+        mask = np.zeros(len(indices), dtype=bool)
+        for occurrence in range(rank.max() + 1): # one pass per repeated reading of the same sensor
+            selected = np.flatnonzero(rank == occurrence)
+            mask[selected] = self._evaluate_unique(indices[selected], values[selected], timestamps[selected])
+        return mask
+
+    def _evaluate_unique(self, indices: np.ndarray, values: np.ndarray, timestamps: np.ndarray) -> np.ndarray:
+        changed = np.abs(values - self.last_value[indices]) > self.threshold[indices]
+        expired = timestamps - self.last_time[indices] >= self.heartbeat[indices]
+        mask = changed | expired | ~self.has_value[indices]
+        sent = indices[mask]
+        self.last_value[sent] = values[mask]
+        self.last_time[sent] = timestamps[mask]
+        self.has_value[sent] = True
+        self.passed.inc(len(sent))
+        self.dropped.inc(len(mask) - len(sent))
+        return mask
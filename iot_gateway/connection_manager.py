@@ -0,0 +1,146 @@
+"""
+Connection lifecycle shared by the Modbus, NMEA and MQTT clients.
+
+- Backoff: exponential reconnect delays with jitter, so many clients of a restarted device do not reconnect in
+  lockstep.
+- CircuitBreaker: stops connection attempts to an endpoint that keeps failing and lets one probe through when its
+  backoff delay is over. Callers fail fast while the circuit is open instead of waiting for a connect timeout, and
+  only the state changes are logged, so a dead device does not flood the log or the network.
+- ConnectionPool: one shared client per endpoint (eg. every Modbus unit behind the same host and port), closed when
+  its last user releases it.
+"""
+import random
+import time
+from utils.logger import get_logger
+from utils import metrics
+from configs import config
+
+logger = get_logger("connection_logger", file_name='logs/connections.log')
+
+
+class Backoff:
+    """
+    Exponential backoff with "equal jitter": the n-th delay is drawn between half and all of
+    min(maximum, initial * multiplier ** n).
+
+    Attributes:
+    - initial(float): First delay in seconds.
+    - maximum(float): Upper bound of the delay in seconds.
+    - multiplier(float): Growth of the delay per attempt.
+    """
+    def __init__(self, initial: float = config.RECONNECT_MIN_DELAY, maximum: float = config.RECONNECT_MAX_DELAY,
+                 multiplier: float = 2.0) -> None:
+        self.initial = initial
+        self.maximum = maximum
+        self.multiplier = multiplier
+        self.attempts = 0
+
+    def next_delay(self) -> float:
+        ceiling = min(self.maximum, self.initial * self.multiplier ** self.attempts)
+        self.attempts += 1
+        return random.uniform(ceiling / 2, ceiling)
+
+    def reset(self) -> None:
+        self.attempts = 0
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of one endpoint.
+
+    closed: attempts are allowed. Every failure schedules the next background retry after a backoff delay, and after
+    `failure_threshold` consecutive failures the circuit opens.
+    open: attempts are refused until the backoff delay is over, then the circuit is half open.
+    half-open: one attempt (the probe) is allowed, its success closes the circuit, its failure opens it again with a
+    longer delay.
+
+    Attributes:
+    - name(str): Endpoint name used in the log and the metrics, eg. "modbus 10.0.0.5:502".
+    - failure_threshold(int): Consecutive failures that open the circuit.
+    - backoff(Backoff): Delays between attempts.
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+    def __init__(self, name: str, failure_threshold: int = config.CIRCUIT_FAILURE_THRESHOLD,
+                 backoff: Backoff | None = None) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.backoff = backoff or Backoff()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.retry_at = 0.0 # time.monotonic() of the next allowed attempt
+        self.failed = metrics.counter("gateway_connection_failures_total", "Failed connection attempts and lost connections", endpoint=name)
+        metrics.gauge("gateway_circuit_open", "1 while the circuit breaker of the endpoint refuses connection attempts",
+                      endpoint=name).set_function(lambda: int(self.state != self.CLOSED))
+
+    @property
+    def retry_in(self) -> float:
+        """
+        Seconds until the next attempt is allowed, background reconnect loops sleep this long after a failure.
+        """
+        return max(0.0, self.retry_at - time.monotonic())
+
+    def allow(self) -> bool:
+        """
+        Returns:
+        --------
+        bool: True if a connection attempt may be made now.
+        """
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() >= self.retry_at:
+            self.state = self.HALF_OPEN
+            return True
+        return False
+
+    def record_success(self) -> None:
+        if self.state != self.CLOSED:
+            logger.info("%s: connection restored after %d failed attempts", self.name, self.failures)
+        self.state = self.CLOSED
+        self.failures = 0
+        self.backoff.reset()
+
+    def record_failure(self, reason: object = None) -> None:
+        self.failures += 1
+        self.failed.inc()
+        delay = self.backoff.next_delay()
+        self.retry_at = time.monotonic() + delay
+        if self.state == self.HALF_OPEN:
+            self.state = self.OPEN
+            logger.debug("%s: probe failed (%s), next attempt in %.1fs", self.name, reason, delay)
+        elif self.state == self.CLOSED and self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            logger.warning("%s: %d connection attempts failed (%s), retrying with backoff up to %ss",
+                           self.name, self.failures, reason, self.backoff.maximum)
+        elif self.state == self.CLOSED:
+            logger.info("%s: connection failed (%s), retrying in %.1fs", self.name, reason, delay)
+
+
+class ConnectionPool:
+    """
+    Shares one client per endpoint between its users.
+
+    acquire() returns the client of the key and creates it with the factory for the first user, release() closes it
+    when the last user is gone. The client has to provide an async close().
+    """
+    def __init__(self) -> None:
+        self._clients: dict = {} # key -> [client, users]
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    def acquire(self, key, factory):
+        entry = self._clients.get(key)
+        if entry is None:
+            entry = self._clients[key] = [factory(), 0]
+        entry[1] += 1
+        return entry[0]
+
+    async def release(self, key) -> None:
+        entry = self._clients.get(key)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del self._clients[key]
+            await entry[0].close()
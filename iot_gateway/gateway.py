@@ -0,0 +1,230 @@
+"""
+The gateway application: the clients, the publisher and the background services of Main.py in one object.
+
+Nothing is connected or opened when the module is imported. Every component is built on first use
+(functools.cached_property), so a tool that only needs the publisher or a benchmark that patches the configuration
+does not pay for the rest. Gateway.run() opens the broker and Modbus connections in parallel with the NMEA stream
+and only lets the pollers publish once the broker is connected (or STARTUP_CONNECT_TIMEOUT has passed), so the first
+readings are sent right away instead of going through the outbound queue.
+"""
+import asyncio
+import functools
+import sys
+import time
+from configs import config
+from utils import metrics
+from utils.logger import get_logger
+from utils.clock import CLOCK
+from .sensor_registry import REGISTRY
+
+logger = get_logger("iot_gatway_logger", file_name='logs/iot_gatway.log')
+
+STARTUP_SECONDS = metrics.gauge("gateway_startup_seconds", "Time from creating the gateway until the broker and Modbus connections were up")
+FIRST_PUBLISH_SECONDS = metrics.gauge("gateway_first_publish_seconds", "Time from creating the gateway until the first reading was published")
+
+
+class Gateway:
+    """
+    The single process IoT gateway.
+
+    Attributes:
+    - created(float): time.monotonic() when the gateway was created, the startup metrics are measured from here.
+    - last_publish(float): time.monotonic() of the last reading handed to the connected broker, watched by
+      calculate_timeout(). Readings kept in the outbound queue while the broker is offline do not count.
+    """
+    def __init__(self) -> None:
+        self.created = time.monotonic()
+        self.last_publish = self.created
+        self.first_publish: float | None = None
+        self._ready: asyncio.Event | None = None # set by start(), created on the running loop
+
+    #-------------components-----------------
+    @functools.cached_property
+    def modbus_client(self):
+        from .modubs_tcp import ModbusClientHandler
+        client = ModbusClientHandler(host=config.MODBUS_HOST, port=config.MODUBS_PORT, unit_id=config.MODBUS_UNIT_ID, use_asyncio=True)
+        client.capture = self.capture
+        return client
+
+    @functools.cached_property
+    def nmea_client(self):
+        from .nmea_client import NmeaHandler
+        client = NmeaHandler(config.NMEA_PORT, config.NMEA_HOST, send_valid_data=True, use_asyncio=True,
+                             sentence_types=config.NMEA_SENTENCE_TYPES)
+        client.capture = self.capture
+        return client
+
+    @functools.cached_property
+    def outbound_queue(self):
+        from .outbound_queue import OutboundQueue
+        return OutboundQueue(path=config.OFFLINE_QUEUE_PATH, max_bytes=config.OFFLINE_QUEUE_MAX_BYTES,
+                             max_age=config.OFFLINE_QUEUE_MAX_AGE * 3600)
+
+    @functools.cached_property
+    def publisher(self):
+        from .mqtt_publisher import MQTTPublisher
+        return MQTTPublisher(host=config.MQTT_BROKER_HOST, port=config.MQTT_BROKER_PORT,
+                             username=config.MQTT_BROKER_USERNAME, password=config.MQTT_BROKER_PASSWORD,
+                             outbound_queue=self.outbound_queue)
+
+    @functools.cached_property
+    def aggregator(self):
+        from .aggregation import WindowAggregator
+        return WindowAggregator()
+
+    @functools.cached_property
+    def history_store(self):
+        if not config.HISTORY_STORE_PATH:
+            return None
+        from .history_store import HistoryStore
+        return HistoryStore()
+
+    @functools.cached_property
+    def capture(self):
+        if not config.CAPTURE_PATH:
+            return None
+        from .capture import CaptureWriter
+        return CaptureWriter(config.CAPTURE_PATH)
+
+    @functools.cached_property
+    def metrics_server(self):
+        from utils.metrics import MetricsServer
+        return MetricsServer(host=config.METRICS_HOST, port=config.METRICS_PORT)
+
+    #----------startup-----------
+    async def start(self, timeout: float = config.STARTUP_CONNECT_TIMEOUT) -> bool:
+        """
+        Connect to the MQTT broker and open the Modbus connection in parallel, waiting at most timeout seconds.
+        The pollers are released afterwards even if a connection is not up yet, the publisher then queues the
+        readings and the clients keep reconnecting in the background.
+
+        Returns:
+        --------
+        bool: True if both connections are up
+        """
+        try:
+            broker, modbus = await asyncio.gather(self.publisher.wait_connected(timeout),
+                                                  asyncio.wait_for(self.modbus_client.cnx.open(), timeout),
+                                                  return_exceptions=True)
+        finally:
+            self._ready.set()
+        elapsed = time.monotonic() - self.created
+        STARTUP_SECONDS.set(elapsed)
+        if broker is True and modbus is True:
+            logger.info("Gateway started in %.3f s", elapsed)
+            return True
+        logger.warning("Gateway started in %.3f s without %s", elapsed,
+                       " and ".join(name for name, result in (("the MQTT broker", broker), ("Modbus", modbus)) if result is not True))
+        return False
+
+    async def _publish(self, reading) -> None:
+        if not self._ready.is_set():
+            await self._ready.wait()
+        if await self.publisher.publish_async(reading):
+            self.last_publish = time.monotonic()
+            if self.first_publish is None:
+                self.first_publish = self.last_publish - self.created
+                FIRST_PUBLISH_SECONDS.set(self.first_publish)
+                logger.info("First reading published %.3f s after start", self.first_publish)
+
+    #----------polling loops-----------
+    async def poll_temerature_sensors(self):
+        """
+        Polls the temperature sensors via Modbus and publishes the valid data to the Mqtt broker.
+        """
+        while True:
+            try:
+                async for readings in self.modbus_client.poll_registers(): # poll intervals come from the sensor registry
+                    self.aggregator.extend(readings)
+                    if self.history_store:
+                        self.history_store.extend(readings)
+                    for reading in readings:
+                        if reading:
+                            await self._publish(reading)
+            except Exception as e:
+                error_message = "Error in reading temerature sensors, please check modbus protocol logs"
+                print(error_message)
+                logger.error("%s: %s", error_message, e)
+                await asyncio.sleep(2)
+
+    async def poll_rot_sensor(self):
+        """
+        Streams the ROT sensor data via NMEA and publishes the valid data to the Mqtt broker.
+        """
+        await self._poll_nmea(self.nmea_client.stream_ROT_readings, "Error in reading ROT sensor, please check NMEA protocol logs")
+
+    async def poll_nmea_datagrams(self, source: dict):
+        """
+        Reads the NMEA datagrams of a NMEA_DATAGRAM_SOURCES entry and publishes the valid data to the Mqtt broker.
+        The TCP stream and all datagram sources share the NMEA handler, so redundant sources are deduplicated.
+        """
+        await self._poll_nmea(lambda: self.nmea_client.stream_datagrams(source["port"], source.get("group"), source.get("interface", "0.0.0.0")),
+                              f"Error in reading NMEA datagrams on port {source['port']}, please check NMEA protocol logs")
+
+    async def _poll_nmea(self, stream, error_message: str):
+        while True:
+            try:
+                async for reading in stream():
+                    if reading:
+                        self.aggregator.add(reading)
+                        if self.history_store:
+                            self.history_store.append(reading)
+                        await self._publish(reading)
+            except Exception as e:
+                print(error_message)
+                logger.error("%s: %s", error_message, e)
+                await asyncio.sleep(2)
+
+    async def calculate_timeout(self, timeout: int = 60 * config.MAX_ELAPSED_TIME):
+        """
+        Monitors the elapsed time since the last successful data publish and shuts the gateway down if it
+        exceeds the timeout.
+
+        Args:
+        ------
+        timeout(int): Maximum allowed seconds of inactivity
+        """
+        while True:
+            await asyncio.sleep(60)
+            if time.monotonic() - self.last_publish > timeout:
+                logger.error("The mqtt publisher has not recieved data for %s minutes, so the connection will be closed.", timeout/60)
+                sys.exit(1)
+
+    async def _optional(self, name: str, coroutine) -> None:
+        """
+        Run a background service that the data path does not depend on, a failure is logged and ends only this
+        service instead of cancelling the pollers gathered with it.
+        """
+        try:
+            await coroutine
+        except Exception as e:
+            logger.exception("The %s stopped, the gateway keeps running without it: %s", name, e)
+
+    async def run(self) -> None:
+        """
+        Start the connections and run all polling and background tasks until cancelled.
+
+        The observability and maintenance services (metrics, summaries, history, capture, registry reload, clock
+        discipline) run supervised, see _optional().
+        """
+        logger.info("Starting iot_gatway......")
+        self._ready = asyncio.Event()
+        tasks = [self.start(),
+                 self.poll_rot_sensor(),
+                 self.poll_temerature_sensors(),
+                 *(self.poll_nmea_datagrams(source) for source in config.NMEA_DATAGRAM_SOURCES),
+                 self.publisher.replay_outbound_queue(),
+                 self.publisher.flush_batches(),
+                 self.calculate_timeout(),
+                 self._optional("metrics publisher", self.publisher.publish_metrics()),
+                 self._optional("summary publisher", self.publisher.publish_summaries(self.aggregator)),
+                 self._optional("sensor registry watcher", REGISTRY.watch()),
+                 self._optional("clock discipline", CLOCK.discipline())]
+        if self.history_store:
+            tasks += [self._optional("history store", self.history_store.run()),
+                      self._optional("history query service", self.publisher.serve_history(self.history_store))]
+        if self.capture:
+            tasks.append(self._optional("capture writer", self.capture.run()))
+        if config.METRICS_PORT is not None:
+            tasks.append(self._optional("metrics endpoint", self.metrics_server.serve()))
+        await asyncio.gather(*tasks)
@@ -0,0 +1,254 @@
+"""
+Embedded append-only time series store for the readings of every sensor.
+
+Layout: <root>/<sensor>/<first timestamp>.seg, one directory per sensor and segment files of packed
+(timestamp float64, value float64, valid bool) records (HISTORY_DTYPE, 17 bytes each). A segment holds up to
+`segment_records` readings in time order, a reading older than the end of the open segment starts a new one.
+
+The time index is the sorted list of segments with their first and last timestamp per sensor, kept in memory and
+rebuilt from the files on start. A query memory-maps only the segments that overlap the requested range and
+finds the range inside them by binary search on the timestamp column.
+
+Writes are collected in memory and appended by flush() with one write per sensor, HistoryStore.run() flushes every
+HISTORY_STORE_FLUSH_INTERVAL seconds on a worker thread so the polling loops only pay for a list append.
+"""
+import asyncio
+import hashlib
+import re
+import threading
+import time
+import numpy as np
+import os
+from utils.logger import get_logger
+from configs import config
+from .readings import Reading
+
+logger = get_logger("history_logger", file_name='logs/history_store.log')
+
+SEGMENT_SUFFIX = ".seg"
+HISTORY_DTYPE = np.dtype([("timestamp", "f8"), ("value", "f8"), ("valid", "?")]) # 17 bytes per reading
+
+
+def sensor_directory(sensor: str) -> str:
+    """
+    File system safe directory name of a sensor, eg. "Luffing motor 1 temperature (PS Winch)" ->
+    "Luffing_motor_1_temperature_PS_Winch-<hash>". The short hash of the raw name keeps names that only differ in
+    replaced characters (eg. "TI:ROT" and "TI ROT") apart.
+    """
+    safe = re.sub(r"[^A-Za-z0-9.-]+", "_", sensor).strip("_") or "_"
+    return f"{safe}-{hashlib.blake2s(sensor.encode(), digest_size=4).hexdigest()}"
+
+
+def history_name(reading: Reading) -> str:
+    """
+    Name a reading is stored and queried under: "<source>:<sensor>" for readings with a source (the NMEA talker id,
+    eg. "HE:ROT" and "TI:ROT" of two gyros), so redundant instruments keep separate series, else the sensor name.
+    """
+    source, sensor = reading.source, reading.sensor
+    if not source or sensor.startswith(source + ":"): # the registry already names the talker
+        return sensor
+    return f"{source}:{sensor}"
+
+
+class Segment:
+    """
+    One segment file of a sensor.
+
+    Attributes:
+    - path(str): Path of the file.
+    - first(float): Timestamp of the first record.
+    - last(float): Timestamp of the last record.
+    - count(int): Number of records.
+    """
+    __slots__ = ("path", "first", "last", "count")
+
+    def __init__(self, path: str, first: float, last: float, count: int) -> None:
+        self.path = path
+        self.first = first
+        self.last = last
+        self.count = count
+
+    @classmethod
+    def open(cls, path: str):
+        """
+        Index an existing segment file, a record cut off by a crash at the end of the file is removed.
+        """
+        size = os.path.getsize(path)
+        count, torn = divmod(size, HISTORY_DTYPE.itemsize)
+        if torn:
+            with open(path, "r+b") as file:
+                file.truncate(count * HISTORY_DTYPE.itemsize)
+        if not count:
+            return None
+        records = np.memmap(path, dtype=HISTORY_DTYPE, mode="r", shape=(count,))
+        return cls(path, float(records["timestamp"][0]), float(records["timestamp"][-1]), count)
+
+    def read(self, start: float, end: float) -> np.ndarray:
+        """
+        Returns:
+        --------
+        np.ndarray: Copy of the records with start <= timestamp < end
+        """
+        records = np.memmap(self.path, dtype=HISTORY_DTYPE, mode="r", shape=(self.count,))
+        timestamps = records["timestamp"]
+        low, high = np.searchsorted(timestamps, start, "left"), np.searchsorted(timestamps, end, "left")
+        return np.array(records[low:high])
+
+
+class HistoryStore:
+    """
+    Per sensor history on disk with range and downsampled queries.
+
+    Attributes:
+    - root(str): Directory of the store.
+    - segment_records(int): Records per segment file.
+    - max_age(float): Seconds of history kept, older segments are deleted on flush (0 keeps everything).
+    """
+    def __init__(self, root: str = config.HISTORY_STORE_PATH, segment_records: int = config.HISTORY_STORE_SEGMENT_RECORDS,
+                 max_age: float = config.HISTORY_STORE_MAX_AGE * 86400) -> None:
+        self.root = root
+        self.segment_records = segment_records
+        self.max_age = max_age
+        self._segments: dict[str, list] = {} # sensor directory -> segments sorted by first timestamp
+        self._sensors: dict[str, str] = {} # sensor -> directory
+        self._pending: dict[str, list] = {} # sensor -> [(timestamp, value, valid)]
+        self._lock = threading.Lock() # appends come from the event loop, flushes from a worker thread
+        self._write_lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        for directory in sorted(os.listdir(root)):
+            path = os.path.join(root, directory)
+            if not os.path.isdir(path):
+                continue
+            segments = [Segment.open(os.path.join(path, name)) for name in os.listdir(path) if name.endswith(SEGMENT_SUFFIX)]
+            self._segments[directory] = sorted((segment for segment in segments if segment), key=lambda segment: segment.first)
+        logger.info("History store '%s' opened with %d sensors", root, len(self._segments))
+
+    def _directory(self, sensor: str) -> str:
+        directory = self._sensors.get(sensor)
+        if directory is None:
+            directory = self._sensors[sensor] = sensor_directory(sensor)
+        return directory
+
+    def append(self, reading: Reading) -> None:
+        """
+        Queue a reading for the next flush.
+        """
+        with self._lock:
+            self._pending.setdefault(history_name(reading), []).append((reading.timestamp, reading.value, reading.is_valid))
+
+    def extend(self, readings: list) -> None:
+        with self._lock:
+            for reading in readings:
+                if reading:
+                    self._pending.setdefault(history_name(reading), []).append((reading.timestamp, reading.value, reading.is_valid))
+
+    def flush(self) -> None:
+        """
+        Append the queued readings to the segment files, one write per segment.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        with self._write_lock:
+            for sensor, rows in pending.items():
+                try:
+                    self._write(self._directory(sensor), np.array(rows, dtype=HISTORY_DTYPE))
+                except OSError as e:
+                    logger.error("Unable to write %d readings of '%s' to the history store: %s", len(rows), sensor, e)
+            if self.max_age:
+                self._expire(time.time() - self.max_age)
+
+    def _write(self, directory: str, records: np.ndarray) -> None:
+        segments = self._segments.setdefault(directory, [])
+        while len(records):
+            segment = segments[-1] if segments else None
+            if segment is None or segment.count >= self.segment_records or records["timestamp"][0] < segment.last:
+                os.makedirs(os.path.join(self.root, directory), exist_ok=True)
+                path = os.path.join(self.root, directory, f"{records['timestamp'][0]:.6f}{SEGMENT_SUFFIX}")
+                suffix = 0
+                while os.path.exists(path): # out of order readings can start two segments at the same time
+                    suffix += 1
+                    path = os.path.join(self.root, directory, f"{records['timestamp'][0]:.6f}-{suffix}{SEGMENT_SUFFIX}")
+                segment = Segment(path, float(records["timestamp"][0]), float(records["timestamp"][0]), 0)
+                segments.append(segment)
+            timestamps = records["timestamp"]
+            room = self.segment_records - segment.count
+            in_order = np.flatnonzero(np.diff(timestamps) < 0) # a reading older than the previous one starts a new segment
+            take = min(room, in_order[0] + 1 if len(in_order) else len(records))
+            with open(segment.path, "ab") as file:
+                file.write(records[:take].tobytes())
+            segment.count += take
+            segment.last = float(timestamps[take - 1])
+            records = records[take:]
+
+    def _expire(self, oldest: float) -> None:
+        for segments in self._segments.values():
+            while len(segments) > 1 and segments[0].last < oldest: # the open segment is never deleted
+                os.remove(segments.pop(0).path)
+
+    async def run(self, interval: float = config.HISTORY_STORE_FLUSH_INTERVAL) -> None:
+        """
+        Flush the queued readings every interval on a worker thread, runs until cancelled.
+        """
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                await asyncio.to_thread(self.flush)
+        finally:
+            self.flush()
+
+    def query(self, sensor: str, start: float, end: float) -> np.ndarray:
+        """
+        Read the readings of a sensor in a time range.
+
+        Args:
+        -----
+        sensor(str): Sensor name, "<talker>:<sensor>" for NMEA readings (see history_name())
+        start(float): Start of the range as epoch seconds (included)
+        end(float): End of the range as epoch seconds (excluded)
+
+        Returns:
+        --------
+        np.ndarray: HISTORY_DTYPE records sorted by timestamp
+        """
+        self.flush()
+        with self._write_lock:
+            segments = self._segments.get(self._directory(sensor), [])
+            parts = [segment.read(start, end) for segment in segments if segment.first < end and segment.last >= start]
+        if not parts:
+            return np.zeros(0, dtype=HISTORY_DTYPE)
+        records = np.concatenate(parts)
+        if len(parts) > 1:
+            records = records[np.argsort(records["timestamp"], kind="stable")]
+        return records
+
+    def downsample(self, sensor: str, start: float, end: float, bucket: float) -> np.ndarray:
+        """
+        Aggregate the valid readings of a range into fixed time buckets.
+
+        Args:
+        -----
+        sensor(str): Sensor name, "<talker>:<sensor>" for NMEA readings (see history_name())
+        start(float): Start of the range as epoch seconds, buckets are aligned to it
+        end(float): End of the range as epoch seconds
+        bucket(float): Bucket length in seconds
+
+        Returns:
+        --------
+        np.ndarray: One record per non empty bucket with the fields timestamp (bucket start), min, max, mean and count
+        """
+        records = self.query(sensor, start, end)
+        records = records[records["valid"]]
+        dtype = np.dtype([("timestamp", "f8"), ("min", "f8"), ("max", "f8"), ("mean", "f8"), ("count", "i8")])
+        if not len(records):
+            return np.zeros(0, dtype=dtype)
+        buckets = ((records["timestamp"] - start) // bucket).astype(np.int64)
+        boundaries = np.r_[0, np.flatnonzero(np.diff(buckets)) + 1] # records are sorted, so buckets are contiguous
+        values = records["value"]
+        counts = np.diff(np.r_[boundaries, len(values)])
+        result = np.zeros(len(boundaries), dtype=dtype)
+        result["timestamp"] = start + buckets[boundaries] * bucket
+        result["min"] = np.minimum.reduceat(values, boundaries)
+        result["max"] = np.maximum.reduceat(values, boundaries)
+        result["mean"] = np.add.reduceat(values, boundaries) / counts
+        result["count"] = counts
+        return result
@@ -0,0 +1,190 @@
+import asyncio
+from utils.logger import get_logger
+from utils import metrics
+from configs import config
+from .async_modbus import AsyncModbusClient, MAX_REGISTERS_PER_READ, CLIENT_POOL
+from .poll_controller import AdaptivePollInterval
+from .register_decoding import RegisterDecoder, register_count
+
+logger = get_logger("modbus_logger", file_name='logs/modbus_client.log')
+
+POLL_LATENESS_SECONDS = metrics.histogram("gateway_modbus_poll_lateness_seconds", "Delay between the scheduled and the actual start of a poll")
+
+
+def coalesce_registers(addresses, max_gap: int = config.MODBUS_MAX_REGISTER_GAP, max_count: int = MAX_REGISTERS_PER_READ,
+                       sizes: dict | None = None) -> list:
+    """
+    Merge register addresses into the fewest (start, count) read requests.
+
+    Two registers end up in the same request when the gap between them is at most max_gap registers (the unused
+    registers in between are read and ignored, which is cheaper than another round trip) and the request stays
+    within max_count registers.
+
+    Args:
+    -----
+    addresses(iterable): Register addresses to read
+    max_gap(int): Maximum number of unused registers allowed between two wanted registers
+    max_count(int): Maximum registers per request (125 for function code 0x03)
+    sizes(dict, optional): Address -> number of registers of values that span several registers (eg. float32), such
+    a value is never split between two requests
+
+    Returns:
+    --------
+    list: (start, count) tuples sorted by start address
+    """
+    blocks = []
+    start = end = None
+    for address in sorted(set(addresses)):
+        last = address + (sizes.get(address, 1) if sizes else 1) - 1
+        if start is not None and address - end - 1 <= max_gap and last - start + 1 <= max_count:
+            end = max(end, last)
+            continue
+        if start is not None:
+            blocks.append((start, end - start + 1))
+        start, end = address, last
+    if start is not None:
+        blocks.append((start, end - start + 1))
+    return blocks
+
+
+class RegisterBlock:
+    """
+    One coalesced read request of a device.
+
+    Attributes:
+    - host(str): The Modbus Server host name.
+    - port(int): The Modbus port.
+    - unit_id(int): The device id.
+    - start(int): First register address.
+    - count(int): Number of registers.
+    - interval(float): Configured poll interval in seconds, the first interval of an adaptive block.
+    - sensors(dict): Register address -> sensor name of the wanted registers in the block.
+    - controller(AdaptivePollInterval, optional): Adapts the interval to the rate of change of the values, None
+      polls at the fixed interval.
+    - registers(list, optional): Decoding descriptors of the wanted registers (see register_decoding), in the order
+      of sensors, plain uint16 registers by default.
+    """
+    def __init__(self, host: str, port: int, unit_id: int, start: int, count: int, interval: float, sensors: dict,
+                 controller: AdaptivePollInterval | None = None, registers: list | None = None) -> None:
+        self.host = host
+        self.port = port
+        self.unit_id = unit_id
+        self.start = start
+        self.count = count
+        self.interval = interval
+        self.sensors = sensors
+        self.controller = controller
+        self.decoder = RegisterDecoder(registers or [{"address": address} for address in sensors], start)
+        self.sensor_ids = None # registry ids of the sensors, resolved by the ModbusClientHandler on the first read
+
+    def next_interval(self, values: list, now: float) -> float:
+        if self.controller is None:
+            return self.interval
+        return self.controller.update(self.decoder.decode(values), now) # the deadbands are in decoded units
+
+    def __repr__(self) -> str:
+        return f"RegisterBlock({self.host}:{self.port} unit {self.unit_id}, registers {self.start}-{self.start + self.count - 1}, every {self.interval}s)"
+
+
+class ModbusPollScheduler:
+    """
+    Polls many Modbus devices from one event loop.
+
+    Registers are grouped per device and poll interval and merged into coalesced read requests. All devices
+    behind the same host and port share one pipelined AsyncModbusClient connection from the CLIENT_POOL. The first poll of every block
+    is spread over its interval so the requests do not all go out at the same time, and polls follow absolute
+    deadlines so the schedule does not drift: a poll that starts late (event loop jitter) does not move the
+    following ones.
+
+    With adaptive polling every block gets an AdaptivePollInterval that shortens the interval while its values move
+    quickly relative to their deadband and lengthens it while they are steady, between the "min_interval" and
+    "max_interval" of the registers (POLL_MIN_INTERVAL and POLL_MAX_INTERVAL by default).
+
+    Attributes:
+    - devices(list): Device descriptions, see SensorRegistry.devices.
+    - timeout(float): Response timeout of the Modbus clients.
+    - adaptive(bool): Adapt the poll intervals to the signal dynamics (default POLL_ADAPTIVE).
+    """
+    def __init__(self, devices: list, timeout: float = 1.0, adaptive: bool = config.POLL_ADAPTIVE) -> None:
+        self.timeout = timeout
+        self.adaptive = adaptive
+        self.blocks = self.build_blocks(devices, adaptive)
+        self.clients: dict[tuple, AsyncModbusClient] = {} # clients taken from the CLIENT_POOL
+        logger.info(f"Modbus scheduler polls {sum(len(block.sensors) for block in self.blocks)} registers with {len(self.blocks)} requests")
+
+    @staticmethod
+    def build_blocks(devices: list, adaptive: bool = False) -> list:
+        """
+        Turn the device descriptions into coalesced register blocks.
+
+        Registers are merged only with registers of the same poll interval and interval bounds.
+        """
+        blocks = []
+        for device in devices:
+            by_interval: dict[tuple, dict] = {}
+            for register in device["registers"]:
+                key = (register["poll_interval"],
+                       register.get("min_interval", config.POLL_MIN_INTERVAL),
+                       register.get("max_interval", config.POLL_MAX_INTERVAL))
+                by_interval.setdefault(key, {})[register["address"]] = register
+            for (interval, min_interval, max_interval), registers in by_interval.items():
+                sizes = {address: register_count(register) for address, register in registers.items()}
+                for start, count in coalesce_registers(registers, sizes=sizes):
+                    block_registers = [register for address, register in registers.items() if start <= address < start + count]
+                    controller = None
+                    if adaptive:
+                        controller = AdaptivePollInterval(interval, min_interval, max_interval,
+                                                          [register.get("deadband", config.MIN_TEMPERATURE_CHANGE) for register in block_registers])
+                    blocks.append(RegisterBlock(device["host"], device["port"], device["unit_id"], start, count, interval,
+                                                {register["address"]: register["sensor"] for register in block_registers},
+                                                controller, block_registers))
+        return blocks
+
+    def get_client(self, block: RegisterBlock) -> AsyncModbusClient:
+        key = (block.host, block.port)
+        if key not in self.clients:
+            self.clients[key] = CLIENT_POOL.acquire(key, lambda: AsyncModbusClient(block.host, block.port, block.unit_id, timeout=self.timeout))
+        return self.clients[key]
+
+    async def _poll_block(self, block: RegisterBlock, phase: float, results: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        client = self.get_client(block)
+        deadline = loop.time() + phase
+        interval = block.interval
+        while True:
+            await asyncio.sleep(max(0, deadline - loop.time()))
+            POLL_LATENESS_SECONDS.observe(max(0.0, loop.time() - deadline))
+            values, received_ns = await client.read_holding_registers_timed(block.start, block.count, unit_id=block.unit_id)
+            if values:
+                await results.put((block, values, received_ns))
+                interval = block.next_interval(values, loop.time())
+            deadline += interval # from the scheduled time, not from now, so the lateness is not carried over
+            if deadline < loop.time(): # a slow read overran the next deadline, skip the missed polls
+                deadline += (loop.time() - deadline) // interval * interval + interval
+
+    async def poll(self):
+        """
+        An async generator that runs the schedule and yields every completed read.
+
+        Yields:
+        -------
+        tuple: (RegisterBlock, register values, time.monotonic_ns() the response was received)
+        """
+        results: asyncio.Queue = asyncio.Queue()
+        by_interval: dict[float, list] = {}
+        for block in self.blocks:
+            by_interval.setdefault(block.interval, []).append(block)
+        tasks = []
+        for interval, blocks in by_interval.items():
+            for position, block in enumerate(blocks): # spread blocks with the same interval evenly over the interval
+                tasks.append(asyncio.create_task(self._poll_block(block, interval * position / len(blocks), results)))
+        try:
+            while True:
+                yield await results.get()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True) # no read is left running on a client that is closed below
+            for key in self.clients:
+                await CLIENT_POOL.release(key)
+            self.clients.clear()
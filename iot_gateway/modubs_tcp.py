@@ -1,12 +1,15 @@
-from pyModbusTCP.client import ModbusClient
+import numpy as np
+import contextlib
 import time
-import sys
-import os
-from datetime import datetime
-SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
-sys.path.append(os.path.dirname(SCRIPT_DIR))
 from utils.logger import get_logger
-from configs import config,mb_registers_mapping
+from utils.clock import CLOCK
+from .async_modbus import AsyncModbusClient, REQUEST_SECONDS, CLIENT_POOL
+from .connection_manager import CircuitBreaker
+from .modbus_scheduler import ModbusPollScheduler
+from .change_filter import DeadbandFilter
+from .readings import Reading
+from .sensor_registry import REGISTRY
+from .register_decoding import RegisterDecoder, register_count
 
 logger = get_logger("modbus_logger", file_name='logs/modbus_client.log')
 iot_logger = get_logger("iot_gatway_logger", file_name='logs/iot_gatway.log')
@@ -20,31 +23,64 @@ class ModbusClientHandler:
     - port(int): The Modbus port.
     - unit_id(int): The device id.
     - layer(str): The communication layer (default=TCP)
+    - use_asyncio(bool): Use the asyncio native client instead of the blocking pyModbusTCP client (default=False)
     """
-    def __init__(self, host: str, port:int, unit_id:int, layer:str="TCP" ):
+    def __init__(self, host: str, port:int, unit_id:int, layer:str="TCP", use_asyncio:bool=False ):
         self.host=host
         self.port = port
         self.layer=layer # Might be used in the future
         self.unit_id = unit_id
-        self.connect() #Automatic attempt to connect
-        self.previous_values = [None]*4
-
-    def connect(self) -> None:
+        self.use_asyncio = use_asyncio
+        if self.use_asyncio: # the pooled client has the circuit breaker of the endpoint
+            self.cnx = CLIENT_POOL.acquire((host, port), lambda: AsyncModbusClient(host=self.host, port=self.port, unit_id=self.unit_id)) # connects lazily on the first read
+        else:
+            self.breaker = CircuitBreaker(f"modbus {host}:{port}")
+            self.connect() #Automatic attempt to connect
+        self.registry = REGISTRY
+        self.filter = DeadbandFilter(name="modbus")
+        self.registry.configure(self.filter) # the filter rows are the sensor ids
+        self._registry_version = self.registry.version
+        self._decoders: dict[tuple, tuple] = {} # (host, port, unit_id, start, count) -> (RegisterDecoder, sensor ids)
+        self._decoders_version = self.registry.devices_version
+        self.capture = None # CaptureWriter recording the register frames for Replay.py
+
+    def connect(self) -> bool:
         """
         A method to establish connection to the Modbus Server
 
+        The client is created once and reopened after a failure, attempts are skipped while the circuit breaker of
+        the server is open.
+
         Returns:
-            None
+            bool: True if the connection is open
+        """
+        if getattr(self, "cnx", None) is None:
+            from pyModbusTCP.client import ModbusClient # only the blocking mode needs it, not imported at startup
+            self.cnx=ModbusClient(host=self.host, port=self.port, unit_id=self.unit_id, timeout=0.1, auto_open=False)
+        if self.cnx.is_open:
+            return True
+        if not self.breaker.allow():
+            return False
+        if not self.cnx.open():
+            self.breaker.record_failure(self.cnx.last_error_as_txt)
+            return False
+        self.breaker.record_success()
+        iot_logger.info(f"Connection to Modbus Server on host '{self.host}' port '{self.port}' is successful")
+        logger.info(f"Connection to Modbus Server on host '{self.host}' port '{self.port}' is successful")
+        return True
+
+    async def close(self) -> None:
         """
-        try:
-            self.cnx=ModbusClient(host=self.host, port=self.port, unit_id=self.unit_id, timeout=0.1)
-            if not self.cnx.open():
-                logger.error("Unable to connect to Modbus Server")
-            else:
-                iot_logger.info(f"Connection to Modbus Server on host '{self.host}' port '{self.port}' is successful")
-                logger.info(f"Connection to Modbus Server on host '{self.host}' port '{self.port}' is successful")
-        except Exception as e:
-            logger.error(f"Error in connecting to Modbus server {e}")
+        A method to close the connection, in asyncio mode the client is given back to the CLIENT_POOL (and closed if
+        no poller uses it anymore). Calling it again does nothing.
+        """
+        cnx, self.cnx = getattr(self, "cnx", None), None
+        if cnx is None:
+            return
+        if self.use_asyncio:
+            await CLIENT_POOL.release((self.host, self.port))
+        else:
+            cnx.close()
 
     def read_registers(self, register_address:int, number_of_registers:int) -> None:
         """
@@ -57,10 +93,17 @@ class ModbusClientHandler:
             None
         """
 
+        if not self.connect():
+            self.values=None
+            return
+        started=time.perf_counter()
         self.values=self.cnx.read_holding_registers(register_address, number_of_registers) #function code 3 (Read Multiple Holding Register) Hex0x03
-        if not self.values: # in case connection was lost during reading process
-            self.connect()
+        self.received_ns=time.monotonic_ns()
+        if not self.values: # in case connection was lost during reading process, it is reopened by the next read
+            self.cnx.close()
+            self.breaker.record_failure(self.cnx.last_error_as_txt)
             return
+        REQUEST_SECONDS.observe(time.perf_counter()-started)
     
     def parse_readings(self) -> None:
         """
@@ -70,72 +113,108 @@ class ModbusClientHandler:
             None
         """
         if not self.values:
-            self.connect() # in case connection was lost during parsing process
             return
-        datapoints=[]
-        for index, value in enumerate(self.values):
-            sensor_name=mb_registers_mapping.mapping.get(index, "Unknown Sensor")
-            previous_value=self.previous_values[index]
-            datapoint = Datapoint(sensor_name, value, previous_value)
-            self.previous_values[index] = datapoint
-            datapoints.append(datapoint)
-        return datapoints
+        decoder, sensor_ids=self.decoder_for(self.host, self.port, self.unit_id, 0, len(self.values)) # values are read from address 0
+        return self.evaluate_registers(sensor_ids, decoder.decode(self.values), CLOCK.to_epoch_ns(self.received_ns), self.received_ns)
+
     def read_temperature_sensor(self):
         self.read_registers(0,4)
         return self.parse_readings()
-   
 
-
-class Datapoint:
-    """
-    A helper class the represents a single sensor reading and its previous value
-    
-    Attributes:
-    
-    - sensor(str): the name of the sensor
-    - value(float): The current value of the sensor reading.
-    - previous_datapoint(Datapoint): The previous datapoint object for comparison.
-    - send_point(bool): A flag if the data point meets the criteria to be sent to the broker.
-    - timestamp(datetime): The timestamp of the current reading.
-
-    """
-    def __init__(self, sensor:str, value:float, previous_datapoint)->None:
+    async def read_registers_async(self, register_address:int, number_of_registers:int) -> None:
         """
-        Initialize a Datapoint object
+        A Method to read Modbus registers without blocking the event loop (requires use_asyncio=True)
 
         Attributes:
-        - sensor(str): Sensor name
-        - value(float): Sensor reading value
-        - previous_datapoint(Datapoint): previous datapoint object
-        
+        - register_address(int): The Starting address of the register to read from.
+        - number_of_registers(int): The number of registers to read.
+        Returns:
+            None
         """
-        self.sensor = sensor
-        self.value = value
-        self.previous_datapoint:Datapoint=previous_datapoint
-        self.changed = True  
-        self.send_point = True
-        self.timestamp=datetime.now()
-        self.evaluate_datapoint()
+        self.values, self.received_ns = await self.cnx.read_holding_registers_timed(register_address, number_of_registers)
+
+    async def read_temperature_sensor_async(self):
+        await self.read_registers_async(0,4)
+        if not self.values:
+            return []
+        return self.parse_readings()
 
-    def evaluate_datapoint(self):
+    async def poll_registers(self, devices:list|None=None):
         """
-        Evaluate if the current reading differs from the previous one based on comparison criteria
+        An async generator that polls all Modbus devices of the sensor registry with the ModbusPollScheduler.
 
-        If the temperature change is plus minus 1 degrees (MIN_TEMPERATURE_CHANGE) and the time difference is less that 5 mins MIN_ELAPSED_TIME 
-        the data point will be marked as not for sending.
+        The schedule is rebuilt when a reload of the registry changes the devices.
 
+        Args:
+        -----
+        devices(list, optional): Poll only these devices (same format as SensorRegistry.devices), used by the
+        sharded runtime to split the fleet between worker processes.
+
+        Yields:
+        -------
+        list: The readings of one coalesced read request, with send_point set by the change filter.
         """
-        if not self.previous_datapoint: # The first data points (no previous) will be None
-            return
-        value_delta = abs(self.value - self.previous_datapoint.value)
-        time_delta = (self.timestamp - self.previous_datapoint.timestamp).total_seconds() /60
-        if value_delta <= config.MIN_TEMPERATURE_CHANGE and time_delta < config.MIN_ELAPSED_TIME:
-            self.changed=False
-            self.send_point=False 
-
-    def __str__(self):
-        date = self.timestamp.strftime("%Y-%m-%d")
-        time = self.timestamp.strftime("%H:%M")
-        status = "Valid" if self!= "V" else "Invalid"
-        return f"{self.value} C, {status}, {date} at {time} UTC"
+        while True:
+            devices_version = self.registry.devices_version
+            scheduler = ModbusPollScheduler(self.registry.devices if devices is None else devices)
+            async with contextlib.aclosing(scheduler.poll()) as reads:
+                async for block, values, received_ns in reads:
+                    timestamp_ns = CLOCK.to_epoch_ns(received_ns)
+                    if self.capture:
+                        self.capture.write_modbus(f"{block.host}:{block.port}", block.unit_id, block.start, values, timestamp_ns / 1e9)
+                    if block.sensor_ids is None:
+                        block.sensor_ids = self.registry.resolve(block.sensors.values())
+                    yield self.evaluate_registers(block.sensor_ids, block.decoder.decode(values), timestamp_ns, received_ns)
+                    if devices is None and self.registry.devices_version != devices_version:
+                        logger.info("The sensor registry changed, rebuilding the Modbus poll schedule")
+                        break
+
+    def decoder_for(self, host:str, port:int, unit_id:int, start:int, count:int) -> tuple:
+        """
+        Returns the decoder of the registry registers of a device that lie inside a read of count registers at start,
+        for reads that are not made by the ModbusPollScheduler (read_temperature_sensor, Replay.py).
+
+        Returns:
+        --------
+        tuple: (RegisterDecoder, np.ndarray sensor ids in the order of the decoded values)
+        """
+        if self._decoders_version != self.registry.devices_version:
+            self._decoders.clear()
+            self._decoders_version = self.registry.devices_version
+        key = (host, port, unit_id, start, count)
+        entry = self._decoders.get(key)
+        if entry is None:
+            registers = []
+            for device in self.registry.devices:
+                if (device["host"], device["port"], device["unit_id"]) == (host, port, unit_id):
+                    registers = [register for register in device["registers"]
+                                 if start <= register["address"] and register["address"] + register_count(register) <= start + count]
+            entry = self._decoders[key] = (RegisterDecoder(registers, start), self.registry.resolve(register["sensor"] for register in registers))
+        return entry
+
+    def evaluate_registers(self, sensor_ids:np.ndarray, values:np.ndarray, timestamp_ns:int, received_ns:int=0) -> list:
+        """
+        Turn the decoded values of one read request into readings and run them through the change filter.
+
+        Args:
+        -----
+        sensor_ids(np.ndarray): Registry ids of the values
+        values(np.ndarray): Decoded values, see RegisterDecoder.decode()
+        timestamp_ns(int): Time of the read as UTC epoch nanoseconds, replays pass the recorded time
+        received_ns(int, optional): time.monotonic_ns() the response was received, 0 for replays
 
+        Returns:
+        --------
+        list: The readings, with send_point set by the change filter.
+        """
+        if not len(sensor_ids):
+            return []
+        if self._registry_version != self.registry.version: # sensors were added or the registry was reloaded
+            self.registry.configure(self.filter)
+            self._registry_version = self.registry.version
+        send_mask = self.filter.evaluate(sensor_ids, values, np.full(len(sensor_ids), timestamp_ns / 1e9))
+        names, units = self.registry.names, self.registry.units
+        readings = [Reading(names[sensor_id], value, units[sensor_id], send_point=bool(send_point), sensor_id=sensor_id,
+                            timestamp_ns=timestamp_ns, received_ns=received_ns)
+                    for sensor_id, value, send_point in zip(sensor_ids.tolist(), values.tolist(), send_mask)]
+        return readings
@@ -1,28 +1,203 @@
 import paho.mqtt.client as paho
 from paho import mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 from datetime import datetime
-import os
-import sys
+import asyncio
+import collections
+import functools
+import json
+import threading
+import time
 
-SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
-sys.path.append(os.path.dirname(SCRIPT_DIR))
 from utils.logger import get_logger
-from .modubs_tcp import Datapoint
-from .nmea_client import Datapoint_Nmea
-from configs import config, measurements_mapping
+from utils import metrics
+from utils.clock import observe_latency
+from .readings import Reading
+from .outbound_queue import OutboundQueue
+from .payload_codecs import PayloadBatcher, StatsCodec, get_codec, publish_properties
+from .aggregation import WindowAggregator, seconds_to_next_window
+from .history_store import HistoryStore
+from .sensor_registry import REGISTRY
+from configs import config
 
 logger = get_logger("mqtt_logger", file_name='logs/mqtt_publisher.log')
 iot_logger = get_logger("iot_gatway_logger", file_name='logs/iot_gatway.log')
 
+BACKPRESSURE_POLICIES = ("block", "drop")
+BATCH_KEYS = ("sensor", "crane")
+
+ACK_SECONDS = metrics.histogram("gateway_mqtt_ack_seconds", "Time from handing a QoS 1 message to paho until the broker acknowledged it")
+PUBLISHED = metrics.counter("gateway_mqtt_published_total", "Messages handed to the MQTT client")
+STORED = metrics.counter("gateway_mqtt_stored_total", "Messages written to the outbound queue while the broker was offline")
+
+
+class InflightWindow:
+    """
+    A bounded window of published but not yet acknowledged messages.
+
+    Slots are taken on the asyncio event loop before a message is handed to paho and given back from the paho
+    network thread when the broker acknowledges the message (on_publish). When the window is full the producer
+    either waits for a free slot ("block") or the message is discarded ("drop"). When the connection is lost the
+    slots of the messages in flight are given back (reset()), paho sends the QoS 1 messages again after the reconnect
+    and their acknowledgements are then ignored. A message can be tracked with a callback that runs on the paho
+    network thread when it is acknowledged, the callbacks of the messages lost with the connection are not called.
+
+    Attributes:
+    - size(int): Maximum number of messages in flight.
+    - policy(str): "block" or "drop".
+    """
+    def __init__(self, size: int, policy: str = "block") -> None:
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy '{policy}', expected one of {BACKPRESSURE_POLICIES}")
+        self.size = size
+        self.policy = policy
+        self.dropped = 0
+        self._free = size
+        self._waiters: collections.deque[asyncio.Future] = collections.deque()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._lock = threading.Lock() # mids are tracked from both the event loop and the paho network thread
+        self._holding: dict[int, float] = {} # mid -> time.perf_counter() when it was handed to paho
+        self._early_acks: set[int] = set()
+        self._stale: set[int] = set() # mids in flight when the connection was lost, their slots are already free
+        self._callbacks: dict = {} # mid -> called when the message is acknowledged
+
+    @property
+    def inflight(self) -> int:
+        return self.size - self._free
+
+    @property
+    def is_full(self) -> bool:
+        return self._free <= 0
+
+    async def acquire(self, wait: bool | None = None) -> bool:
+        """
+        Take a slot for a new message.
+
+        Args:
+        -----
+        wait(bool, optional): Wait for a free slot even with the "drop" policy, defaults to the window policy.
+
+        Returns:
+        --------
+        bool: True if a slot was taken, False if the message has to be dropped.
+        """
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        if self._free > 0:
+            self._free -= 1
+            return True
+        if not (self.policy == "block" if wait is None else wait):
+            self.dropped += 1
+            return False
+        waiter = self._loop.create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter # release() hands its slot directly to the oldest waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        return True
+
+    def try_acquire(self) -> bool:
+        """
+        Take a slot without waiting, used by synchronous callers that can not block the event loop.
+        """
+        if self._loop is None:
+            try:
+                self._loop = asyncio.get_running_loop()
+            except RuntimeError: # called outside of an event loop
+                pass
+        if self._free > 0:
+            self._free -= 1
+            return True
+        self.dropped += 1
+        return False
+
+    def track(self, mid: int, on_ack=None) -> None:
+        """
+        Attach a taken slot to the paho message id, the slot is returned when the message is acknowledged.
+
+        Args:
+        -----
+        mid(int): Message id returned by paho
+        on_ack(callable, optional): Called without arguments when the broker acknowledged the message
+        """
+        with self._lock:
+            self._stale.discard(mid) # paho reused the mid, the old message is gone
+            if mid in self._early_acks: # the broker acknowledged before publish() returned
+                self._early_acks.discard(mid)
+                acked = True
+            else:
+                self._holding[mid] = time.perf_counter()
+                if on_ack is not None:
+                    self._callbacks[mid] = on_ack
+                acked = False
+        if acked:
+            self.release()
+            if on_ack is not None:
+                on_ack()
+
+    def acknowledge(self, mid: int) -> None:
+        """
+        Called from the paho network thread when a message is acknowledged.
+        """
+        with self._lock:
+            sent = self._holding.pop(mid, None)
+            if sent is None:
+                if mid in self._stale: # sent again after a reconnect, the slot was given back by reset()
+                    self._stale.discard(mid)
+                else:
+                    self._early_acks.add(mid)
+                return
+            on_ack = self._callbacks.pop(mid, None)
+        ACK_SECONDS.observe(time.perf_counter() - sent)
+        self.release_threadsafe()
+        if on_ack is not None:
+            on_ack()
+
+    def reset(self) -> None:
+        """
+        Called from the paho network thread when the connection is lost: give back the slots of the messages in
+        flight, QoS 0 messages that were not sent yet are discarded by paho and would hold their slot forever.
+        """
+        with self._lock:
+            lost = len(self._holding)
+            self._stale.update(self._holding)
+            self._holding.clear()
+            self._early_acks.clear()
+            self._callbacks.clear()
+        for _ in range(lost):
+            self.release_threadsafe()
+
+    def release(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+        self._free += 1
+
+    def release_threadsafe(self) -> None:
+        if self._loop is None: # no event loop, so nobody can be waiting for the slot
+            with self._lock:
+                self._free += 1
+        elif not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self.release)
+
 
 class MQTTPublisher:
     """
-    MQTT Publisher class that manages MQTT client conenctions, 
+    MQTT Publisher class that manages MQTT client conenctions,
     publishes messages to different topics
     """
 
 
-    def __init__(self, host: str, port: int, username: str, password: str):
+    def __init__(self, host: str, port: int, username: str, password: str,
+                 max_inflight: int = config.MQTT_MAX_INFLIGHT, backpressure_policy: str = config.MQTT_BACKPRESSURE_POLICY,
+                 outbound_queue: OutboundQueue | None = None, client_id: str | None = None,
+                 payload_format: str = config.MQTT_PAYLOAD_FORMAT, batch_by: str = config.MQTT_BATCH_BY):
         """
         Initialize the MQTT Publisher client object.
 
@@ -32,72 +207,461 @@ class MQTTPublisher:
         port(int): MQTT broker port number
         username(str): Username for MQTT broker authentication
         password(str): Password for MQTT broker authentication.
+        max_inflight(int): Maximum number of unacknowledged messages
+        backpressure_policy(str): "block" or "drop" when the in-flight window is full
+        outbound_queue(OutboundQueue, optional): Persistent queue that keeps the messages while the broker is offline
+        client_id(str, optional): MQTT client id, must be unique per connection (default is ows-challenge-<date>)
+        payload_format(str): "text" (one message per reading) or a batch format, see payload_codecs
+        batch_by(str): "sensor" batches on the sensor topics, "crane" packs all sensors into <static_text>/batch
 
 
 
         """
-        
-        date_str = datetime.now().strftime("%d%m%y")
-        client_id = f"ows-challenge-{date_str}"
+
+        if client_id is None:
+            date_str = datetime.now().strftime("%d%m%y")
+            client_id = f"ows-challenge-{date_str}"
+        if batch_by not in BATCH_KEYS:
+            raise ValueError(f"Unknown batch key '{batch_by}', expected one of {BATCH_KEYS}")
+        self.registry = REGISTRY # sensor topics
+        self.window = InflightWindow(max_inflight, backpressure_policy)
+        self.codec = get_codec(payload_format)
+        self.batch_by = batch_by
+        self.batcher = PayloadBatcher(config.MQTT_BATCH_MAX_READINGS, config.MQTT_BATCH_WINDOW) if self.codec.batched else None
+        self._properties: dict = {} # encoding -> MQTTv5 publish properties
+        self.outbound_queue = outbound_queue
+        self.connected = False
+        self.disconnects = 0 # connection losses, the replay resends the unacknowledged queued messages after one
+        self.subscriptions: list = [] # (topic, qos) subscribed again after every reconnect
         self.client = paho.Client(client_id=client_id, protocol=paho.MQTTv5)
         self.client.username_pw_set(username, password) #NOTE: username/password are not required but essential for HiveMQ
-        self.client.tls_set(tls_version=mqtt.client.ssl.PROTOCOL_TLS)
+        if config.MQTT_USE_TLS:
+            self.client.tls_set(tls_version=mqtt.client.ssl.PROTOCOL_TLS)
+        self.client.max_inflight_messages_set(max_inflight)
+        self.client.will_set(f"{self.registry.static_text}/gateway/status", payload="connection lost", qos=1, retain=True) # must be set before connecting
         self.client.on_connect = self.on_connect
         self.client.on_publish = self.on_publish
-        try:
-            self.client.connect(host, port)
-            logger.info("Mqtt publisher it connected")
-            iot_logger.info("Mqtt publisher it connected")
-        except Exception as e :
-            logger.error("Mqtt could not connect.")
-            sys.exit(1)
-    def on_connect(self,reason_code):
+        self.client.on_disconnect = self.on_disconnect
+        self.client.reconnect_delay_set(min_delay=max(1, round(config.RECONNECT_MIN_DELAY)), max_delay=config.RECONNECT_MAX_DELAY)
+        metrics.gauge("gateway_mqtt_inflight_messages", "Published messages waiting for an acknowledgement").set_function(lambda: self.window.inflight)
+        metrics.counter("gateway_mqtt_dropped_total", "Messages dropped because the in-flight window was full").set_function(lambda: self.window.dropped)
+        metrics.gauge("gateway_mqtt_connected", "1 while the broker connection is up").set_function(lambda: int(self.connected))
+        if outbound_queue is not None:
+            metrics.gauge("gateway_mqtt_offline_queue_messages", "Messages waiting in the outbound queue").set_function(lambda: len(outbound_queue))
+        # The first connection is made by the network thread, which retries with an exponential backoff (reconnect_delay_set)
+        # while the readings go to the outbound queue, so a broker that is down at startup does not stop the gateway.
+        self.client.connect_async(host, port)
+        logger.info("Connecting to the MQTT broker on host '%s' port %s", host, port)
+        self.start()
+
+    async def wait_connected(self, timeout: float, interval: float = 0.01) -> bool:
+        """
+        Wait until the network thread has connected to the broker, so the first readings are sent instead of queued.
+
+        Args:
+        -----
+        timeout(float): Seconds to wait at most
+        interval(float): Seconds between two checks of the connection state
+
+        Returns:
+        --------
+        bool: True if the broker is connected
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while not self.connected and loop.time() < deadline:
+            await asyncio.sleep(interval)
+        return self.connected
+
+    def on_connect(self, client, userdata, flags, reason_code, properties=None):
         logger.info(f"Connected Reason code: {reason_code}")
+        self.connected = reason_code == 0
+        if self.connected:
+            iot_logger.info("Mqtt publisher it connected")
+            if self.subscriptions:
+                self.client.subscribe(self.subscriptions)
+
+    def on_disconnect(self, client, userdata, reason_code, properties=None):
+        if self.connected:
+            logger.error("Disconnected from broker, reason code: %s", reason_code)
+        else: # failed reconnect attempt, paho retries with its backoff
+            logger.debug("Unable to reach the broker, reason code: %s", reason_code)
+        self.connected = False
+        self.disconnects += 1
+        self.window.reset()
 
-    def on_publish(self, mid, ):
-        logger.info(f"Published mid: {mid}")
+    def on_publish(self, client, userdata, mid):
+        self.window.acknowledge(mid)
 
-    def get_topic(self, message:Datapoint|Datapoint_Nmea)->str:
+    def get_topic(self, message:Reading)->str:
         """
-        Determine MQTT topic based on sensor datapoint object
+        Determine MQTT topic based on sensor reading
         
         Args:
         ----
-        message(Datapoint|Datapoint_Nmea): Message object to publish
+        message(Reading): Message object to publish
         
         Rerunts:
         --------
-        str: The topic string of the message
+        str: The topic string of the message, None for sensors that are not published
         """
-        if isinstance(message, Datapoint_Nmea) :
-            return measurements_mapping.measurements_mapping.get("ROT")
-        else:
-            return measurements_mapping.measurements_mapping.get(message.sensor)
+        if message.sensor_id < 0: # readings created without the registry, eg. in the sharded publisher processes
+            return self.registry.topic(message.sensor)
+        return self.registry.topics[message.sensor_id]
 
-    def publish(self, message: str, qos: int = 1):
+    def get_batch_topic(self, topic: str) -> str:
+        """
+        The topic a reading is batched on: its own topic, or the crane batch topic when batching by crane.
+        """
+        if self.batch_by == "crane":
+            return f"{self.registry.static_text}/batch"
+        return topic
+
+    def properties_for(self, encoding: str | None):
+        """
+        MQTTv5 publish properties (content type, schema and schema version) of a payload encoding.
+        """
+        encoding = encoding or "text" # queued messages from before payload encodings existed
+        properties = self._properties.get(encoding)
+        if properties is None:
+            properties = self._properties[encoding] = publish_properties(encoding)
+        return properties
+
+    def _store(self, topic: str, payload: bytes, qos: int, encoding: str | None = None) -> bool:
+        """
+        Keep a message in the outbound queue while the broker is offline.
+
+        Returns:
+        --------
+        bool: True if the message was queued.
+        """
+        if self.outbound_queue is None or self.connected:
+            return False
+        self.outbound_queue.put(topic, payload, qos, encoding or self.codec.name)
+        STORED.inc()
+        return True
+
+    def _send(self, topic: str, payload: bytes, qos: int, encoding: str | None = None) -> None:
+        self._send_payload(topic, payload, qos, self.properties_for(encoding or self.codec.name))
+
+    def _send_payload(self, topic: str, payload: str | bytes, qos: int, properties=None, on_ack=None) -> bool:
+        info = self.client.publish(topic, payload=payload, qos=qos, properties=properties)
+        if info.rc != paho.MQTT_ERR_SUCCESS and qos == 0: # QoS 0 messages are discarded by paho while offline
+            self.window.release()
+            return False
+        PUBLISHED.inc()
+        self.window.track(info.mid, on_ack)
+        return True
+
+    def publish(self, message: Reading, qos: int = 1) -> bool:
         """
         Publish a message to the MQTT broker on appropriate topic
 
+        This method does not wait for a free slot, when the in-flight window is full the message is dropped.
+        Async producers should use publish_async().
+
         Args:
         -----
-        message(str): The message to publish
+        message(Reading): The message to publish
 
         qos(int, optional): Quality of service lever (deafult is 1 ) -> To fullfill the requirement that at least the message needs to be send once
+
+        Returns:
+        --------
+        bool: True if the message was handed to the MQTT client (or added to a batch) while the broker is connected,
+        False if it was filtered, dropped (also when it completed a batch that the in-flight window refused) or kept
+        in the outbound queue.
         """
-        
-        
-        self.topic = self.get_topic(message)
-        if message.send_point:
-            logger.info(f"[Publishing] {message} to topic '{self.topic}'")
-            self.client.publish(self.topic, payload=message.__str__(), qos=qos)
-            self.client.will_set(self.topic, payload="connection lost", qos=1)
+        topic = self.get_topic(message)
+        if not message.send_point or topic is None:
+            return False
+        if self.batcher is not None:
+            topic = self.get_batch_topic(topic)
+            batch = self.batcher.add((topic, qos), message, time.monotonic())
+            if batch:
+                if not self._publish_payload_nowait(topic, self.codec.encode(batch), qos):
+                    logger.warning("Dropped a batch of %d readings on '%s', the in-flight window is full", len(batch), topic)
+                    return False
+                observe_latency(batch)
+            return self.connected # while offline the batch ends up in the outbound queue
+        payload = self.codec.encode((message,))
+        if self._store(topic, payload, qos):
+            return False # kept until the broker is back, not a publish
+        if not self._publish_payload_nowait(topic, payload, qos):
+            return False
+        observe_latency((message,))
+        return True
+
+    async def publish_async(self, message: Reading, qos: int = 1) -> bool:
+        """
+        Publish a message to the MQTT broker, applying the backpressure policy when the in-flight window is full.
+
+        With a batch payload format the reading is added to the batch of its topic, which is published when it is
+        full or by flush_batches() when its time window is over.
+
+        Args:
+        -----
+        message(Reading): The message to publish
+        qos(int, optional): Quality of service level (default is 1)
+
+        Returns:
+        --------
+        bool: True if the message was handed to the MQTT client (or added to a batch) while the broker is connected,
+        False if it was filtered, dropped (also when it completed a batch that the in-flight window refused) or kept
+        in the outbound queue. Gateway.calculate_timeout() relies on dropped and queued messages not counting as
+        published.
+        """
+        if not message.send_point:
+            return False
+        topic = self.get_topic(message)
+        if topic is None:
+            logger.error("No topic configured for sensor '%s'", message.sensor)
+            return False
+        if self.batcher is not None:
+            topic = self.get_batch_topic(topic)
+            batch = self.batcher.add((topic, qos), message, time.monotonic())
+            if batch:
+                if not await self._publish_payload(topic, self.codec.encode(batch), qos):
+                    logger.warning("Dropped a batch of %d readings on '%s', the in-flight window is full", len(batch), topic)
+                    return False
+                observe_latency(batch)
+            return self.connected # while offline the batch ends up in the outbound queue
+        payload = self.codec.encode((message,))
+        if self._store(topic, payload, qos):
+            return False # kept until the broker is back, not a publish
+        if not await self._publish_payload(topic, payload, qos):
+            return False
+        observe_latency((message,)) # socket to MQTT client, see gateway_mqtt_ack_seconds for the broker side
+        return True
+
+    def _publish_payload_nowait(self, topic: str, payload: bytes, qos: int) -> bool:
+        if self._store(topic, payload, qos):
+            return True
+        if not self.window.try_acquire():
+            return False
+        self._send(topic, payload, qos)
+        return True
+
+    async def _publish_payload(self, topic: str, payload: bytes, qos: int, encoding: str | None = None) -> bool:
+        if self._store(topic, payload, qos, encoding):
+            return True
+        if not await self.window.acquire():
+            return False
+        self._send(topic, payload, qos, encoding)
+        return True
+
+    async def flush_batches(self, interval: float = 0.5):
+        """
+        Publish the batches whose time window (MQTT_BATCH_WINDOW) is over, runs until cancelled.
+
+        Args:
+        -----
+        interval(float): Seconds between two checks, a batch is published at most this late
+        """
+        if self.batcher is None:
+            return
+        while True:
+            await asyncio.sleep(interval)
+            for (topic, qos), readings in self.batcher.due(time.monotonic()):
+                if not await self._publish_payload(topic, self.codec.encode(readings), qos):
+                    logger.warning("Dropped a batch of %d readings on '%s', the in-flight window is full", len(readings), topic)
+                    continue
+                observe_latency(readings)
+
+    async def publish_batch_async(self, messages: list, qos: int = 1) -> int:
+        """
+        Publish a batch of messages, paho pipelines them on the connection without waiting for each acknowledgement.
+
+        Args:
+        -----
+        messages(list): Readings to publish
+        qos(int, optional): Quality of service level (default is 1)
+
+        Returns:
+        --------
+        int: Number of messages handed to the MQTT client, messages kept in the outbound queue are not counted.
+        """
+        published = 0
+        for message in messages:
+            if message and await self.publish_async(message, qos):
+                published += 1
+        return published
+
+    async def replay_outbound_queue(self, rate: float = config.OFFLINE_QUEUE_REPLAY_RATE, interval: float = 0.5):
+        """
+        Drain the outbound queue in order after the broker connection is back.
+
+        Messages are sent in batches of rate * interval, live readings are published directly in parallel so a long
+        backlog does not delay fresh data. The queue is also flushed to disk on every tick while offline.
+
+        A message stays in the queue until the broker acknowledged it. The messages that were not acknowledged when
+        the connection is lost are sent again after the reconnect, so they can arrive twice (QoS 1 is at least once).
+
+        Args:
+        -----
+        rate(float): Maximum number of queued messages sent per second
+        interval(float): Seconds between two batches
+        """
+        if self.outbound_queue is None:
+            return
+        batch_size = max(1, int(rate * interval))
+        acked: collections.deque = collections.deque() # row ids, appended by the paho network thread
+        last_sent = 0 # id of the last row handed to paho on the current connection
+        disconnects = self.disconnects
+        while True:
+            started = asyncio.get_running_loop().time()
+            if acked:
+                ids = [acked.popleft() for _ in range(len(acked))]
+                await asyncio.to_thread(self.outbound_queue.remove, ids)
+            if disconnects != self.disconnects: # the rows that were not acknowledged are sent again
+                disconnects, last_sent = self.disconnects, 0
+            if not self.connected or not len(self.outbound_queue):
+                await asyncio.to_thread(self.outbound_queue.flush)
+            else:
+                rows = await asyncio.to_thread(self.outbound_queue.peek, batch_size, last_sent)
+                sent = 0
+                for row_id, topic, payload, qos, encoding in rows:
+                    await self.window.acquire(wait=True) # replayed messages are never dropped
+                    if disconnects != self.disconnects: # lost while waiting for a slot, start over after the reconnect
+                        self.window.release()
+                        break
+                    if not self._send_payload(topic, payload, qos, self.properties_for(encoding), functools.partial(acked.append, row_id)):
+                        break
+                    last_sent = row_id
+                    sent += 1
+                if sent:
+                    logger.info("Replayed %d queued messages, %d waiting for an acknowledgement or left", sent, len(self.outbound_queue))
+            await asyncio.sleep(max(0, interval - (asyncio.get_running_loop().time() - started)))
+
+    async def publish_metrics(self, interval: float = config.METRICS_MQTT_INTERVAL, registry: metrics.MetricsRegistry = metrics.REGISTRY):
+        """
+        Publish a JSON snapshot of the gateway metrics to the '<static_text>/gateway/$SYS/metrics' topic periodically.
+
+        The snapshot is sent with QoS 0 and skipped while offline or when the in-flight window is full, so it never
+        competes with the sensor readings.
+
+        Args:
+        -----
+        interval(float): Seconds between two snapshots, 0 disables publishing
+        registry(MetricsRegistry): The metrics to publish
+        """
+        if not interval:
+            return
+        topic = f"{self.registry.static_text}/gateway/$SYS/metrics"
+        while True:
+            await asyncio.sleep(interval)
+            if self.connected and not self.window.is_full and self.window.try_acquire():
+                self._send_payload(topic, json.dumps(registry.snapshot()), qos=0)
+
+    async def publish_summaries(self, aggregator: WindowAggregator, interval: float = config.AGGREGATION_INTERVAL, qos: int = 1):
+        """
+        Publish the window statistics of every sensor to '<sensor topic>/stats' every interval, runs until cancelled.
+
+        The windows are aligned to the wall clock (eg. every full minute), a summary covers all readings of the
+        window, also the ones the change filter did not send.
+
+        Args:
+        -----
+        aggregator(WindowAggregator): The aggregation stage fed by the polling loops
+        interval(float): Window length in seconds, 0 disables the summaries
+        qos(int, optional): Quality of service level (default is 1)
+        """
+        if not interval:
+            return
+        codec = StatsCodec()
+        while True:
+            await asyncio.sleep(seconds_to_next_window(time.time(), interval))
+            for sensor, summary in aggregator.flush():
+                topic = self.registry.topic(sensor)
+                if topic is not None:
+                    await self._publish_payload(f"{topic}/stats", codec.encode(summary), qos, codec.name)
+
+    async def serve_history(self, store: HistoryStore, max_points: int = config.HISTORY_QUERY_MAX_POINTS):
+        """
+        Answer history queries sent to '<static_text>/gateway/history/request', runs until cancelled.
+
+        A request is a JSON object {"sensor": name, "start": epoch seconds, "end": epoch seconds} with an optional
+        "bucket" (seconds) for a downsampled read. The response is sent to the MQTTv5 response topic of the request
+        with its correlation data, clients without MQTTv5 properties can put "response_topic" and "id" in the
+        request instead (default response topic '<static_text>/gateway/history/response').
+
+        Args:
+        -----
+        store(HistoryStore): The history to query
+        max_points(int): Maximum points in a response, raw reads with more readings are truncated
+        """
+        loop = asyncio.get_running_loop()
+        requests: asyncio.Queue = asyncio.Queue(maxsize=100)
+        request_topic = f"{self.registry.static_text}/gateway/history/request"
+
+        def enqueue(message):
+            if requests.full():
+                logger.warning("History request dropped, %d requests are waiting", requests.qsize())
+            else:
+                requests.put_nowait(message)
+
+        self.client.message_callback_add(request_topic, lambda client, userdata, message: loop.call_soon_threadsafe(enqueue, message))
+        self.subscriptions.append((request_topic, 1))
+        if self.connected:
+            self.client.subscribe(request_topic, qos=1)
+        while True:
+            message = await requests.get()
+            response_topic = getattr(message.properties, "ResponseTopic", None)
+            correlation = getattr(message.properties, "CorrelationData", None)
+            try:
+                request = json.loads(message.payload)
+                response_topic = response_topic or request.get("response_topic") or f"{self.registry.static_text}/gateway/history/response"
+                response = {"id": request.get("id"), **await asyncio.to_thread(self.query_history, store, request, max_points)}
+            except (ValueError, TypeError, KeyError, AttributeError) as e:
+                response = {"error": f"Invalid history request: {e}"}
+                response_topic = response_topic or f"{self.registry.static_text}/gateway/history/response"
+            properties = Properties(PacketTypes.PUBLISH)
+            properties.ContentType = "application/json"
+            if correlation is not None:
+                properties.CorrelationData = correlation
+            if self.connected and await self.window.acquire():
+                self._send_payload(response_topic, json.dumps(response, separators=(",", ":")), 1, properties)
+
+    @staticmethod
+    def query_history(store: HistoryStore, request: dict, max_points: int) -> dict:
+        """
+        Run a history request (see serve_history) and return the columns of the response.
+        """
+        sensor, start, end = request["sensor"], float(request["start"]), float(request["end"])
+        response = {"sensor": sensor, "start": start, "end": end}
+        if request.get("bucket"):
+            bucket = float(request["bucket"])
+            if (end - start) / bucket > max_points:
+                raise ValueError(f"more than {max_points} buckets")
+            records = store.downsample(sensor, start, end, bucket)
+            response.update(bucket=bucket, t=records["timestamp"].tolist(), min=records["min"].tolist(),
+                            max=records["max"].tolist(), mean=records["mean"].tolist(), count=records["count"].tolist())
         else:
-            logger.info(f"Message {message} with topic {self.topic} cant be published as it didnt change or its invalid")
+            records = store.query(sensor, start, end)
+            response["truncated"] = len(records) > max_points
+            records = records[:max_points]
+            response.update(t=records["timestamp"].tolist(), value=records["value"].tolist(), valid=records["valid"].tolist())
+        return response
 
     def start(self):
         """
-        Start the MQTT network loop.
-        
+        Start the MQTT network loop on a background thread, it sends the messages and processes the acknowledgements.
+
         """
         logger.info("Starting MQTT loop")
-        self.client.loop_forever()
+        self.client.loop_start()
+
+    def stop(self):
+        """
+        Stop the MQTT network loop and disconnect from the broker.
+
+        Readings still waiting in a batch are sent if the broker is connected, otherwise they are kept in the
+        outbound queue.
+        """
+        if self.batcher is not None:
+            for (topic, qos), readings in self.batcher.due(time.monotonic(), force=True):
+                self._publish_payload_nowait(topic, self.codec.encode(readings), qos)
+        self.client.disconnect()
+        self.client.loop_stop()
+        if self.outbound_queue is not None:
+            self.outbound_queue.close()
@@ -1,151 +1,327 @@
+import asyncio
 import socket
-import sys
-import os
-import operator
-from functools import reduce
-from datetime import datetime
-SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
-sys.path.append(os.path.dirname(SCRIPT_DIR))
+import time
 from configs import config
 from utils.logger import get_logger
+from utils.clock import CLOCK
+from utils import metrics
+from .change_filter import DeadbandFilter
+from .connection_manager import CircuitBreaker
+from .readings import Reading
+from .sensor_registry import REGISTRY
+from .nmea_sources import SourceSelector, open_datagram_socket, receive_datagrams
+from . import nmea_parser
 
 
 logger = get_logger("nmea_logger", file_name= 'logs/nmea_client.log')
 iot_logger = get_logger("iot_gatway_logger", file_name='logs/iot_gatway.log')
+
+PARSE_SECONDS = metrics.histogram("gateway_nmea_parse_seconds", "Time to parse a batch of received NMEA sentences",
+                                  buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01))
+SENTENCES = metrics.counter("gateway_nmea_sentences_total", "NMEA sentences parsed into readings")
+
+
+class NmeaSentenceFramer:
+    """
+    Splits a TCP byte stream into complete NMEA sentences.
+
+    A sentence starts with '$' and ends at CRLF (or at the next '$' when the talker omits the line ending).
+    Everything after the last complete sentence is kept in the buffer until the next chunk arrives, so a
+    sentence split across two TCP segments is reassembled instead of failing the checksum.
+    """
+    def __init__(self, max_buffer:int=4096) -> None:
+        self.buffer = b""
+        self.max_buffer = max_buffer
+
+    def feed(self, data:bytes) -> list:
+        """
+        Add a chunk from the stream and return the sentences it completes.
+
+        Args:
+        -----
+        - data(bytes): Raw bytes received from the socket.
+
+        Returns:
+        --------
+        - list: Complete sentences (bytes) without the line ending.
+        """
+        buffer = self.buffer + data
+        sentences = []
+        start = buffer.find(b"$")
+        while start != -1:
+            next_start = buffer.find(b"$", start + 1)
+            end = buffer.find(b"\n", start + 1)
+            if end != -1 and (next_start == -1 or end < next_start):
+                sentences.append(buffer[start:end].rstrip(b"\r"))
+                start = next_start
+            elif next_start != -1: # missing line ending, the next '$' closes the sentence
+                sentences.append(buffer[start:next_start].rstrip(b"\r\n"))
+                start = next_start
+            else:
+                break
+        self.buffer = buffer[start:] if start != -1 else b""
+        if len(self.buffer) > self.max_buffer: # garbage without any framing, drop it
+            logger.error("Dropping %d unframed bytes from NMEA stream", len(self.buffer))
+            self.buffer = b""
+        return sentences
+
+    def feed_block(self, data:bytes) -> bytes:
+        """
+        Add a chunk from the stream and return the complete sentences it finishes as one block.
+
+        The block is meant for nmea_parser.parse_buffer(), which parses all sentences of the block in one pass.
+
+        Args:
+        -----
+        - data(bytes): Raw bytes received from the socket.
+
+        Returns:
+        --------
+        - bytes: Complete sentences (may be empty), the unfinished sentence stays in the buffer.
+        """
+        buffer = self.buffer + data
+        if buffer.endswith(b"\n"):
+            self.buffer = b""
+            return buffer
+        cut = buffer.rfind(b"$") # everything before the last '$' is complete
+        if cut == -1:
+            cut = len(buffer) if len(buffer) > self.max_buffer else 0
+        self.buffer = buffer[cut:]
+        if len(self.buffer) > self.max_buffer: # garbage without any framing, drop it
+            logger.error("Dropping %d unframed bytes from NMEA stream", len(self.buffer))
+            self.buffer = b""
+        return buffer[:cut]
+
+    def reset(self) -> None:
+        self.buffer = b""
+
+
 class NmeaHandler:
     """
-    A handler class for connecting to NMEA TCP stream, reading and parsing
+    A handler class for connecting to NMEA TCP stream and UDP sources, reading and parsing
+
+    The change filter keeps one row per talker and sensor, so the same sentence type from two talkers (eg. the ROT of
+    two gyros) is filtered on its own values. A registry sensor named "<talker>:<sensor>" (eg. "HE:ROT") gives the
+    readings of that talker their own name and topic, the other talkers use the plain sensor name. Sources that
+    deliver the same talker and sentence type are deduplicated by the SourceSelector.
 
     Params:
     --------
     - port(int): Port Number of the NMEA server.
     - host (str): Host address of the NMEA server
     - send_valid_data (bool): A flag to allow the handler to send only the data that is tagged with "Valid"
+    - use_asyncio (bool): Stream readings with stream_ROT_readings() instead of the blocking socket (default=False)
+    - sentence_types (tuple): Sentence types turned into readings, see nmea_parser for the registered types (default=("ROT",))
 
     """
     
-    def __init__(self, port:int, host:str,send_valid_data:bool=False) -> None:
+    def __init__(self, port:int, host:str,send_valid_data:bool=False, use_asyncio:bool=False, sentence_types:tuple=("ROT",)) -> None:
         self.port = port
         self.host = host
-        self.previous_datapoint=None
-        self.connect()
-        self.buffer=""
+        self.sentence_types={sentence_type.encode('ascii') for sentence_type in sentence_types}
+        self.registry=REGISTRY
+        self.filter=DeadbandFilter(name="nmea")
+        self.selector=SourceSelector()
+        self._sensors: dict[tuple, tuple] = {} # (talker id, sensor) -> (registry name, sensor id)
+        self._rows: dict[tuple, int] = {} # (talker id, sensor id) -> change filter row
+        self._registry_version=self.registry.version
+        self.framer=NmeaSentenceFramer()
+        self.breaker=CircuitBreaker(f"nmea {host}:{port}")
+        self.sock=None
+        self.capture=None # CaptureWriter recording the received bytes for Replay.py
+        self.received_ns=0 # time.monotonic_ns() of the last receive in the blocking mode
+        self.use_asyncio=use_asyncio
+        if not self.use_asyncio:
+            self.connect() # the streaming mode opens its own connection
         self.send_valid_data=send_valid_data
         if self.send_valid_data:
             logger.info("Only Valid signals will be sent to the broker based on user wish")
 
 
 
-    def connect(self) -> None:
+    def connect(self) -> bool:
         """
         Attempts to establish a TCP connection to the NMEA (server)"
 
+        The previous socket is closed first. Attempts are skipped while the circuit breaker of the server is open.
+
         Returns:
         --------
-        - None
+        - bool: True if the connection is open
         
         """
+        self.close()
+        if not self.breaker.allow():
+            return False
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.sock.connect((self.host, self.port))
-            logger.info(f"Connection to NMEA Websocket on host '{self.host}' port '{self.port}' is successful")
-            iot_logger.info(f"Connection to NMEA Websocket on host '{self.host}' port '{self.port}' is successful")
-     
-        except socket.timeout:
-            logger.error("Connection times out")
-        except Exception as e:
+            sock.connect((self.host, self.port))
+        except OSError as e:
+            sock.close()
+            self.breaker.record_failure(e)
+            return False
+        self.sock = sock
+        self.breaker.record_success()
+        logger.info(f"Connection to NMEA Websocket on host '{self.host}' port '{self.port}' is successful")
+        iot_logger.info(f"Connection to NMEA Websocket on host '{self.host}' port '{self.port}' is successful")
+        return True
 
-            logger.error(f"Failed to connect to NMEA Websocket: {e}")
+    def close(self) -> None:
+        """
+        Close the socket of the blocking mode and drop the partial sentence of the old connection.
+        """
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        self.framer.reset()
 
     def read_nmea_data(self) -> str:
         """
         Reads a raw NMEA sentence.
+
+        A lost connection is reopened by the next call (see connect()).
         
         Returns:
         --------
         - data (str) | None : Decoded Nmea sentence (if successful) otherwise returns None
         
         """
+        if self.sock is None and not self.connect():
+            return
         try:
-            data= self.sock.recv(1024).decode('ascii') #1 kilobyte
-            if not data:
-                self.connect()
-                logger.error("Socket Closed by server")
-                return 
-            else:
-                messages= [f'${part}' for part in data.split('$') if part] # to recosntruct the messages.
-                return messages
-        except Exception as e:
-            logger.error(f"Unexpected error:{e}")
+            data= self.sock.recv(1024) #1 kilobyte
+            self.received_ns=time.monotonic_ns()
+        except OSError as e:
+            self.close()
+            self.breaker.record_failure(e)
+            return
+        if not data:
+            self.close()
+            self.breaker.record_failure("socket closed by server")
+            return
+        return self.framer.feed(data) # partial sentences are kept until the rest arrives
 
 
-    def parse_data(self, messages:list)->dict:
+    def parse_data(self, messages:list, received_ns:int=0, source:str="")->list:
         """
-        Parses a given NMEA sentence
+        Parses the given NMEA sentences and runs the readings through the change filter
         
         Params:
         --------
-        - messages(list): a list of Nmea messages that follows MG predefined format
+        - messages(list): a list of Nmea sentences (bytes or str) that follows MG predefined format
+        - received_ns(int, optional): time.monotonic_ns() the sentences were received (default now)
+        - source(str, optional): Where the sentences came from, see SourceSelector
 
         Returns:
         --------
-        - dict | None: Parsed message as dictionary if sucessful, otherwise None
+        - list: Parsed readings, invalid sentences are skipped
 
         
         """
-        def calculate_checksum(data: str) -> int:
-            """
-            A function to calculate the checksum of the message
-
-            Args:
-            -----
-            - data(str): The raw data string without the "Given" checksum, eg. 
-            """
-            #https://gist.github.com/MattWoodhead/0bc2b3066796e19a3a350689b43b50ab
-            calculated_checksum = reduce(operator.xor, (ord(s) for s in data[1:]), 0) # [1:] to skip the $
-            return calculated_checksum
-
-        def parse_signal(message:str):
-            """
-            A function that encabsulates the handle of parsing a one signal
-
-            Args:
-            -----
-            -message(str): The one line of a simple Nmea Message. 
-
-            """
-            if not message.startswith('$') or '*' not in message:
-                    logger.error(f"Invalid NMEA format {message}")
-                    return
-            else:
-                data, checksum = message.split("*")
-                calculated_checksum=calculate_checksum(data)
-                if int(checksum, base=16) != calculated_checksum:
-                    logger.error(f"Checksum mismatch. Received: {int(checksum, base=16)}, Calculated: {calculated_checksum}")
-                    return None
-                try:
-                    fields= data.split(",")
-                    talker_id = fields[0][1:3]
-                    sentence_type= fields[0][3:]
-                    rot_value= float(fields[1])
-                    status= fields[2]
-                    if status == "V" and self.send_valid_data:
-                        return
-                    datapoint = Datapoint_Nmea(talker_id, sentence_type, rot_value, status, checksum,self.previous_datapoint)
-                    self.previous_datapoint=datapoint
-                    return datapoint
-                except IndexError:
-                    logger.error("Error in index the nmea sentence")
-                except Exception as e:
-                    logger.error(f"Failed to parse nmea message {e}")     
+        started=time.perf_counter()
+        parsed=[]
+        for message in messages:
+            if isinstance(message, str):
+                message=message.encode('ascii', errors='replace')
+            sentence=nmea_parser.parse_sentence(message, self.sentence_types)
+            if sentence:
+                parsed.append(sentence)
+        PARSE_SECONDS.observe(time.perf_counter()-started)
+        SENTENCES.inc(len(parsed))
+        received_ns=received_ns or time.monotonic_ns()
+        return self.evaluate_readings(self.to_readings(parsed, CLOCK.to_epoch_ns(received_ns), received_ns, source))
 
+    def parse_block(self, block:bytes, timestamp_ns:int|None=None, received_ns:int=0, source:str="", device:str="")->list:
+        """
+        Parses a block of complete NMEA sentences with the nmea_parser fast path and runs the readings through the change filter
+
+        Params:
+        --------
+        - block(bytes): Complete sentences, as returned by NmeaSentenceFramer.feed_block()
+        - timestamp_ns(int, optional): Time the block was received as UTC epoch nanoseconds (default now), replays pass the recorded time
+        - received_ns(int, optional): time.monotonic_ns() the block was received, 0 for replays
+        - source(str, optional): Where the block came from, eg. "host:port", see SourceSelector
+        - device(str, optional): IEC 61162-450 TAG source identifier of the sending device, see SourceSelector
+
+        Returns:
+        --------
+        - list: Parsed readings, invalid sentences are skipped
+        """
+        if not block:
+            return []
+        started=time.perf_counter()
+        parsed=nmea_parser.parse_buffer(block, self.sentence_types)
+        PARSE_SECONDS.observe(time.perf_counter()-started)
+        SENTENCES.inc(len(parsed))
+        return self.evaluate_readings(self.to_readings(parsed, timestamp_ns, received_ns, source, device))
+
+    def to_readings(self, parsed:list, timestamp_ns:int|None=None, received_ns:int=0, source:str="", device:str="")->list:
+        """
+        Turns parsed sentences into readings, dropping the sentences of redundant sources and invalid data if only
+        valid data should be sent.
+        """
+        if timestamp_ns is None:
+            timestamp_ns=CLOCK.now_ns()
+        self._check_registry()
         datapoints=[]
-        for message in messages:
-            dp=parse_signal(message)
-            if dp:
-                datapoints.append(dp)
+        accept=self.selector.accept
+        sensors=self._sensors
+        for talker_id, sentence_type, values in parsed:
+            if not accept(source, talker_id, sentence_type, timestamp_ns, device):
+                continue
+            for sensor, value, unit, status in values:
+                if status == "V" and self.send_valid_data:
+                    continue
+                name, sensor_id = sensors.get((talker_id, sensor)) or self.sensor_of(talker_id, sensor)
+                datapoints.append(Reading(name, value, unit, status, source=talker_id, sensor_id=sensor_id,
+                                          timestamp_ns=timestamp_ns, received_ns=received_ns))
+        return datapoints
+
+    def sensor_of(self, talker_id:str, sensor:str)->tuple:
+        """
+        Returns the registry name and id of a sensor of a talker: "<talker>:<sensor>" if the registry defines it,
+        else the sensor name shared by all talkers.
+        """
+        qualified=f"{talker_id}:{sensor}"
+        name=qualified if qualified in self.registry.ids else sensor
+        entry=self._sensors[(talker_id, sensor)]=(name, self.registry.sensor_id(name))
+        return entry
+
+    def filter_row(self, talker_id:str, sensor_id:int)->int:
+        """
+        Returns the change filter row of a sensor of a talker, registered with the limits of the sensor on first use.
+        """
+        row=self._rows.get((talker_id, sensor_id))
+        if row is None:
+            row=self._rows[(talker_id, sensor_id)]=self.filter.register(
+                f"{talker_id}:{self.registry.names[sensor_id]}", self.registry.deadband[sensor_id], self.registry.heartbeat[sensor_id])
+        return row
+
+    def _check_registry(self)->None:
+        if self._registry_version == self.registry.version:
+            return
+        # sensors were added or the registry was reloaded: resolve the names again and update the filter limits
+        self._registry_version=self.registry.version
+        self._sensors.clear()
+        for talker_id, sensor_id in self._rows:
+            self.filter.register(f"{talker_id}:{self.registry.names[sensor_id]}", self.registry.deadband[sensor_id], self.registry.heartbeat[sensor_id])
+
+    def evaluate_readings(self, datapoints:list)->list:
+        """
+        Runs a batch of readings through the change filter in one call and records them in the history.
+        """
+        if datapoints: # the whole batch goes through the change filter in one call
+            for dp in datapoints:
+                if dp.sensor_id < 0:
+                    dp.sensor_id=self.registry.sensor_id(dp.sensor)
+            self._check_registry()
+            filter_row=self.filter_row
+            send_mask=self.filter.evaluate([filter_row(dp.source, dp.sensor_id) for dp in datapoints],
+                                           [dp.value for dp in datapoints],
+                                           [dp.timestamp for dp in datapoints])
+            for dp, send_point in zip(datapoints, send_mask):
+                dp.send_point=bool(send_point)
         return datapoints
-  
 
     def get_ROT_readings(self)->None:
         """
@@ -154,49 +330,93 @@ class NmeaHandler:
         """
         messages=self.read_nmea_data()
         if messages:
-            return self.parse_data(messages)
+            return self.parse_data(messages, self.received_ns)
         return
 
-class Datapoint_Nmea:
-    def __init__(self,talker_id, sentence_type, rot_value, status, checksum, previous_datapoint)->None:
+    async def stream_ROT_readings(self, chunk_size:int=4096):
         """
-        Initialize a Datapoint object
+        An async generator that streams ROT readings from the NMEA server without blocking the event loop.
 
-        Attributes:
-        - sensor(str): Sensor name
-        - value(float): Sensor reading value
-        - previous_datapoint(Datapoint): previous datapoint object
-        
+        Every complete sentence is parsed and yielded as soon as it arrives, so there is no polling delay.
+        The stream is reopened with an exponential backoff (see connection_manager) if the server closes the connection.
+
+        Args:
+        -----
+        - chunk_size(int): Maximum number of bytes to read from the stream at once.
+
+        Yields:
+        -------
+        - Reading: Parsed ROT reading.
         """
-        self.talker_id = talker_id
-        self.sentence_type = sentence_type
-        self.previous_datapoint:Datapoint_Nmea=previous_datapoint
-        self.rot_value=rot_value
-        self.status=status
-        self.checksum=checksum
-        self.changed = True  
-        self.send_point = True
-        self.timestamp=datetime.now()
-        self.evaluate_datapoint()
+        framer = NmeaSentenceFramer()
+        source = f"{self.host}:{self.port}"
+        while True:
+            await asyncio.sleep(self.breaker.retry_in)
+            if not self.breaker.allow():
+                continue
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            except OSError as e:
+                self.breaker.record_failure(e)
+                continue
+            self.breaker.record_success()
+            logger.info(f"Streaming connection to NMEA Websocket on host '{self.host}' port '{self.port}' is successful")
+            reason = "socket closed by server"
+            try:
+                while True:
+                    data = await reader.read(chunk_size)
+                    if not data:
+                        break
+                    received_ns = time.monotonic_ns() # first thing after the bytes arrive, before framing and parsing
+                    timestamp_ns = CLOCK.to_epoch_ns(received_ns)
+                    if self.capture:
+                        self.capture.write_nmea(source, data, timestamp_ns / 1e9)
+                    for datapoint in self.parse_block(framer.feed_block(data), timestamp_ns, received_ns, source):
+                        yield datapoint
+            except OSError as e:
+                reason = e
+            finally:
+                writer.close()
+                framer.reset()
+            self.breaker.record_failure(reason)
 
-    def evaluate_datapoint(self):
+    async def stream_datagrams(self, port:int, group:str|None=None, interface:str="0.0.0.0",
+                               max_datagrams:int=config.NMEA_UDP_BATCH):
         """
-        Evaluate if the current reading differs from the previous one based on comparison criteria
+        An async generator that streams the readings of NMEA datagrams, eg. an IEC 61162-450 multicast group.
 
-        If the temperature change is plus minus 1 degrees (MIN_TEMPERATURE_CHANGE) and the time difference is less that 5 mins MIN_ELAPSED_TIME 
-        the data point will be marked as not for sending.
+        Every datagram waiting on the socket is read when it becomes readable and the datagrams of each sender are
+        parsed as one block (see nmea_sources). Each datagram holds complete sentences, so no framing is needed.
+        The sender address is the source of the sentences, so the same device received from two senders (redundant
+        networks) is deduplicated. Devices are told apart by their TAG block "s:" source identifier, see SourceSelector.
 
-        """
+        Args:
+        -----
+        - port(int): UDP port
+        - group(str, optional): Multicast group to join, None for unicast/broadcast datagrams
+        - interface(str): Address of the interface to listen on
+        - max_datagrams(int): Maximum datagrams read and parsed per wakeup
 
-        if not self.previous_datapoint: # The first data points (no previous) will be None
-            return
-        value_delta = abs(self.rot_value - self.previous_datapoint.rot_value)
-        time_delta = (self.timestamp - self.previous_datapoint.timestamp).total_seconds() /60
-        if value_delta <= config.MIN_ROT_CHANGE and time_delta < config.MIN_ELAPSED_TIME:
-            self.changed=False
-            self.send_point=False 
-    def __str__(self):
-        date = self.timestamp.strftime("%Y-%m-%d")
-        time = self.timestamp.strftime("%H:%M")
-        status = "Valid" if self.status != "V" else "Invalid"
-        return f"{self.rot_value} deg, {status}, {date} at {time} UTC"
+        Yields:
+        -------
+        - Reading: Parsed reading.
+        """
+        loop = asyncio.get_running_loop()
+        sock = open_datagram_socket(port, group, interface)
+        readable = asyncio.Event()
+        loop.add_reader(sock.fileno(), readable.set)
+        logger.info(f"Listening for NMEA datagrams on {group or interface} port '{port}'")
+        try:
+            while True:
+                await readable.wait()
+                readable.clear()
+                received_ns = time.monotonic_ns() # first thing after the datagrams arrive, before reading and parsing
+                timestamp_ns = CLOCK.to_epoch_ns(received_ns)
+                for (sender, device), block in receive_datagrams(sock, max_datagrams).items():
+                    if self.capture:
+                        self.capture.write_nmea(sender, block, timestamp_ns / 1e9)
+                    for datapoint in self.parse_block(block, timestamp_ns, received_ns, sender, device):
+                        yield datapoint
+        finally:
+            loop.remove_reader(sock.fileno())
+            sock.close()
@@ -0,0 +1,229 @@
+import re
+import numpy as np
+from utils.logger import get_logger
+from utils import metrics
+
+logger = get_logger("nmea_logger", file_name= 'logs/nmea_client.log')
+
+CHECKSUM_FAILURES = metrics.counter("gateway_nmea_checksum_failures_total", "NMEA sentences dropped because of a checksum mismatch")
+
+_MASK_512 = (1 << 512) - 1
+_MASK_256 = (1 << 256) - 1
+_MASK_128 = (1 << 128) - 1
+_MASK_64 = (1 << 64) - 1
+
+_HEX_CHECKSUMS = [f"{value:02X}".encode('ascii') for value in range(256)] # checksum -> expected hex field
+MAX_CACHED_ADDRESSES = 256
+_ADDRESSES: dict = {} # validated address field (bytes, or (talker, type) tuple) -> (talker_id, sentence_type)
+_HEX_VALUES = np.full(256, -1, dtype=np.int16) # ascii code -> hex digit value
+for _digit, _code in enumerate(b"0123456789ABCDEF"):
+    _HEX_VALUES[_code] = _digit
+for _digit, _code in enumerate(b"abcdef", start=10):
+    _HEX_VALUES[_code] = _digit
+MAX_SENTENCE_LENGTH = 82 # NMEA 0183 limit, from '$' to the end of the line ending
+_SENTENCE = re.compile(rb"\$([A-Z0-9]{2,}?)([A-Z]{3}),([^*$\r\n]*)\*([0-9A-Fa-f]{2})") # talker, type, fields, checksum
+_TALKER_ID = re.compile(rb"[A-Z0-9]{2,}")
+
+SENTENCE_HANDLERS: dict = {} # sentence type (bytes) -> handler(fields) -> list of (sensor, value, unit, status)
+
+
+def sentence_handler(sentence_type: str):
+    """
+    A decorator that registers a parser for an NMEA sentence type.
+
+    The handler receives the data fields of the sentence (list of bytes, without the address field and checksum)
+    and returns a list of (sensor, value, unit, status) tuples.
+
+    Args:
+    -----
+    - sentence_type(str): Three letter sentence type, eg. "ROT"
+    """
+    def register(handler):
+        SENTENCE_HANDLERS[sentence_type.encode('ascii')] = handler
+        return handler
+    return register
+
+
+def decode_address(key, talker_id: bytes, sentence_type: bytes) -> tuple | None:
+    """
+    Validate and decode the address field of a sentence with a registered type. The address fields come from the
+    network, so only valid ones are cached, at most MAX_CACHED_ADDRESSES of them.
+
+    Returns:
+    --------
+    - tuple | None: (talker_id, sentence_type) as str, None for an invalid talker id
+    """
+    if _TALKER_ID.fullmatch(talker_id) is None:
+        return None
+    decoded = (talker_id.decode('ascii'), sentence_type.decode('ascii'))
+    if len(_ADDRESSES) < MAX_CACHED_ADDRESSES:
+        _ADDRESSES[key] = decoded
+    return decoded
+
+
+def nmea_checksum(data) -> int:
+    """
+    XOR of all bytes of the buffer, computed on the whole buffer at once.
+
+    The buffer is read as one big integer and folded in halves (XOR of the upper and lower half) until a single
+    byte is left. That is a fixed handful of integer operations, only the folds needed for the buffer length are
+    done, instead of one Python operation per character.
+
+    Args:
+    -----
+    - data(bytes|memoryview): The sentence between '$' and '*' (NMEA sentences are at most 82 bytes, longer
+      buffers are folded down to 128 bytes first)
+
+    Returns:
+    --------
+    - int: The checksum
+    """
+    value = int.from_bytes(data, "little")
+    length = len(data)
+    while length > 128: # not a valid NMEA 0183 sentence, but the framer passes lines of up to max_buffer bytes
+        length = (length + 1) // 2
+        value = (value >> (8 * length)) ^ (value & ((1 << (8 * length)) - 1))
+    if length > 64:
+        value = (value >> 512) ^ (value & _MASK_512)
+    if length > 32:
+        value = (value >> 256) ^ (value & _MASK_256)
+    if length > 16:
+        value = (value >> 128) ^ (value & _MASK_128)
+    if length > 8:
+        value = (value >> 64) ^ (value & _MASK_64)
+    value = (value >> 32) ^ (value & 0xFFFFFFFF)
+    value = (value >> 16) ^ (value & 0xFFFF)
+    return (value >> 8) ^ (value & 0xFF)
+
+
+def parse_sentence(sentence: bytes, sentence_types=None):
+    """
+    Parse one framed NMEA sentence without decoding it to str.
+
+    Per call this costs about the same as a str based parser (see benchmarks/bench_nmea_parser.py), the streaming
+    readers use parse_buffer() for whole received blocks.
+
+    Args:
+    -----
+    - sentence(bytes): One sentence starting with '$', with or without the line ending
+    - sentence_types(set, optional): Sentence types (bytes) to parse, others are skipped before the checksum is computed
+
+    Returns:
+    --------
+    - tuple | None: (talker_id, sentence_type, [(sensor, value, unit, status), ...]) or None if the sentence is
+      invalid or has no registered handler
+    """
+    star = sentence.rfind(b"*")
+    if star == -1 or sentence[:1] != b"$":
+        logger.error("Invalid NMEA format %r", sentence)
+        return None
+    if star + 3 > MAX_SENTENCE_LENGTH - 2: # '$' .. checksum without the CRLF
+        logger.error("NMEA sentence longer than %d characters: %r", MAX_SENTENCE_LENGTH, sentence[:MAX_SENTENCE_LENGTH])
+        return None
+    comma = sentence.find(b",", 1, star)
+    if comma == -1:
+        logger.error("Invalid NMEA format %r", sentence)
+        return None
+    sentence_type = sentence[comma - 3:comma]
+    handler = SENTENCE_HANDLERS.get(sentence_type)
+    if handler is None or (sentence_types is not None and sentence_type not in sentence_types):
+        return None
+    view = memoryview(sentence)
+    calculated_checksum = nmea_checksum(view[1:star])
+    received_checksum = sentence[star + 1:star + 3]
+    expected_checksum = _HEX_CHECKSUMS[calculated_checksum]
+    if received_checksum != expected_checksum and received_checksum.upper() != expected_checksum:
+        CHECKSUM_FAILURES.inc()
+        logger.error("Checksum mismatch. Received: %r, Calculated: %r", received_checksum, expected_checksum)
+        return None
+    try:
+        values = handler(sentence[comma + 1:star].split(b","))
+    except (IndexError, ValueError) as e:
+        logger.error("Failed to parse nmea message %r: %s", sentence, e)
+        return None
+    address = view[1:comma]
+    decoded = _ADDRESSES.get(address)
+    if decoded is None:
+        decoded = decode_address(bytes(address), sentence[1:comma - 3], sentence_type)
+        if decoded is None:
+            logger.error("Invalid NMEA talker id %r", sentence)
+            return None
+    return decoded[0], decoded[1], values
+
+
+def parse_buffer(buffer: bytes, sentence_types=None) -> list:
+    """
+    Parse every complete sentence of a received block in one pass.
+
+    The sentences are located with one compiled regular expression over the whole block and all checksums are
+    computed together with numpy (XOR reduce between each '$' and '*'), so only the valid sentences with a
+    registered handler cost Python work. This is the fast path for the streaming readers.
+
+    Args:
+    -----
+    - buffer(bytes): One or more complete sentences, eg. the block returned by NmeaSentenceFramer.feed_block()
+    - sentence_types(set, optional): Sentence types (bytes) to parse, others are skipped
+
+    Returns:
+    --------
+    - list: (talker_id, sentence_type, [(sensor, value, unit, status), ...]) tuples in stream order
+    """
+    matches = list(_SENTENCE.finditer(buffer))
+    if not matches:
+        return []
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    bounds = np.empty(2 * len(matches), dtype=np.intp)
+    bounds[0::2] = [match.start() + 1 for match in matches] # first byte after '$'
+    bounds[1::2] = [match.end(3) for match in matches] # the '*'
+    calculated = np.bitwise_xor.reduceat(data, bounds)[0::2]
+    stars = bounds[1::2]
+    received = _HEX_VALUES[data[stars + 1]] * 16 + _HEX_VALUES[data[stars + 2]]
+    parsed = []
+    handlers = SENTENCE_HANDLERS
+    for match, valid in zip(matches, (calculated == received).tolist()):
+        talker_id, sentence_type, fields, _ = match.groups()
+        handler = handlers.get(sentence_type)
+        if handler is None or (sentence_types is not None and sentence_type not in sentence_types):
+            continue
+        if match.end() - match.start() > MAX_SENTENCE_LENGTH - 2:
+            logger.error("NMEA sentence longer than %d characters: %r", MAX_SENTENCE_LENGTH, match.group(0)[:MAX_SENTENCE_LENGTH])
+            continue
+        if not valid:
+            CHECKSUM_FAILURES.inc()
+            logger.error("Checksum mismatch in NMEA sentence %r", match.group(0))
+            continue
+        try:
+            values = handler(fields.split(b","))
+        except (IndexError, ValueError) as e:
+            logger.error("Failed to parse nmea message %r: %s", match.group(0), e)
+            continue
+        address = (talker_id, sentence_type)
+        decoded = _ADDRESSES.get(address) or decode_address(address, talker_id, sentence_type)
+        parsed.append((decoded[0], decoded[1], values))
+    return parsed
+
+
+@sentence_handler("ROT")
+def parse_rot(fields: list) -> list:
+    """
+    $--ROT,x.x,A*hh : rate of turn in degrees per minute (negative to port), status A = valid, V = invalid
+    """
+    return [("ROT", float(fields[0]), "deg", "V" if fields[1] == b"V" else "A")]
+
+
+@sentence_handler("HDT")
+def parse_hdt(fields: list) -> list:
+    """
+    $--HDT,x.x,T*hh : true heading in degrees
+    """
+    return [("HDT", float(fields[0]), "deg", "A")]
+
+
+@sentence_handler("VTG")
+def parse_vtg(fields: list) -> list:
+    """
+    $--VTG,x.x,T,x.x,M,x.x,N,x.x,K[,a]*hh : course over ground (true) and speed over ground in knots
+    """
+    status = "V" if len(fields) > 8 and fields[8] == b"N" else "A" # mode indicator N = data not valid
+    return [("COG", float(fields[0]), "deg", status),
+            ("SOG", float(fields[4]), "kn", status)]
@@ -0,0 +1,147 @@
+"""
+NMEA sources besides the TCP stream: UDP (unicast and multicast, as used by IEC 61162-450 ship networks) and the
+selection between redundant sources.
+
+Datagrams are read in batches: when the socket becomes readable every datagram waiting in the receive buffer is read
+in one go (up to NMEA_UDP_BATCH), the nearest to recvmmsg() the standard library offers, and the datagrams of a
+sender are parsed as one block with nmea_parser.parse_buffer(). A full bridge feed then costs one event loop wakeup
+and one parser pass per batch instead of per sentence. The "UdPbC" header and the TAG blocks of 61162-450 datagrams
+are skipped by the parser, which only picks up the '$' sentences.
+"""
+import re
+import socket
+import struct
+from configs import config
+from utils import metrics
+from utils.logger import get_logger
+
+logger = get_logger("nmea_logger", file_name= 'logs/nmea_client.log')
+
+DATAGRAMS = metrics.counter("gateway_nmea_datagrams_total", "NMEA datagrams received over UDP")
+DUPLICATES = metrics.counter("gateway_nmea_duplicates_total", "NMEA sentences dropped because another source delivers the same talker and sentence type")
+SOURCE_SWITCHES = metrics.counter("gateway_nmea_source_switches_total", "Talker and sentence types that moved to another source after their source went silent")
+
+_TAG_SOURCE = re.compile(rb"\\(?:[^\\*]*,)?s:([^,*\\]+)") # "s:" source identifier of a 61162-450 TAG block
+
+
+class SourceSelector:
+    """
+    Keeps one source per talker and sentence type when the same data arrives over redundant paths (eg. the two LANs
+    of an IEC 61162-450 network, or a TCP stream and a multicast group of the same bridge).
+
+    The first source of a talker and sentence type owns it, the same talker and type from other sources is dropped
+    while the owner keeps sending. When the owner has been silent for `timeout` seconds the next source that
+    delivers takes over, so a failed path costs at most one timeout of data.
+
+    Sentences with an IEC 61162-450 TAG block are told apart by the "s:" source identifier of the sending device, so
+    two devices with the same talker id (eg. two GP receivers) are both kept and only the copies of one device that
+    arrive over several paths are dropped. Without a TAG block nothing but the talker id and sentence type identifies
+    the device: two devices with the same talker and sentence type on different sources (eg. two TI rate of turn
+    sensors on plain TCP streams) are then taken for redundant paths and only one of them is used. Give such devices
+    distinct talker ids, or set NMEA_SOURCE_TIMEOUT = 0 to keep every source.
+
+    Attributes:
+    - timeout(float): Seconds of silence after which another source takes over, 0 accepts every source.
+    """
+    def __init__(self, timeout: float = config.NMEA_SOURCE_TIMEOUT) -> None:
+        self.timeout = timeout
+        self._timeout_ns = int(timeout * 1e9)
+        self._owners: dict[tuple, list] = {} # (device, talker id, sentence type) -> [source, last accepted timestamp_ns]
+
+    def accept(self, source: str, talker_id: str, sentence_type: str, timestamp_ns: int, device: str = "") -> bool:
+        """
+        Returns True if the sentence should be used, False if another source delivers it.
+
+        Args:
+        -----
+        source(str): The path the sentence arrived on, eg. "host:port" of the sender
+        talker_id(str), sentence_type(str): Address field of the sentence
+        timestamp_ns(int): Time the sentence was received
+        device(str): TAG block "s:" source identifier of the sending device, empty if the sentence had no TAG block
+        """
+        if not self.timeout:
+            return True
+        key = (device, talker_id, sentence_type)
+        owner = self._owners.get(key)
+        if owner is None:
+            self._owners[key] = [source, timestamp_ns]
+            logger.info("NMEA %s%s%s is read from %s", talker_id, sentence_type, f" of {device}" if device else "", source)
+            return True
+        if owner[0] == source:
+            owner[1] = timestamp_ns
+            return True
+        if timestamp_ns - owner[1] > self._timeout_ns:
+            logger.warning("NMEA %s%s%s moved from %s to %s after %.1f s of silence", talker_id, sentence_type,
+                           f" of {device}" if device else "", owner[0], source, (timestamp_ns - owner[1]) / 1e9)
+            SOURCE_SWITCHES.inc()
+            owner[0], owner[1] = source, timestamp_ns
+            return True
+        DUPLICATES.inc()
+        return False
+
+
+def open_datagram_socket(port: int, group: str | None = None, interface: str = "0.0.0.0",
+                         receive_buffer: int = config.NMEA_UDP_RECEIVE_BUFFER) -> socket.socket:
+    """
+    Open a non blocking UDP socket for NMEA datagrams and join the multicast group if one is given.
+
+    Several gateways (or other bridge applications) can listen to the same group and port, the address is bound
+    with SO_REUSEADDR and SO_REUSEPORT where available.
+
+    Args:
+    -----
+    port(int): UDP port
+    group(str, optional): Multicast group, eg. "239.192.0.1", None for unicast/broadcast datagrams
+    interface(str): Address of the interface to listen on (and to join the group on)
+    receive_buffer(int): SO_RCVBUF in bytes, large enough to hold the datagrams of a burst between two batches
+
+    Returns:
+    --------
+    socket.socket: The bound socket
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+        sock.bind(("" if group else interface, port))
+        if group:
+            membership = struct.pack("4s4s", socket.inet_aton(group), socket.inet_aton(interface))
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        sock.setblocking(False)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def tag_source(datagram: bytes) -> str:
+    """
+    Returns the "s:" source identifier of the first TAG block of a datagram, empty if it has none.
+    """
+    start = datagram.find(b"$")
+    match = _TAG_SOURCE.search(datagram, 0, len(datagram) if start == -1 else start)
+    return match.group(1).decode("ascii", errors="replace") if match else ""
+
+
+def receive_datagrams(sock: socket.socket, max_datagrams: int = config.NMEA_UDP_BATCH) -> dict:
+    """
+    Read the datagrams waiting on a non blocking socket, at most max_datagrams.
+
+    Returns:
+    --------
+    dict: (sender "host:port", TAG source identifier) -> the datagrams joined into one block, in arrival order. The
+    source identifier is taken from the first TAG block of each datagram (61162-450 sends one sentence per datagram).
+    """
+    blocks: dict[str, list] = {}
+    count = 0
+    while count < max_datagrams:
+        try:
+            data, address = sock.recvfrom(65535)
+        except (BlockingIOError, InterruptedError):
+            break
+        count += 1
+        blocks.setdefault((f"{address[0]}:{address[1]}", tag_source(data)), []).append(data)
+    DATAGRAMS.inc(count)
+    return {key: b"\r\n".join(datagrams) + b"\r\n" for key, datagrams in blocks.items()}
@@ -0,0 +1,138 @@
+import sqlite3
+import threading
+import time
+import os
+from utils.logger import get_logger
+
+logger = get_logger("mqtt_logger", file_name='logs/mqtt_publisher.log')
+
+
+class OutboundQueue:
+    """
+    A persistent store-and-forward queue for MQTT messages that could not be sent while the broker was offline.
+
+    Messages are kept in an SQLite table in WAL mode. Writes are collected in memory and inserted in batches,
+    so a burst of readings costs one transaction. Retention is capped by the size of the database and by the
+    age of the oldest message, the oldest messages are removed first.
+
+    Attributes:
+    - path(str): Path of the SQLite database file.
+    - max_bytes(int): Maximum size of the stored messages in bytes.
+    - max_age(float): Maximum age of a stored message in seconds.
+    - batch_size(int): Number of pending messages that triggers an insert.
+    """
+    def __init__(self, path: str, max_bytes: int, max_age: float, batch_size: int = 100) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.batch_size = batch_size
+        self._pending: list[tuple] = []
+        self._lock = threading.Lock() # the queue is used from the event loop and from worker threads
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL") # durable enough in WAL mode and avoids an fsync per commit
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbound ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "created REAL NOT NULL, "
+            "topic TEXT NOT NULL, "
+            "payload BLOB NOT NULL, "
+            "qos INTEGER NOT NULL)"
+        )
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(outbound)")]
+        if "encoding" not in columns: # queues written before payload encodings existed hold text payloads
+            self._conn.execute("ALTER TABLE outbound ADD COLUMN encoding TEXT")
+        self._page_size = self._conn.execute("PRAGMA page_size").fetchone()[0]
+        self._stored = self._conn.execute("SELECT COUNT(*) FROM outbound").fetchone()[0]
+        if self._stored:
+            logger.info(f"Outbound queue '{path}' holds {self._stored} messages from a previous run")
+
+    def __len__(self) -> int:
+        return self._stored + len(self._pending)
+
+    def put(self, topic: str, payload: str | bytes, qos: int = 1, encoding: str | None = None) -> None:
+        """
+        Add a message to the queue, the message is written to disk with the next batch.
+
+        Args:
+        -----
+        topic(str): MQTT topic of the message
+        payload(str|bytes): Message payload
+        qos(int): Quality of service level to publish with
+        encoding(str, optional): Payload format (see payload_codecs), None for text
+        """
+        with self._lock:
+            self._pending.append((time.time(), topic, payload, qos, encoding))
+            if len(self._pending) < self.batch_size:
+                return
+        self.flush()
+
+    def flush(self) -> None:
+        """
+        Write all pending messages to disk in one transaction and apply the retention limits.
+        """
+        with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, []
+            try:
+                with self._conn:
+                    self._conn.execute("BEGIN")
+                    self._conn.executemany("INSERT INTO outbound (created, topic, payload, qos, encoding) VALUES (?, ?, ?, ?, ?)", pending)
+                self._stored += len(pending)
+            except sqlite3.Error as e:
+                logger.error("Failed to store %d messages in outbound queue: %s", len(pending), e)
+                return
+            self._enforce_retention()
+
+    def _enforce_retention(self) -> None:
+        expired = self._conn.execute("DELETE FROM outbound WHERE created < ?", (time.time() - self.max_age,)).rowcount
+        evicted = 0
+        while self._stored - expired - evicted > 0 and self._used_bytes() > self.max_bytes:
+            evicted += self._conn.execute(
+                "DELETE FROM outbound WHERE id IN (SELECT id FROM outbound ORDER BY id LIMIT ?)", (self.batch_size,)
+            ).rowcount
+        self._stored -= expired + evicted
+        if expired or evicted:
+            logger.warning("Outbound queue retention removed %d expired and %d oldest messages", expired, evicted)
+
+    def _used_bytes(self) -> int:
+        pages = self._conn.execute("PRAGMA page_count").fetchone()[0]
+        free_pages = self._conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return (pages - free_pages) * self._page_size
+
+    def peek(self, limit: int, after_id: int = 0) -> list:
+        """
+        Return the oldest stored messages in the order they were queued.
+
+        Args:
+        -----
+        limit(int): Maximum number of messages to return
+        after_id(int): Only return messages with a larger id, to skip the ones already handed to the MQTT client
+
+        Returns:
+        --------
+        list: (id, topic, payload, qos, encoding) tuples
+        """
+        self.flush()
+        with self._lock:
+            return self._conn.execute("SELECT id, topic, payload, qos, encoding FROM outbound WHERE id > ? ORDER BY id LIMIT ?",
+                                      (after_id, limit)).fetchall()
+
+    def remove(self, ids: list) -> None:
+        """
+        Remove messages by id, called once the broker acknowledged them. Ids removed by the retention limits in the
+        meantime are skipped.
+        """
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN")
+                removed = self._conn.executemany("DELETE FROM outbound WHERE id = ?", [(row_id,) for row_id in ids]).rowcount
+            self._stored -= removed
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,274 @@
+"""
+MQTT payload encodings.
+
+"text" is the original human readable payload, one message per reading. The batch formats pack many readings in
+one message: readings are grouped per sensor and stored column wise with a base timestamp and millisecond
+offsets, so a reading costs a few bytes instead of a full PUBLISH packet.
+
+Batch formats:
+- "struct": fixed binary layout, no dependency (see StructCodec)
+- "json": the batch document as JSON, no dependency, for debugging
+- "msgpack": the batch document as MessagePack (requires the msgpack package)
+- "cbor": the batch document as CBOR (requires the cbor2 package)
+
+Every message is published with the MQTTv5 user properties "schema" and "schema-version" and a content type, so
+consumers can pick the decoder. The window summaries of the aggregation stage are JSON documents with their own
+schema ("stats" encoding).
+"""
+import json
+import struct
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+try:
+    import msgpack
+except ImportError: # optional, only needed for MQTT_PAYLOAD_FORMAT = "msgpack"
+    msgpack = None
+try:
+    import cbor2
+except ImportError: # optional, only needed for MQTT_PAYLOAD_FORMAT = "cbor"
+    cbor2 = None
+
+SCHEMA_NAME = "gateway-readings"
+SCHEMA_VERSION = 1
+STATS_SCHEMA_NAME = "gateway-window-stats"
+
+
+def group_readings(readings: list) -> dict:
+    """
+    Group readings per sensor in arrival order.
+
+    Returns:
+    --------
+    dict: sensor -> list of readings
+    """
+    groups: dict = {}
+    for reading in readings:
+        groups.setdefault(reading.sensor, []).append(reading)
+    return groups
+
+
+def batch_document(readings: list) -> dict:
+    """
+    The column wise batch document shared by the json, msgpack and cbor codecs.
+
+    {"v": 1, "sensors": {sensor: {"unit": "C", "t0": epoch seconds, "dt": [ms since t0], "values": [...],
+                                  "valid": [true, ...]}}}
+    """
+    sensors = {}
+    for sensor, group in group_readings(readings).items():
+        base = group[0].timestamp
+        sensors[sensor] = {"unit": group[0].unit,
+                           "t0": base,
+                           "dt": [round((reading.timestamp - base) * 1000) for reading in group],
+                           "values": [reading.value for reading in group],
+                           "valid": [reading.is_valid for reading in group]}
+    return {"v": SCHEMA_VERSION, "sensors": sensors}
+
+
+def readings_from_document(document: dict) -> list:
+    """
+    Returns:
+    --------
+    list: (sensor, value, unit, valid, timestamp) tuples of a batch document
+    """
+    readings = []
+    for sensor, group in document["sensors"].items():
+        for offset, value, valid in zip(group["dt"], group["values"], group["valid"]):
+            readings.append((sensor, value, group["unit"], valid, group["t0"] + offset / 1000))
+    return readings
+
+
+class TextCodec:
+    """
+    The original payload: one "<value> <unit>, Valid, <date> at <time> UTC" message per reading, the time in UTC with
+    milliseconds.
+    """
+    name = "text"
+    content_type = "text/plain"
+    batched = False
+
+    def encode(self, readings: list) -> bytes:
+        return readings[0].__str__().encode()
+
+
+class StructCodec:
+    """
+    Fixed little endian binary layout:
+
+    envelope: "GW" magic, version (uint8), number of sensor groups (uint16)
+    group:    name length (uint8) + utf-8 name, unit length (uint8) + utf-8 unit, base timestamp (float64 epoch
+              seconds), number of readings (uint16)
+    reading:  ms since the base timestamp (uint32), value (float64), valid (uint8) -> 13 bytes
+
+    The value is a float64 so int32 and uint32 registers and counters pass without rounding.
+    """
+    name = "struct"
+    content_type = "application/x-gateway-readings"
+    batched = True
+    ENVELOPE = struct.Struct("<2sBH")
+    GROUP = struct.Struct("<dH")
+    READING = struct.Struct("<IdB")
+    MAGIC = b"GW"
+
+    def encode(self, readings: list) -> bytes:
+        groups = group_readings(readings)
+        parts = [self.ENVELOPE.pack(self.MAGIC, SCHEMA_VERSION, len(groups))]
+        for sensor, group in groups.items():
+            name, unit = sensor.encode()[:255], group[0].unit.encode()[:255]
+            base = group[0].timestamp
+            parts.append(bytes((len(name),)) + name + bytes((len(unit),)) + unit + self.GROUP.pack(base, len(group)))
+            parts.extend(self.READING.pack(max(0, round((reading.timestamp - base) * 1000)), reading.value, reading.is_valid)
+                         for reading in group)
+        return b"".join(parts)
+
+    def decode(self, payload: bytes) -> list:
+        """
+        Returns:
+        --------
+        list: (sensor, value, unit, valid, timestamp) tuples
+        """
+        magic, version, group_count = self.ENVELOPE.unpack_from(payload)
+        if magic != self.MAGIC or version != SCHEMA_VERSION:
+            raise ValueError(f"Not a version {SCHEMA_VERSION} gateway batch")
+        offset = self.ENVELOPE.size
+        readings = []
+        for _ in range(group_count):
+            name = payload[offset + 1:offset + 1 + payload[offset]].decode()
+            offset += 1 + payload[offset]
+            unit = payload[offset + 1:offset + 1 + payload[offset]].decode()
+            offset += 1 + payload[offset]
+            base, count = self.GROUP.unpack_from(payload, offset)
+            offset += self.GROUP.size
+            for milliseconds, value, valid in self.READING.iter_unpack(payload[offset:offset + count * self.READING.size]):
+                readings.append((name, value, unit, bool(valid), base + milliseconds / 1000))
+            offset += count * self.READING.size
+        return readings
+
+
+class JsonCodec:
+    name = "json"
+    content_type = "application/json"
+    batched = True
+
+    def encode(self, readings: list) -> bytes:
+        return json.dumps(batch_document(readings), separators=(",", ":")).encode()
+
+    def decode(self, payload: bytes) -> list:
+        return readings_from_document(json.loads(payload))
+
+
+class MsgpackCodec:
+    name = "msgpack"
+    content_type = "application/msgpack"
+    batched = True
+
+    def encode(self, readings: list) -> bytes:
+        return msgpack.packb(batch_document(readings))
+
+    def decode(self, payload: bytes) -> list:
+        return readings_from_document(msgpack.unpackb(payload))
+
+
+class CborCodec:
+    name = "cbor"
+    content_type = "application/cbor"
+    batched = True
+
+    def encode(self, readings: list) -> bytes:
+        return cbor2.dumps(batch_document(readings))
+
+    def decode(self, payload: bytes) -> list:
+        return readings_from_document(cbor2.loads(payload))
+
+
+class StatsCodec:
+    """
+    Window summaries of the aggregation stage (see aggregation.SensorWindow.summary), not a reading payload format.
+    """
+    name = "stats"
+    content_type = "application/json"
+    batched = False
+    schema = STATS_SCHEMA_NAME
+
+    def encode(self, summary: dict) -> bytes:
+        return json.dumps(summary, separators=(",", ":")).encode()
+
+
+CODECS = {codec.name: codec for codec in (TextCodec, StructCodec, JsonCodec, MsgpackCodec, CborCodec)}
+ENCODINGS = {**CODECS, StatsCodec.name: StatsCodec} # everything that can be published, with its properties
+OPTIONAL_DEPENDENCIES = {"msgpack": ("msgpack", msgpack), "cbor": ("cbor2", cbor2)} # format -> (package, module)
+
+
+def get_codec(name: str):
+    """
+    Returns:
+    --------
+    The codec registered under name, ValueError if it is unknown or its package is not installed.
+    """
+    if name not in CODECS:
+        raise ValueError(f"Unknown payload format '{name}', expected one of {tuple(CODECS)}")
+    package, module = OPTIONAL_DEPENDENCIES.get(name, (None, True))
+    if module is None:
+        raise ValueError(f"Payload format '{name}' requires the {package} package (pip install {package})")
+    return CODECS[name]()
+
+
+def publish_properties(codec_name: str) -> Properties:
+    """
+    MQTTv5 PUBLISH properties describing the payload: content type, payload format and schema user properties.
+    """
+    codec = ENCODINGS[codec_name]
+    properties = Properties(PacketTypes.PUBLISH)
+    properties.ContentType = codec.content_type
+    properties.PayloadFormatIndicator = 1 if codec.name in ("text", "json", "stats") else 0 # 1 = UTF-8 text
+    schema = getattr(codec, "schema", SCHEMA_NAME if codec.batched else "text")
+    properties.UserProperty = [("schema", schema),
+                               ("schema-version", str(SCHEMA_VERSION)),
+                               ("encoding", codec.name)]
+    return properties
+
+
+class PayloadBatcher:
+    """
+    Collects readings per topic until a batch is full or its time window is over.
+
+    Attributes:
+    - max_readings(int): Readings per batch, a full batch is returned by add() right away.
+    - window(float): Seconds after the first reading of a batch when due() returns it.
+    """
+    def __init__(self, max_readings: int, window: float) -> None:
+        self.max_readings = max_readings
+        self.window = window
+        self._batches: dict = {} # topic -> [opened (loop time), readings]
+
+    def __len__(self) -> int:
+        return sum(len(readings) for _, readings in self._batches.values())
+
+    def add(self, topic: str, reading, now: float) -> list | None:
+        """
+        Add a reading to the batch of its topic.
+
+        Returns:
+        --------
+        list | None: The readings of the batch if it is full, it is removed from the batcher.
+        """
+        batch = self._batches.get(topic)
+        if batch is None:
+            batch = self._batches[topic] = [now, []]
+        batch[1].append(reading)
+        if len(batch[1]) >= self.max_readings:
+            del self._batches[topic]
+            return batch[1]
+        return None
+
+    def due(self, now: float, force: bool = False) -> list:
+        """
+        Remove and return the batches whose window is over (or all batches with force=True).
+
+        Returns:
+        --------
+        list: (topic, readings) tuples
+        """
+        ready = [topic for topic, (opened, _) in self._batches.items() if force or now - opened >= self.window]
+        return [(topic, self._batches.pop(topic)[1]) for topic in ready]
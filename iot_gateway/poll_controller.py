@@ -0,0 +1,70 @@
+import numpy as np
+from configs import config
+
+
+class AdaptivePollInterval:
+    """
+    Poll interval of one register block, derived from how fast its values move compared to their deadband.
+
+    After every read the rate of change of each register is expressed in deadbands per second. The fastest register
+    sets the interval: it is polled `deadband_fraction / rate` seconds apart, so a moving value is sampled several
+    times before it crosses its deadband. The interval drops right away when the values start moving and grows by at
+    most `backoff` per poll when they settle, always within [min_interval, max_interval].
+
+    Attributes:
+    - interval(float): Current poll interval in seconds, starts at the configured poll interval.
+    - min_interval(float): Shortest allowed interval.
+    - max_interval(float): Longest allowed interval, keep it below the heartbeat of the change filter.
+    - deadbands(np.ndarray): Deadband of every register of the block.
+    - deadband_fraction(float): Fraction of the deadband a value may move between two polls.
+    - backoff(float): Maximum growth factor of the interval per poll.
+    - smoothing(float): Weight of a new rate sample when the rate falls (rises are taken as they are).
+    """
+    def __init__(self, interval: float, min_interval: float, max_interval: float, deadbands,
+                 deadband_fraction: float = config.POLL_DEADBAND_FRACTION, backoff: float = config.POLL_BACKOFF_FACTOR,
+                 smoothing: float = 0.3) -> None:
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.interval = min(max(interval, self.min_interval), self.max_interval)
+        self.deadbands = np.asarray(deadbands, dtype=np.float64)
+        self.deadband_fraction = deadband_fraction
+        self.backoff = backoff
+        self.smoothing = smoothing
+        self.rate = 0.0 # deadbands per second of the fastest register
+        self.max_rate = deadband_fraction / min_interval if min_interval > 0 else float("inf") # any faster rate gives min_interval
+        self._last_values: np.ndarray | None = None
+        self._last_time = 0.0
+
+    def update(self, values, timestamp: float) -> float:
+        """
+        Feed the values of a read and return the interval until the next one.
+
+        Args:
+        -----
+        values(array-like): Register values in the order of the deadbands
+        timestamp(float): Time of the read in seconds, the measured time between reads is used so a late poll does
+        not look like a fast change
+
+        Returns:
+        --------
+        float: The new poll interval in seconds
+        """
+        values = np.asarray(values, dtype=np.float64)
+        last_values, last_time = self._last_values, self._last_time
+        self._last_values, self._last_time = values, timestamp
+        elapsed = timestamp - last_time
+        if last_values is None or elapsed <= 0:
+            return self.interval
+        changes = np.abs(values - last_values)
+        # a register without a deadband counts any change as a full deadband, NaN values (eg. float32 registers) are ignored
+        moved = np.divide(changes, self.deadbands, out=np.where(changes > 0, 1.0, 0.0), where=self.deadbands > 0)
+        rate = min(float(np.nanmax(moved, initial=0.0)) / elapsed, self.max_rate)
+        if not np.isfinite(self.rate):
+            self.rate = 0.0
+        self.rate = rate if rate >= self.rate else self.rate + self.smoothing * (rate - self.rate)
+        target = self.deadband_fraction / self.rate if self.rate > 0 else self.max_interval
+        if target < self.interval:
+            self.interval = max(self.min_interval, target)
+        else:
+            self.interval = min(self.max_interval, target, self.interval * self.backoff)
+        return self.interval
@@ -0,0 +1,59 @@
+from datetime import datetime, timezone
+from utils.clock import CLOCK
+
+
+class Reading:
+    """
+    A compact representation of a single sensor reading, shared by the Modbus and NMEA handlers.
+
+    The class uses __slots__ and an integer epoch timestamp instead of a per instance dict and a datetime object,
+    and it does not keep a reference to the previous reading, so readings are freed as soon as they are published.
+    The timestamp is the time the reading was received at the socket (see utils/clock.py), not the time the object
+    was created.
+
+    Attributes:
+    - sensor(str): The name of the sensor, used to look up the MQTT topic.
+    - value(float): The value of the reading.
+    - unit(str): The unit shown in the payload, eg. "C" or "deg".
+    - status(str): "A" for valid and "V" for invalid data (NMEA convention).
+    - timestamp_ns(int): Reading time as UTC epoch nanoseconds, the timestamp property gives epoch seconds. The
+      constructor takes either (default now).
+    - send_point(bool): A flag if the reading meets the criteria to be sent to the broker.
+    - source(str): Where the reading came from, eg. the NMEA talker id.
+    - sensor_id(int): Row of the sensor in the sensor registry, -1 if the reading was created without the registry.
+    - received_ns(int): time.monotonic_ns() when the reading arrived at the socket, used for the end to end latency,
+      0 if unknown (eg. replays).
+    """
+    __slots__ = ("sensor", "value", "unit", "status", "timestamp_ns", "send_point", "source", "sensor_id", "received_ns")
+
+    def __init__(self, sensor: str, value: float, unit: str, status: str = "A", timestamp: float | None = None,
+                 send_point: bool = True, source: str = "", sensor_id: int = -1, timestamp_ns: int | None = None,
+                 received_ns: int = 0) -> None:
+        self.sensor = sensor
+        self.value = value
+        self.unit = unit
+        self.status = status
+        if timestamp_ns is None:
+            timestamp_ns = CLOCK.now_ns() if timestamp is None else round(timestamp * 1e9)
+        self.timestamp_ns = timestamp_ns
+        self.send_point = send_point
+        self.source = source
+        self.sensor_id = sensor_id
+        self.received_ns = received_ns
+
+    @property
+    def timestamp(self) -> float:
+        return self.timestamp_ns / 1e9
+
+    @property
+    def is_valid(self) -> bool:
+        return self.status != "V"
+
+    def __repr__(self) -> str:
+        return f"Reading({self.sensor!r}, {self.value!r}, {self.unit!r}, status={self.status!r}, timestamp={self.timestamp!r})"
+
+    def __str__(self) -> str:
+        timestamp = datetime.fromtimestamp(self.timestamp_ns // 1000 / 1e6, timezone.utc)
+        status = "Valid" if self.is_valid else "Invalid"
+        return f"{self.value} {self.unit}, {status}, {timestamp:%Y-%m-%d} at {timestamp:%H:%M:%S.%f}"[:-3] + " UTC"
+
@@ -0,0 +1,114 @@
+"""
+Decoding of Modbus holding registers into values, driven by the register descriptors of the sensor registry.
+
+A descriptor is the register entry of configs/sensors.toml:
+- type: "uint16" (default), "int16", "uint32", "int32" or "float32", the 32 bit types span two registers
+- byte_order: "big" (default, Modbus) or "little" when the device swaps the two bytes of every register
+- word_order: "big" (default, high word first) or "little" for 32 bit values sent low word first
+- mask: bit mask of a status word, the value is the masked bits shifted down to bit 0 (eg. mask = 4 gives 0 or 1)
+- scale, offset: value = decoded * scale + offset
+
+RegisterDecoder compiles the descriptors of one register block into index arrays grouped by layout, so a read is
+decoded with a few NumPy operations per layout instead of per value in Python.
+"""
+import numpy as np
+
+REGISTER_TYPES = {"uint16": (1, np.uint16), "int16": (1, np.int16), "uint32": (2, np.uint32),
+                  "int32": (2, np.int32), "float32": (2, np.float32)} # type -> (registers, dtype)
+ORDERS = ("big", "little")
+
+
+def register_count(register: dict) -> int:
+    """
+    Returns the number of registers a value spans.
+
+    Raises:
+    -------
+    ValueError: Unknown type or byte/word order.
+    """
+    data_type = register.get("type", "uint16")
+    if data_type not in REGISTER_TYPES:
+        raise ValueError(f"Unknown register type '{data_type}' at address {register.get('address')}, expected one of {tuple(REGISTER_TYPES)}")
+    for key in ("byte_order", "word_order"):
+        if register.get(key, "big") not in ORDERS:
+            raise ValueError(f"Unknown {key} '{register[key]}' at address {register.get('address')}, expected one of {ORDERS}")
+    if register.get("mask") and data_type == "float32":
+        raise ValueError(f"A mask needs an integer type, not float32 at address {register.get('address')}")
+    return REGISTER_TYPES[data_type][0]
+
+
+class RegisterDecoder:
+    """
+    Decodes the wanted values of a register block.
+
+    Attributes:
+    - start(int): Address of the first register of the block.
+    - registers(list): Descriptors of the wanted registers, the decoded values are in this order.
+    - offsets(np.ndarray): Position of the first register of every value in the block.
+    - integer(bool): All values are unscaled integers, decode() then returns an int64 array (published as integers).
+    """
+    def __init__(self, registers: list, start: int) -> None:
+        self.start = start
+        self.registers = registers
+        self.offsets = np.array([register["address"] - start for register in registers], dtype=np.intp)
+        layouts: dict[tuple, list] = {}
+        for position, register in enumerate(registers):
+            register_count(register) # validates the descriptor
+            key = (register.get("type", "uint16"), register.get("byte_order", "big"), register.get("word_order", "big"))
+            layouts.setdefault(key, []).append(position)
+        self.groups = [(np.array(positions, dtype=np.intp), self.offsets[positions], REGISTER_TYPES[data_type][0],
+                        REGISTER_TYPES[data_type][1], byte_order == "little", word_order == "little")
+                       for (data_type, byte_order, word_order), positions in layouts.items()]
+        masks = np.array([register.get("mask", 0) for register in registers], dtype=np.int64)
+        self.mask_positions = np.flatnonzero(masks)
+        self.masks = masks[self.mask_positions]
+        self.shifts = np.array([(int(mask) & -int(mask)).bit_length() - 1 for mask in self.masks], dtype=np.int64)
+        self.scale = np.array([register.get("scale", 1.0) for register in registers], dtype=np.float64)
+        self.offset = np.array([register.get("offset", 0.0) for register in registers], dtype=np.float64)
+        self.scaled = bool((self.scale != 1).any() or self.offset.any())
+        self.integer = not self.scaled and all(register.get("type", "uint16") != "float32" for register in registers)
+        self.raw = len(self.groups) == 1 and self.groups[0][2:] == (1, np.uint16, False, False) and not len(self.masks) and not self.scaled
+        self._last_values = None
+        self._last_decoded = None
+
+    def __len__(self) -> int:
+        return len(self.registers)
+
+    def decode(self, values) -> np.ndarray:
+        """
+        Decode the wanted values of a read.
+
+        Args:
+        -----
+        values(list): Register values of the block as returned by read_holding_registers
+
+        Returns:
+        --------
+        np.ndarray: One value per descriptor, int64 if all values are unscaled integers, else float64
+        """
+        if values is self._last_values: # the scheduler and the handler decode the same read
+            return self._last_decoded
+        words = np.asarray(values, dtype=np.uint16)
+        if self.raw: # plain uint16 registers
+            decoded = words[self.offsets].astype(np.int64)
+        else:
+            decoded = np.empty(len(self.registers), dtype=np.int64 if self.integer else np.float64)
+            for positions, offsets, size, dtype, byte_swap, word_swap in self.groups:
+                first = words[offsets]
+                if byte_swap:
+                    first = first.byteswap()
+                if size == 1:
+                    decoded[positions] = first.view(dtype)
+                    continue
+                second = words[offsets + 1]
+                if byte_swap:
+                    second = second.byteswap()
+                if word_swap:
+                    first, second = second, first
+                decoded[positions] = ((first.astype(np.uint32) << 16) | second).view(dtype)
+            if len(self.masks):
+                decoded[self.mask_positions] = (decoded[self.mask_positions].astype(np.int64) & self.masks) >> self.shifts
+            if self.scaled:
+                decoded = decoded * self.scale + self.offset
+        self._last_values, self._last_decoded = values, decoded
+        return decoded
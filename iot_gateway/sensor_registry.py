@@ -0,0 +1,243 @@
+"""
+Sensor registry: the declarative sensor definitions of configs/sensors.toml compiled into id indexed lookup tables.
+
+Every sensor gets an integer id. Its unit, change filter limits and MQTT topic are kept in lists and NumPy
+arrays indexed by that id, so the hot paths look a reading up with Reading.sensor_id instead of hashing the long
+sensor name, and a new sensor only needs an entry in the registry file.
+
+Ids are stable while the gateway runs: a reload updates the rows of the known sensors, appends the new ones and keeps
+the row of a removed sensor without a topic. Change filter rows (SensorRegistry.configure) and register tables
+cached by the handlers therefore stay valid across reloads.
+
+The file is read on the first use of a table, not when the module is imported, so importing the gateway does no I/O.
+"""
+try:
+    import tomllib
+except ImportError: # Python < 3.11
+    import tomli as tomllib
+import asyncio
+import numpy as np
+import os
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+from utils.logger import get_logger
+from configs import config
+from .change_filter import DeadbandFilter
+from .register_decoding import register_count
+
+logger = get_logger("iot_gatway_logger", file_name='logs/iot_gatway.log')
+
+DEFAULT_POLL_INTERVAL = 2 # Seconds, poll interval of registers that do not set one
+REGISTER_KEYS = ("min_interval", "max_interval", "type", "byte_order", "word_order", "mask", "scale", "offset") # optional register keys
+TABLES = ("static_text", "ids", "names", "units", "topics", "deadband", "heartbeat", "devices", "registers", "version",
+          "devices_version") # loaded from the file on first use
+
+
+class SensorRegistry:
+    """
+    The compiled sensor registry.
+
+    Attributes:
+    - path(str): The registry file, relative paths are resolved from the project directory.
+    - static_text(str): Topic prefix of the crane.
+    - ids(dict): Sensor name -> sensor id.
+    - names(list), units(list), topics(list): Per sensor id, the topic is None for sensors that are not published.
+    - deadband, heartbeat(np.ndarray): Per sensor id.
+    - devices(list): Modbus devices in the ModbusPollScheduler format, with the decoding descriptors of the registers.
+    - registers(dict): (host, port, unit_id) -> {register address: sensor id}
+    - version(int): Incremented by every change of the tables, devices_version only when the Modbus devices change.
+
+    The tables are loaded from the file on the first access of one of them (see __getattr__()).
+    """
+    def __init__(self, path: str = config.SENSOR_REGISTRY_PATH) -> None:
+        self.path = path if os.path.isabs(path) else os.path.join(PROJECT_DIR, path)
+        self._mtime = None
+
+    def __getattr__(self, name: str):
+        """
+        Only called for attributes that are not set, ie. the tables before the file was loaded. Afterwards the
+        tables are plain attributes and cost nothing extra.
+        """
+        if name not in TABLES:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+        self.load()
+        return self.__dict__[name]
+
+    def _reset(self) -> None:
+        self.static_text = ""
+        self.ids: dict[str, int] = {}
+        self.names: list[str] = []
+        self.units: list[str] = []
+        self.topics: list[str | None] = []
+        self.deadband = np.zeros(0)
+        self.heartbeat = np.zeros(0)
+        self.devices: list = []
+        self.registers: dict[tuple, dict] = {}
+        self.version = 0
+        self.devices_version = 0
+
+    def load(self) -> None:
+        """
+        Read and compile the registry file, the tables are only replaced when the whole file is valid.
+        """
+        mtime = os.stat(self.path).st_mtime_ns
+        with open(self.path, "rb") as file:
+            document = tomllib.load(file)
+        first = "names" not in self.__dict__
+        if first:
+            self._reset()
+        try:
+            self.compile(document)
+        except ValueError:
+            if first: # not loaded yet, the next use tries again instead of getting empty tables
+                for name in TABLES:
+                    self.__dict__.pop(name, None)
+            raise
+        self._mtime = mtime
+
+    def compile(self, document: dict) -> None:
+        """
+        Compile a parsed registry document into the lookup tables.
+
+        Raises:
+        -------
+        ValueError: A sensor is defined twice, a register misses its address or sensor, has an unknown type or a poll
+        interval that is not a positive number of seconds.
+        """
+        static_text = document.get("static_text", "")
+        default_heartbeat = config.MIN_ELAPSED_TIME * 60
+        rows: dict[str, tuple] = {} # name -> (unit, topic, deadband, heartbeat)
+
+        def add(entry: dict, unit: str, deadband: float) -> str:
+            name = entry.get("sensor")
+            if not name:
+                raise ValueError(f"Sensor without a name in {self.path}: {entry}")
+            if name in rows:
+                raise ValueError(f"Sensor '{name}' is defined twice in {self.path}")
+            topic = entry.get("topic")
+            rows[name] = (entry.get("unit", unit), f"{static_text}/{topic}" if topic else None,
+                          entry.get("deadband", deadband), entry.get("heartbeat", default_heartbeat))
+            return name
+
+        devices = []
+        for device in document.get("devices", []):
+            registers = []
+            for register in device.get("registers", []):
+                if "address" not in register:
+                    raise ValueError(f"Register without an address in {self.path}: {register}")
+                register_count(register) # validates the type and byte/word order
+                for key in ("poll_interval", "min_interval", "max_interval"): # the schedulers divide by the intervals
+                    interval = register.get(key, DEFAULT_POLL_INTERVAL)
+                    if isinstance(interval, bool) or not isinstance(interval, (int, float)) or not interval > 0:
+                        raise ValueError(f"Register {register['address']} has an invalid {key} in {self.path}: {interval!r}")
+                name = add(register, "C", config.MIN_TEMPERATURE_CHANGE)
+                compiled = {"address": register["address"], "sensor": name,
+                            "poll_interval": register.get("poll_interval", DEFAULT_POLL_INTERVAL), "deadband": rows[name][2]}
+                for key in REGISTER_KEYS:
+                    if key in register:
+                        compiled[key] = register[key]
+                registers.append(compiled)
+            devices.append({"host": device.get("host", config.MODBUS_HOST),
+                            "port": device.get("port", config.MODUBS_PORT),
+                            "unit_id": device.get("unit_id", config.MODBUS_UNIT_ID),
+                            "registers": registers})
+        for sensor in document.get("sensors", []):
+            add(sensor, "", config.MIN_ROT_CHANGE)
+
+        names = self.names + [name for name in rows if name not in self.ids]
+        table = [rows[name] if name in rows else self._row(self.ids[name], topic=None) for name in names]
+        self.static_text = static_text
+        self.names = names
+        self.ids = {name: sensor_id for sensor_id, name in enumerate(names)}
+        self.units = [row[0] for row in table]
+        self.topics = [row[1] for row in table]
+        self.deadband = np.array([row[2] for row in table], dtype=np.float64)
+        self.heartbeat = np.array([row[3] for row in table], dtype=np.float64)
+        self.registers = {(device["host"], device["port"], device["unit_id"]):
+                          {register["address"]: self.ids[register["sensor"]] for register in device["registers"]}
+                          for device in devices}
+        if devices != self.devices:
+            self.devices = devices
+            self.devices_version += 1
+        self.version += 1
+
+    def _row(self, sensor_id: int, **changes) -> tuple:
+        row = dict(unit=self.units[sensor_id], topic=self.topics[sensor_id], deadband=self.deadband[sensor_id],
+                   heartbeat=self.heartbeat[sensor_id])
+        row.update(changes)
+        return tuple(row.values())
+
+    def sensor_id(self, name: str, deadband: float = config.MIN_ROT_CHANGE) -> int:
+        """
+        Returns the id of a sensor, sensors that are not in the registry are added without a topic.
+        """
+        sensor_id = self.ids.get(name)
+        if sensor_id is None:
+            sensor_id = len(self.names)
+            self.ids[name] = sensor_id
+            self.names.append(name)
+            self.units.append("")
+            self.topics.append(None)
+            self.deadband = np.append(self.deadband, deadband)
+            self.heartbeat = np.append(self.heartbeat, config.MIN_ELAPSED_TIME * 60)
+            self.version += 1
+        return sensor_id
+
+    def resolve(self, names, deadband: float = config.MIN_TEMPERATURE_CHANGE) -> np.ndarray:
+        """
+        Returns the sensor ids of the names as an index array.
+        """
+        return np.array([self.sensor_id(name, deadband) for name in names], dtype=np.intp)
+
+    def topic(self, name: str) -> str | None:
+        """
+        Returns the topic of a sensor by name, for readings created without a sensor id.
+        """
+        sensor_id = self.ids.get(name)
+        return None if sensor_id is None else self.topics[sensor_id]
+
+    def configure(self, change_filter: DeadbandFilter) -> None:
+        """
+        Register every sensor in a change filter with its deadband and heartbeat, so the filter rows are the sensor ids.
+        The filter must only be filled by the registry.
+        """
+        for sensor_id, name in enumerate(self.names):
+            if change_filter.register(name, self.deadband[sensor_id], self.heartbeat[sensor_id]) != sensor_id:
+                raise RuntimeError(f"The rows of the change filter do not match the sensor ids ('{name}')")
+
+    def reload_if_changed(self) -> bool:
+        """
+        Reload the registry if the file changed since it was loaded. An invalid file is logged and the previous
+        tables are kept until the file changes again.
+
+        Returns:
+        --------
+        bool: True if the registry was reloaded.
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError as e:
+            logger.error("Sensor registry '%s' is not readable: %s", self.path, e)
+            return False
+        if mtime == self._mtime:
+            return False
+        try:
+            self.load()
+        except (OSError, ValueError) as e: # tomllib.TOMLDecodeError is a ValueError
+            self._mtime = mtime
+            logger.error("Sensor registry '%s' not reloaded, keeping the previous one: %s", self.path, e)
+            return False
+        logger.info("Reloaded the sensor registry '%s' (%d sensors)", self.path, len(self.names))
+        return True
+
+    async def watch(self, interval: float = config.SENSOR_REGISTRY_RELOAD_INTERVAL) -> None:
+        """
+        Reload the registry when its file changes, checked every interval seconds (0 disables it), runs until cancelled.
+        """
+        if not interval:
+            return
+        while True:
+            await asyncio.sleep(interval)
+            self.reload_if_changed()
+
+
+REGISTRY = SensorRegistry() # shared by the handlers and the publisher of a process, loaded on first use
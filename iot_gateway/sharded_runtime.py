@@ -0,0 +1,417 @@
+"""
+Multi-process sharded runtime for large sensor fleets.
+
+The Modbus devices and NMEA streams are split between worker processes, each with its own event loop, so parsing
+and change filtering use every core instead of one. Workers send the readings that pass the change filter in
+batches over local pipes (multiprocessing.connection, Unix sockets or Windows named pipes) to one or more
+publisher processes that own the MQTT connections. A supervisor in the main process restarts every process that
+exits, with an exponential backoff when a process keeps crashing.
+
+Every process reloads the sensor registry when its file changes, except for the Modbus devices: the shards are
+assigned once at start, so a changed device list is logged and only polled after Sharded.py is restarted. The
+publisher processes feed the window summaries and the history store. They only receive the readings that passed the
+change filter of the workers, so a summary covers the sent readings instead of every poll. The history store needs all
+readings in one process and is only kept with a single publisher (SHARD_PUBLISHERS = 1).
+
+Run it with Sharded.py next to Main.py.
+"""
+import asyncio
+import collections
+import multiprocessing
+import signal
+import threading
+import time
+from datetime import datetime
+from multiprocessing.connection import Client, Listener, arbitrary_address, wait
+import os
+import sys
+from configs import config
+from utils.logger import get_logger, set_process_name, with_suffix
+from utils.clock import CLOCK
+from .modubs_tcp import ModbusClientHandler
+from .nmea_client import NmeaHandler
+from .mqtt_publisher import MQTTPublisher
+from .outbound_queue import OutboundQueue
+from .readings import Reading
+from .aggregation import WindowAggregator
+from .sensor_registry import REGISTRY
+
+logger = get_logger("sharded_runtime_logger", file_name='logs/sharded_runtime.log')
+
+CONNECTION_FAMILY = "AF_PIPE" if sys.platform == "win32" else "AF_UNIX"
+STABLE_RUN_TIME = 60 # seconds a process has to run before its restart backoff is reset
+
+
+def cancel_on_sigterm() -> None:
+    """
+    Cancel the running main task on SIGTERM (Process.terminate()), so the finally blocks and atexit handlers of the
+    process run and the log files and the outbound queue are flushed. On Windows terminate() ends the process
+    right away.
+    """
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except NotImplementedError:
+        pass
+
+
+async def optional_service(name: str, coroutine) -> None:
+    """
+    Run a background service the data path does not depend on, a failure is logged and ends only this service
+    instead of the process (see Gateway._optional()).
+    """
+    try:
+        await coroutine
+    except Exception as e:
+        logger.exception("The %s stopped, the process keeps running without it: %s", name, e)
+
+
+async def watch_registry(interval: float = config.SENSOR_REGISTRY_RELOAD_INTERVAL) -> None:
+    """
+    Reload the sensor registry of a worker when its file changes (units, deadbands, heartbeats), runs until cancelled.
+    The shards are not reassigned, a change of the Modbus devices is logged and needs a restart of Sharded.py.
+    """
+    if not interval:
+        return
+    devices_version = REGISTRY.devices_version
+    while True:
+        await asyncio.sleep(interval)
+        if REGISTRY.reload_if_changed() and REGISTRY.devices_version != devices_version:
+            devices_version = REGISTRY.devices_version
+            logger.warning("The Modbus devices of the sensor registry changed, restart Sharded.py to poll them")
+
+
+def assign_shards(devices: list, streams: list, workers: int) -> list:
+    """
+    Split the Modbus devices and NMEA streams between the workers, balancing the expected readings per second.
+
+    A device is expected to produce sum(1 / poll_interval) readings per second, a stream its "rate" (default 10).
+    The sources are placed from the busiest to the quietest on the least loaded worker.
+
+    Args:
+    -----
+    devices(list): Modbus devices, same format as SensorRegistry.devices
+    streams(list): NMEA streams, same format as config.NMEA_STREAMS
+    workers(int): Number of worker processes
+
+    Returns:
+    --------
+    list: One {"devices": [...], "streams": [...], "load": float} dict per worker that got work
+    """
+    shards = [{"devices": [], "streams": [], "load": 0.0} for _ in range(max(1, workers))]
+    sources = [("devices", device, sum(1 / register["poll_interval"] for register in device["registers"])) for device in devices]
+    sources += [("streams", stream, stream.get("rate", 10)) for stream in streams]
+    for kind, source, load in sorted(sources, key=lambda source: source[2], reverse=True):
+        shard = min(shards, key=lambda shard: shard["load"])
+        shard[kind].append(source)
+        shard["load"] += load
+    return [shard for shard in shards if shard["devices"] or shard["streams"]]
+
+
+class ReadingSender:
+    """
+    Collects the readings of a worker and sends them in batches to its publisher process.
+
+    Readings are kept in a bounded buffer while the publisher is not reachable (eg. while it is restarted), the
+    oldest readings are dropped when the buffer is full.
+
+    Attributes:
+    - address(str): Listener address of the publisher process.
+    - authkey(bytes): Shared secret of the supervisor and its processes.
+    - flush_interval(float): Seconds between two batches.
+    - buffer_size(int): Maximum number of readings waiting to be sent.
+    - reconnect_delay(float): Seconds between two connection attempts.
+    """
+    def __init__(self, address: str, authkey: bytes, flush_interval: float = config.SHARD_FLUSH_INTERVAL,
+                 buffer_size: int = config.SHARD_BUFFER_SIZE, reconnect_delay: float = 1.0) -> None:
+        self.address = address
+        self.authkey = authkey
+        self.flush_interval = flush_interval
+        self.reconnect_delay = reconnect_delay
+        self.pending: collections.deque = collections.deque(maxlen=buffer_size)
+        self.dropped = 0
+        self.connection = None
+        self._retry_at = 0.0
+
+    def add(self, reading: Reading) -> None:
+        if len(self.pending) == self.pending.maxlen:
+            self.dropped += 1
+        self.pending.append((reading.sensor, reading.value, reading.unit, reading.status, reading.timestamp_ns, reading.source, reading.received_ns))
+
+    def _connect(self) -> bool:
+        try:
+            self.connection = Client(self.address, family=CONNECTION_FAMILY, authkey=self.authkey)
+        except (OSError, multiprocessing.AuthenticationError) as e:
+            logger.error("Unable to connect to the publisher process: %s", e)
+            return False
+        logger.info("Connected to the publisher process")
+        return True
+
+    async def run(self) -> None:
+        """
+        Send the collected readings every flush_interval until cancelled.
+        """
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if not self.pending:
+                continue
+            if self.connection is None:
+                if time.monotonic() < self._retry_at:
+                    continue
+                if not await asyncio.to_thread(self._connect):
+                    self._retry_at = time.monotonic() + self.reconnect_delay
+                    continue
+            batch = list(self.pending)
+            self.pending.clear()
+            try:
+                await asyncio.to_thread(self.connection.send, batch) # blocks while the publisher is behind
+            except OSError as e:
+                logger.error("Lost the connection to the publisher process: %s", e)
+                self.connection.close()
+                self.connection = None
+                self.pending = collections.deque(batch + list(self.pending), maxlen=self.pending.maxlen)
+
+
+async def forward_modbus(devices: list, sender: ReadingSender) -> None:
+    handler = ModbusClientHandler(host=devices[0]["host"], port=devices[0]["port"], unit_id=devices[0]["unit_id"], use_asyncio=True)
+    try:
+        async for readings in handler.poll_registers(devices):
+            for reading in readings:
+                if reading.send_point:
+                    sender.add(reading)
+    finally:
+        await handler.close()
+
+
+async def forward_nmea(stream: dict, sender: ReadingSender, handler: NmeaHandler | None = None) -> None:
+    """
+    Read a TCP stream, or the datagrams of a stream with "protocol": "udp". The UDP streams of a worker share one
+    handler, so redundant sources assigned to the same worker are deduplicated.
+    """
+    if handler is None:
+        handler = NmeaHandler(stream["port"], stream.get("host", stream.get("group")), send_valid_data=True, use_asyncio=True,
+                              sentence_types=tuple(stream.get("sentence_types", config.NMEA_SENTENCE_TYPES)))
+    if stream.get("protocol", "tcp") == "udp":
+        readings = handler.stream_datagrams(stream["port"], stream.get("group"), stream.get("interface", "0.0.0.0"))
+    else:
+        readings = handler.stream_ROT_readings()
+    async for reading in readings:
+        if reading.send_point:
+            sender.add(reading)
+
+
+def run_worker(name: str, shard: dict, address: str, authkey: bytes) -> None:
+    """
+    Worker process: poll the devices and read the streams of one shard and send the readings to a publisher.
+    """
+    set_process_name(name)
+    logger.info("%s polls %d Modbus devices and %d NMEA streams", name, len(shard["devices"]), len(shard["streams"]))
+
+    async def run() -> None:
+        cancel_on_sigterm()
+        sender = ReadingSender(address, authkey)
+        tasks = [sender.run(), optional_service("clock discipline", CLOCK.discipline()),
+                 optional_service("sensor registry watcher", watch_registry())]
+        if shard["devices"]:
+            tasks.append(forward_modbus(shard["devices"], sender))
+        datagram_streams = [stream for stream in shard["streams"] if stream.get("protocol", "tcp") == "udp"]
+        tasks += [forward_nmea(stream, sender) for stream in shard["streams"] if stream not in datagram_streams]
+        if datagram_streams:
+            first = datagram_streams[0]
+            datagram_handler = NmeaHandler(first["port"], first.get("group", first.get("interface", "0.0.0.0")), send_valid_data=True,
+                                           use_asyncio=True, sentence_types=tuple(first.get("sentence_types", config.NMEA_SENTENCE_TYPES)))
+            tasks += [forward_nmea(stream, sender, datagram_handler) for stream in datagram_streams]
+        await asyncio.gather(*tasks)
+
+    try:
+        asyncio.run(run())
+    except (KeyboardInterrupt, asyncio.CancelledError): # the supervisor handles the shutdown
+        pass
+
+
+def receive_batches(connection, loop: asyncio.AbstractEventLoop, batches: asyncio.Queue) -> None:
+    """
+    Thread of a publisher process reading the batches of one worker connection.
+    """
+    try:
+        while True:
+            batch = connection.recv()
+            asyncio.run_coroutine_threadsafe(batches.put(batch), loop).result() # waits while the queue is full
+    except (EOFError, OSError): # the worker exited
+        pass
+    finally:
+        connection.close()
+
+
+def accept_connections(listener: Listener, loop: asyncio.AbstractEventLoop, batches: asyncio.Queue) -> None:
+    """
+    Thread of a publisher process accepting worker connections.
+    """
+    while True:
+        try:
+            connection = listener.accept()
+        except multiprocessing.AuthenticationError as e:
+            logger.error("Rejected a connection to the publisher process: %s", e)
+            continue
+        except OSError as e:
+            logger.error("Publisher process stopped accepting connections: %s", e)
+            return
+        threading.Thread(target=receive_batches, args=(connection, loop, batches), daemon=True).start()
+
+
+async def publish_batches(publisher: MQTTPublisher, batches: asyncio.Queue, aggregator: WindowAggregator,
+                          history_store=None) -> None:
+    while True:
+        batch = await batches.get()
+        for sensor, value, unit, status, timestamp_ns, source, received_ns in batch: # monotonic stamps are valid across processes
+            reading = Reading(sensor, value, unit, status, source=source, timestamp_ns=timestamp_ns, received_ns=received_ns)
+            aggregator.add(reading)
+            if history_store:
+                history_store.append(reading)
+            await publisher.publish_async(reading)
+
+
+def run_publisher(name: str, address: str, authkey: bytes, history: bool = False) -> None:
+    """
+    Publisher process: receive the readings of the workers and publish them to the MQTT broker.
+
+    The process also publishes the window summaries of its readings and, with history set, keeps the history store
+    and answers the history queries.
+    """
+    set_process_name(name)
+
+    async def run() -> None:
+        cancel_on_sigterm()
+        loop = asyncio.get_running_loop()
+        batches = asyncio.Queue(maxsize=config.SHARD_PUBLISH_QUEUE_SIZE)
+        outbound_queue = OutboundQueue(
+            path=with_suffix(config.OFFLINE_QUEUE_PATH, name),
+            max_bytes=config.OFFLINE_QUEUE_MAX_BYTES,
+            max_age=config.OFFLINE_QUEUE_MAX_AGE * 3600
+        )
+        publisher = MQTTPublisher(
+            host=config.MQTT_BROKER_HOST,
+            port=config.MQTT_BROKER_PORT,
+            username=config.MQTT_BROKER_USERNAME,
+            password=config.MQTT_BROKER_PASSWORD,
+            outbound_queue=outbound_queue,
+            client_id=f"ows-challenge-{datetime.now():%d%m%y}-{name}" # client ids must be unique per connection
+        )
+        if CONNECTION_FAMILY == "AF_UNIX" and os.path.exists(address): # socket file left by a crashed publisher
+            os.unlink(address)
+        listener = Listener(address, family=CONNECTION_FAMILY, authkey=authkey)
+        threading.Thread(target=accept_connections, args=(listener, loop, batches), daemon=True).start()
+        logger.info("%s is listening for worker connections", name)
+        aggregator = WindowAggregator()
+        history_store = None
+        if history and config.HISTORY_STORE_PATH:
+            from .history_store import HistoryStore
+            history_store = HistoryStore()
+        tasks = [publish_batches(publisher, batches, aggregator, history_store), publisher.replay_outbound_queue(),
+                 publisher.flush_batches(),
+                 optional_service("summary publisher", publisher.publish_summaries(aggregator)),
+                 optional_service("sensor registry watcher", REGISTRY.watch())]
+        if history_store:
+            tasks += [optional_service("history store", history_store.run()),
+                      optional_service("history query service", publisher.serve_history(history_store))]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            listener.close()
+            publisher.stop()
+
+    try:
+        asyncio.run(run())
+    except (KeyboardInterrupt, asyncio.CancelledError): # the supervisor handles the shutdown
+        pass
+
+
+class ManagedProcess:
+    """
+    A child process kept alive by the ShardSupervisor.
+
+    Attributes:
+    - name(str): Process name, also used for its log files.
+    - target(callable): Entry point of the process.
+    - args(tuple): Arguments of the entry point.
+    """
+    def __init__(self, name: str, target, args: tuple) -> None:
+        self.name = name
+        self.target = target
+        self.args = args
+        self.process = None
+        self.started = 0.0
+        self.failures = 0
+        self.restart_at: float | None = None
+
+
+class ShardSupervisor:
+    """
+    Starts the publisher and worker processes and restarts the ones that exit.
+
+    Processes are started with the "spawn" method, so they do not inherit the threads (paho, log writer) of the
+    main process and behave the same on Linux and Windows.
+
+    Attributes:
+    - devices(list): Modbus devices, same format as SensorRegistry.devices
+    - streams(list): NMEA streams, same format as config.NMEA_STREAMS
+    - workers(int): Number of worker processes, 0 uses one per CPU core left after the publishers.
+    - publishers(int): Number of publisher processes (MQTT connections).
+    """
+    def __init__(self, devices: list, streams: list, workers: int = config.SHARD_WORKERS,
+                 publishers: int = config.SHARD_PUBLISHERS) -> None:
+        self.context = multiprocessing.get_context("spawn")
+        publishers = max(1, publishers)
+        if not workers:
+            workers = max(1, (os.cpu_count() or 1) - publishers)
+        authkey = os.urandom(32)
+        addresses = [arbitrary_address(CONNECTION_FAMILY) for _ in range(publishers)]
+        history = publishers == 1
+        if config.HISTORY_STORE_PATH and not history:
+            logger.warning("The history store is disabled with %d publisher processes, set SHARD_PUBLISHERS = 1 to keep it", publishers)
+        self.processes = [ManagedProcess(f"publisher-{index}", run_publisher, (f"publisher-{index}", address, authkey, history))
+                          for index, address in enumerate(addresses)]
+        for index, shard in enumerate(assign_shards(devices, streams, workers)):
+            name = f"worker-{index}"
+            self.processes.append(ManagedProcess(name, run_worker, (name, shard, addresses[index % publishers], authkey)))
+        self._stopping = False
+
+    def start_process(self, managed: ManagedProcess) -> None:
+        managed.process = self.context.Process(target=managed.target, args=managed.args, name=managed.name, daemon=True)
+        managed.process.start()
+        managed.started = time.monotonic()
+        managed.restart_at = None
+
+    def check_processes(self) -> None:
+        """
+        Schedule a restart for every process that exited and start the ones whose backoff elapsed.
+        """
+        now = time.monotonic()
+        for managed in self.processes:
+            if managed.restart_at is None and not managed.process.is_alive():
+                managed.failures = 0 if now - managed.started >= STABLE_RUN_TIME else managed.failures + 1
+                delay = min(config.SHARD_MAX_RESTART_DELAY, 0.5 * 2 ** managed.failures)
+                logger.error("%s exited with code %s, restarting it in %.1f s", managed.name, managed.process.exitcode, delay)
+                managed.restart_at = now + delay
+            elif managed.restart_at is not None and now >= managed.restart_at:
+                self.start_process(managed)
+
+    def run(self) -> None:
+        """
+        Start all processes and supervise them until stop() is called or the main process is interrupted.
+        """
+        for managed in self.processes:
+            self.start_process(managed)
+        logger.info("Started %d processes: %s", len(self.processes), ", ".join(managed.name for managed in self.processes))
+        while not self._stopping:
+            sentinels = [managed.process.sentinel for managed in self.processes if managed.restart_at is None]
+            wait(sentinels, timeout=0.5)
+            self.check_processes()
+
+    def stop(self, timeout: float = 5) -> None:
+        self._stopping = True
+        for managed in self.processes:
+            if managed.process is not None and managed.process.is_alive():
+                managed.process.terminate()
+        for managed in self.processes:
+            if managed.process is not None:
+                managed.process.join(timeout)
@@ -0,0 +1,119 @@
+"""
+A local Modbus TCP holding register server, a stand-in for the crane PLCs.
+
+Serves function code 0x03 for any unit id. Register values follow a random walk so the change filter has
+something to do.
+
+Run from the repository root:
+    python -m simulators.modbus_server --port 8889
+"""
+import argparse
+import asyncio
+import random
+import struct
+from iot_gateway.async_modbus import MBAP_HEADER, READ_HOLDING_REGISTERS, READ_HOLDING_REGISTERS_REQUEST
+
+ILLEGAL_FUNCTION = 0x01
+ILLEGAL_DATA_ADDRESS = 0x02
+
+
+class ModbusSimulator:
+    """
+    An asyncio Modbus TCP server with a block of holding registers.
+
+    Attributes:
+    - host(str): Interface to listen on.
+    - port(int): Port to listen on, 0 picks a free port.
+    - register_count(int): Number of holding registers served (addresses 0 .. register_count - 1).
+    - step(int): Maximum change of a register per update.
+    - update_interval(float): Seconds between two random walk steps.
+    - response_delay(float): Artificial delay before every response, to simulate slow devices.
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, register_count: int = 16, step: int = 2,
+                 update_interval: float = 1.0, response_delay: float = 0.0) -> None:
+        self.host = host
+        self.port = port
+        self.registers = [random.randint(20, 60) for _ in range(register_count)]
+        self.step = step
+        self.update_interval = update_interval
+        self.response_delay = response_delay
+        self.requests = 0
+        self._server: asyncio.AbstractServer | None = None
+        self._clients: set = set() # handler tasks of the connected clients
+        self._update_task: asyncio.Task | None = None
+
+    async def start(self) -> int:
+        """
+        Start serving and return the port that is listened on.
+        """
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._update_task = asyncio.create_task(self._update_registers())
+        return self.port
+
+    async def stop(self) -> None:
+        if self._update_task:
+            self._update_task.cancel()
+        if self._server:
+            self._server.close()
+            for client in list(self._clients):
+                client.cancel()
+            await asyncio.gather(*self._clients, return_exceptions=True)
+            await self._server.wait_closed()
+
+    async def _update_registers(self) -> None:
+        while True:
+            await asyncio.sleep(self.update_interval)
+            for index, value in enumerate(self.registers):
+                self.registers[index] = min(0xFFFF, max(0, value + random.randint(-self.step, self.step)))
+
+    def handle_request(self, unit_id: int, pdu: bytes) -> bytes:
+        """
+        Build the response PDU of a request PDU.
+        """
+        function_code = pdu[0]
+        if function_code != READ_HOLDING_REGISTERS or len(pdu) != READ_HOLDING_REGISTERS_REQUEST.size:
+            return bytes((function_code | 0x80, ILLEGAL_FUNCTION))
+        _, address, count = READ_HOLDING_REGISTERS_REQUEST.unpack(pdu)
+        if count < 1 or address + count > len(self.registers):
+            return bytes((function_code | 0x80, ILLEGAL_DATA_ADDRESS))
+        return bytes((function_code, 2 * count)) + struct.pack(f">{count}H", *self.registers[address:address + count])
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._clients.add(asyncio.current_task())
+        try:
+            while True:
+                header = await reader.readexactly(MBAP_HEADER.size)
+                transaction_id, protocol_id, length, unit_id = MBAP_HEADER.unpack(header)
+                pdu = await reader.readexactly(length - 1)
+                self.requests += 1
+                if self.response_delay:
+                    await asyncio.sleep(self.response_delay)
+                response = self.handle_request(unit_id, pdu)
+                writer.write(MBAP_HEADER.pack(transaction_id, protocol_id, len(response) + 1, unit_id) + response)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except asyncio.CancelledError: # stop() was called
+            pass
+        finally:
+            self._clients.discard(asyncio.current_task())
+            writer.close()
+
+
+async def main(args) -> None:
+    simulator = ModbusSimulator(args.host, args.port, args.registers, response_delay=args.delay)
+    port = await simulator.start()
+    print(f"Modbus simulator serving {args.registers} holding registers on {args.host}:{port}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8889)
+    parser.add_argument("--registers", type=int, default=16)
+    parser.add_argument("--delay", type=float, default=0.0, help="response delay in seconds")
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
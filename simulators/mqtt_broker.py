@@ -0,0 +1,178 @@
+"""
+A minimal local MQTT broker stand-in (MQTT 3.1.1 and 5).
+
+It accepts connections without authentication, acknowledges QoS 1 publishes, answers pings and forwards
+publishes to subscribed clients (QoS 0 delivery, '+' and '#' wildcards). Every received publish is recorded
+with its arrival time so the benchmark can measure throughput and latency. It is not a real broker: no retained
+messages, no sessions and no QoS 2.
+
+Run from the repository root:
+    python -m simulators.mqtt_broker --port 1883
+"""
+import argparse
+import asyncio
+import struct
+import time
+
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+SUBSCRIBE, SUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 12, 13, 14
+MQTT_V5 = 5
+
+
+def encode_varint(value: int) -> bytes:
+    encoded = bytearray()
+    while True:
+        byte, value = value % 128, value // 128
+        encoded.append(byte | (0x80 if value else 0))
+        if not value:
+            return bytes(encoded)
+
+
+def decode_varint(data: bytes, offset: int) -> tuple:
+    """
+    Returns (value, offset after the varint).
+    """
+    value, multiplier = 0, 1
+    while True:
+        byte = data[offset]
+        offset += 1
+        value += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            return value, offset
+        multiplier *= 128
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    filter_levels = topic_filter.split("/")
+    topic_levels = topic.split("/")
+    for index, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if index >= len(topic_levels) or (level != "+" and level != topic_levels[index]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+class MqttBrokerStub:
+    """
+    An asyncio MQTT broker stand-in for local benchmarks and tests.
+
+    Attributes:
+    - host(str): Interface to listen on.
+    - port(int): Port to listen on, 0 picks a free port.
+    - received(list): (arrival time.time(), topic, payload) of every publish received.
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.host = host
+        self.port = port
+        self.received: list = []
+        self._subscriptions: dict = {} # writer -> (topic filters, protocol level)
+        self._server: asyncio.AbstractServer | None = None
+        self._clients: set = set() # handler tasks of the connected clients
+
+    async def start(self) -> int:
+        """
+        Start serving and return the port that is listened on.
+        """
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self) -> None:
+        if self._server:
+            self._server.close()
+            for client in list(self._clients):
+                client.cancel()
+            await asyncio.gather(*self._clients, return_exceptions=True)
+            await self._server.wait_closed()
+
+    async def _read_packet(self, reader: asyncio.StreamReader) -> tuple:
+        first = (await reader.readexactly(1))[0]
+        length, multiplier = 0, 1
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            length += (byte & 0x7F) * multiplier
+            if not byte & 0x80:
+                break
+            multiplier *= 128
+        return first >> 4, first & 0x0F, await reader.readexactly(length)
+
+    def _forward(self, topic: str, payload: bytes) -> None:
+        for writer, (filters, level) in list(self._subscriptions.items()):
+            if any(topic_matches(topic_filter, topic) for topic_filter in filters):
+                encoded_topic = topic.encode()
+                body = struct.pack(">H", len(encoded_topic)) + encoded_topic + (b"\x00" if level == MQTT_V5 else b"") + payload
+                writer.write(bytes((PUBLISH << 4,)) + encode_varint(len(body)) + body)
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._clients.add(asyncio.current_task())
+        level = 4
+        try:
+            while True:
+                packet_type, flags, body = await self._read_packet(reader)
+                if packet_type == CONNECT:
+                    name_length = struct.unpack_from(">H", body)[0]
+                    level = body[2 + name_length]
+                    ack = b"\x00\x00\x00" if level == MQTT_V5 else b"\x00\x00" # v5 adds an empty property length
+                    writer.write(bytes((CONNACK << 4, len(ack))) + ack)
+                elif packet_type == PUBLISH:
+                    qos = (flags >> 1) & 0x03
+                    topic_length = struct.unpack_from(">H", body)[0]
+                    topic = body[2:2 + topic_length].decode()
+                    offset = 2 + topic_length
+                    packet_id = None
+                    if qos:
+                        packet_id = body[offset:offset + 2]
+                        offset += 2
+                    if level == MQTT_V5:
+                        properties_length, offset = decode_varint(body, offset)
+                        offset += properties_length
+                    payload = body[offset:]
+                    self.received.append((time.time(), topic, payload))
+                    if qos == 1:
+                        writer.write(bytes((PUBACK << 4, 2)) + packet_id)
+                    self._forward(topic, payload)
+                elif packet_type == SUBSCRIBE:
+                    packet_id = body[:2]
+                    offset = 2
+                    if level == MQTT_V5:
+                        properties_length, offset = decode_varint(body, offset)
+                        offset += properties_length
+                    filters = []
+                    while offset < len(body):
+                        filter_length = struct.unpack_from(">H", body, offset)[0]
+                        filters.append(body[offset + 2:offset + 2 + filter_length].decode())
+                        offset += 3 + filter_length # filter and its options byte
+                    self._subscriptions.setdefault(writer, ([], level))[0].extend(filters)
+                    granted = bytes(len(filters)) # QoS 0 granted for every filter
+                    ack = packet_id + (b"\x00" if level == MQTT_V5 else b"") + granted
+                    writer.write(bytes((SUBACK << 4,)) + encode_varint(len(ack)) + ack)
+                elif packet_type == PINGREQ:
+                    writer.write(bytes((PINGRESP << 4, 0)))
+                elif packet_type == DISCONNECT:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except asyncio.CancelledError: # stop() was called
+            pass
+        finally:
+            self._clients.discard(asyncio.current_task())
+            self._subscriptions.pop(writer, None)
+            writer.close()
+
+
+async def main(args) -> None:
+    broker = MqttBrokerStub(args.host, args.port)
+    port = await broker.start()
+    print(f"MQTT broker stand-in listening on {args.host}:{port}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
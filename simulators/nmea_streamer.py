@@ -0,0 +1,137 @@
+"""
+A local NMEA $--ROT TCP streamer, a stand-in for the rate of turn sensor.
+
+Every connected client gets a stream of ROT sentences at the configured rate. The stream can be made harder to
+parse with timing jitter, fragmentation into small TCP writes and a ratio of sentences with a corrupt checksum.
+
+Run from the repository root:
+    python -m simulators.nmea_streamer --port 8888 --rate 20 --fragment 7 --corrupt 0.01
+"""
+import argparse
+import asyncio
+import random
+import time
+from iot_gateway.nmea_parser import nmea_checksum
+
+
+def build_sentence(talker_id: str, rot_value: float, status: str = "A", corrupt: bool = False) -> bytes:
+    """
+    Build a $--ROT sentence with CRLF line ending.
+
+    Args:
+    -----
+    talker_id(str): Two letter talker id, eg. "HE"
+    rot_value(float): Rate of turn in degrees per minute
+    status(str): "A" valid or "V" invalid
+    corrupt(bool): Write a wrong checksum
+
+    Returns:
+    --------
+    bytes: The sentence
+    """
+    body = f"{talker_id}ROT,{rot_value:.1f},{status}".encode('ascii')
+    checksum = nmea_checksum(body) ^ (0x5A if corrupt else 0)
+    return b"$" + body + b"*" + f"{checksum:02X}".encode('ascii') + b"\r\n"
+
+
+class NmeaStreamer:
+    """
+    An asyncio TCP server streaming ROT sentences.
+
+    Attributes:
+    - host(str): Interface to listen on.
+    - port(int): Port to listen on, 0 picks a free port.
+    - rate(float): Sentences per second.
+    - jitter(float): Random deviation of the send interval as a fraction of the interval (0..1).
+    - fragment(int): Split every sentence into TCP writes of at most this many bytes (0 = no fragmentation).
+    - corrupt_ratio(float): Fraction of sentences sent with a wrong checksum.
+    - talker_id(str): Talker id of the sentences.
+    - sequential(bool): Send 0.0, 2.0, 4.0, ... instead of a random walk, so every sentence passes the change
+      filter and can be identified at the broker (used by the benchmark to measure latency).
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, rate: float = 10, jitter: float = 0.0,
+                 fragment: int = 0, corrupt_ratio: float = 0.0, talker_id: str = "HE", sequential: bool = False) -> None:
+        self.host = host
+        self.port = port
+        self.rate = rate
+        self.jitter = jitter
+        self.fragment = fragment
+        self.corrupt_ratio = corrupt_ratio
+        self.talker_id = talker_id
+        self.sequential = sequential
+        self.sent = 0
+        self.sent_times: dict[float, float] = {} # sequential value -> time.time() it was written
+        self._server: asyncio.AbstractServer | None = None
+        self._clients: set = set() # handler tasks of the connected clients
+
+    async def start(self) -> int:
+        """
+        Start serving and return the port that is listened on.
+        """
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self) -> None:
+        if self._server:
+            self._server.close()
+            for client in list(self._clients):
+                client.cancel()
+            await asyncio.gather(*self._clients, return_exceptions=True)
+            await self._server.wait_closed()
+
+    def next_value(self, previous: float) -> float:
+        if self.sequential:
+            return float(2 * self.sent)
+        return max(-99.9, min(99.9, previous + random.uniform(-1.5, 1.5)))
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._clients.add(asyncio.current_task())
+        loop = asyncio.get_running_loop()
+        interval = 1 / self.rate
+        deadline = loop.time()
+        value = 0.0
+        try:
+            while True:
+                value = self.next_value(value)
+                sentence = build_sentence(self.talker_id, value, corrupt=random.random() < self.corrupt_ratio)
+                if self.fragment:
+                    for start in range(0, len(sentence), self.fragment):
+                        writer.write(sentence[start:start + self.fragment])
+                        await writer.drain()
+                else:
+                    writer.write(sentence)
+                    await writer.drain()
+                if self.sequential:
+                    self.sent_times[value] = time.time()
+                self.sent += 1
+                deadline += interval * (1 + random.uniform(-self.jitter, self.jitter))
+                await asyncio.sleep(max(0, deadline - loop.time()))
+        except ConnectionError:
+            pass
+        except asyncio.CancelledError: # stop() was called
+            pass
+        finally:
+            self._clients.discard(asyncio.current_task())
+            writer.close()
+
+
+async def main(args) -> None:
+    streamer = NmeaStreamer(args.host, args.port, args.rate, args.jitter, args.fragment, args.corrupt)
+    port = await streamer.start()
+    print(f"NMEA streamer sending {args.rate} ROT sentences/s on {args.host}:{port}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument("--rate", type=float, default=10, help="sentences per second")
+    parser.add_argument("--jitter", type=float, default=0.0, help="send interval jitter as a fraction of the interval")
+    parser.add_argument("--fragment", type=int, default=0, help="max bytes per TCP write, 0 disables fragmentation")
+    parser.add_argument("--corrupt", type=float, default=0.0, help="ratio of sentences with a wrong checksum")
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
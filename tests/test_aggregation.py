@@ -0,0 +1,46 @@
+import pytest
+
+from iot_gateway.aggregation import SensorWindow, WindowAggregator, seconds_to_next_window
+from iot_gateway.readings import Reading
+
+
+def test_window_statistics():
+    window = SensorWindow("deg/min")
+    for timestamp, value in ((0.0, 10.0), (30.0, 20.0), (60.0, 30.0)):
+        window.add(value, timestamp)
+    summary = window.summary()
+    assert (summary["count"], summary["min"], summary["max"], summary["mean"]) == (3, 10.0, 30.0, 20.0)
+    assert summary["std"] == pytest.approx(10.0)
+    assert summary["slope"] == pytest.approx(20.0) # per minute
+    assert summary["integral"] == pytest.approx(20.0) # mean 20 deg/min over one minute
+    assert (summary["start"], summary["end"]) == (0.0, 60.0)
+
+
+def test_slope_needs_two_timestamps_and_empty_window_has_no_statistics():
+    window = SensorWindow("C")
+    window.add(5.0, 100.0)
+    window.add(7.0, 100.0)
+    assert window.slope == 0.0
+    assert window.integral == 0.0
+    assert "mean" not in SensorWindow("C").summary()
+
+
+def test_aggregator_keeps_sources_apart_and_counts_invalid_readings():
+    aggregator = WindowAggregator()
+    aggregator.extend([Reading("ROT", 10.0, "deg/min", source="HE", timestamp=0.0),
+                       Reading("ROT", -50.0, "deg/min", source="TI", timestamp=0.0),
+                       Reading("ROT", 10.0, "deg/min", source="HE", timestamp=60.0),
+                       Reading("ROT", 0.0, "deg/min", "V", source="HE", timestamp=30.0),
+                       Reading("temp", 21.0, "C", timestamp=0.0)])
+    summaries = {(sensor, summary.get("source")): summary for sensor, summary in aggregator.flush()}
+    assert set(summaries) == {("ROT", "HE"), ("ROT", "TI"), ("temp", None)}
+    assert summaries[("ROT", "HE")]["integral"] == pytest.approx(10.0)
+    assert summaries[("ROT", "HE")]["invalid"] == 1
+    assert summaries[("ROT", "TI")]["mean"] == -50.0
+    assert len(aggregator) == 0 # flush starts new windows
+
+
+def test_windows_are_aligned_to_the_clock():
+    assert seconds_to_next_window(1_700_000_000.0, 60) == pytest.approx(40.0) # 1_700_000_000 is 20 s past a minute
+    assert seconds_to_next_window(1_700_000_040.0, 60) == pytest.approx(60.0)
+    assert seconds_to_next_window(1_700_000_039.5, 60) == pytest.approx(0.5)
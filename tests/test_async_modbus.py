@@ -0,0 +1,143 @@
+import asyncio
+import struct
+
+from iot_gateway import async_modbus
+from iot_gateway.async_modbus import MBAP_HEADER, AsyncModbusClient
+from iot_gateway.connection_manager import Backoff, CircuitBreaker
+
+
+class StubServer:
+    """
+    In-process Modbus TCP server, every read request is put on `requests` and answered by the test.
+    """
+    def __init__(self) -> None:
+        self.requests: asyncio.Queue = asyncio.Queue()
+        self.connections = 0
+        self._server = None
+
+    async def start(self) -> int:
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader, writer) -> None:
+        self.connections += 1
+        try:
+            while True:
+                transaction_id, _, length, unit_id = MBAP_HEADER.unpack(await reader.readexactly(MBAP_HEADER.size))
+                _, start, count = struct.unpack(">BHH", await reader.readexactly(length - 1))
+                await self.requests.put((writer, transaction_id, unit_id, start, count))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+
+    @staticmethod
+    def answer(writer, transaction_id: int, unit_id: int, pdu: bytes) -> None:
+        writer.write(MBAP_HEADER.pack(transaction_id, 0, len(pdu) + 1, unit_id) + pdu)
+
+    @classmethod
+    def registers(cls, request, values: list, byte_count: int | None = None) -> None:
+        writer, transaction_id, unit_id, _, _ = request
+        byte_count = 2 * len(values) if byte_count is None else byte_count
+        cls.answer(writer, transaction_id, unit_id, bytes((3, byte_count)) + struct.pack(f">{len(values)}H", *values))
+
+
+def run_with_stub(test, timeout: float = 0.2) -> None:
+    async def run() -> None:
+        stub = StubServer()
+        client = AsyncModbusClient("127.0.0.1", await stub.start(), unit_id=1, timeout=timeout)
+        client.breaker = CircuitBreaker("modbus stub", failure_threshold=2, backoff=Backoff(0.01, 0.02))
+        try:
+            await asyncio.wait_for(test(stub, client), 5)
+        finally:
+            await client.close()
+            await stub.stop()
+
+    asyncio.run(run())
+
+
+def test_out_of_order_responses_are_matched_by_transaction_id():
+    async def test(stub, client) -> None:
+        first = asyncio.create_task(client.read_holding_registers(0, 2))
+        second = asyncio.create_task(client.read_holding_registers(10, 1, unit_id=2))
+        requests = [await stub.requests.get(), await stub.requests.get()]
+        assert {request[2] for request in requests} == {1, 2}
+        by_start = {request[3]: request for request in requests}
+        stub.registers(by_start[10], [7]) # the second request is answered first
+        stub.registers(by_start[0], [1, 2])
+        assert await first == [1, 2]
+        assert await second == [7]
+
+    run_with_stub(test)
+
+
+def test_transaction_id_wraps_and_skips_ids_in_flight():
+    client = AsyncModbusClient("127.0.0.1", 1)
+    client._transaction_id = 0xFFFE
+    assert client._next_transaction_id() == 0xFFFF
+    client._pending = {0: None, 1: None}
+    assert client._next_transaction_id() == 2
+
+
+def test_late_response_after_a_timeout_is_ignored():
+    async def test(stub, client) -> None:
+        timeouts = async_modbus.REQUEST_TIMEOUTS.value
+        assert await client.read_holding_registers(0, 1) is None # not answered in time
+        late = await stub.requests.get()
+        assert async_modbus.REQUEST_TIMEOUTS.value == timeouts + 1
+        reading = asyncio.create_task(client.read_holding_registers(5, 1))
+        request = await stub.requests.get()
+        stub.registers(late, [111]) # arrives after the timeout, must not resolve the new read
+        stub.registers(request, [222])
+        assert await reading == [222]
+        assert client.is_open
+
+    run_with_stub(test)
+
+
+def test_exception_response():
+    async def test(stub, client) -> None:
+        exceptions = async_modbus.REQUEST_EXCEPTIONS.value
+        reading = asyncio.create_task(client.read_holding_registers(0, 1))
+        writer, transaction_id, unit_id, _, _ = await stub.requests.get()
+        stub.answer(writer, transaction_id, unit_id, bytes((0x83, 2))) # illegal data address
+        assert await reading is None
+        assert async_modbus.REQUEST_EXCEPTIONS.value == exceptions + 1
+
+    run_with_stub(test)
+
+
+def test_byte_count_mismatch():
+    async def test(stub, client) -> None:
+        reading = asyncio.create_task(client.read_holding_registers(0, 2))
+        stub.registers(await stub.requests.get(), [1, 2], byte_count=2)
+        assert await reading is None
+
+    run_with_stub(test)
+
+
+def test_invalid_number_of_registers_is_not_sent():
+    async def test(stub, client) -> None:
+        assert await client.read_holding_registers(0, 0) is None
+        assert await client.read_holding_registers(0, 126) is None
+        assert stub.connections == 0
+
+    run_with_stub(test)
+
+
+def test_consecutive_timeouts_reconnect():
+    async def test(stub, client) -> None:
+        for _ in range(client.breaker.failure_threshold): # the connection is open but the server does not answer
+            assert await client.read_holding_registers(0, 1) is None
+            await stub.requests.get()
+        assert not client.is_open
+        while not client.is_open: # reopened in the background after the backoff delay
+            await asyncio.sleep(0.01)
+        assert stub.connections == 2
+        reading = asyncio.create_task(client.read_holding_registers(0, 1))
+        stub.registers(await stub.requests.get(), [42])
+        assert await reading == [42]
+
+    run_with_stub(test, timeout=0.05)
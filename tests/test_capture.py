@@ -0,0 +1,29 @@
+import asyncio
+
+import Replay
+from iot_gateway.capture import MODBUS, NMEA, SESSION, CaptureWriter, read_capture
+
+
+def test_every_writer_starts_a_session(tmp_path):
+    path = str(tmp_path / "run.cap")
+    for started in (1000.0, 5000.0):
+        writer = CaptureWriter(path)
+        writer.write_nmea("10.0.0.1:10110", b"$HEROT,1.0,A*00\r\n", started + 1)
+        writer.write_modbus("localhost:8889", 1, 0, [215, 220], started + 2)
+        writer.close()
+    kinds = [kind for _, kind, _, _ in read_capture(path)]
+    assert kinds == [SESSION, NMEA, MODBUS, SESSION, NMEA, MODBUS]
+
+
+def test_replay_sums_sessions_and_skips_unknown_devices(tmp_path):
+    path = str(tmp_path / "run.cap")
+    for started in (1000.0, 5000.0):
+        writer = CaptureWriter(path)
+        writer.write_modbus("localhost:8889", 1, 0, [215, 220, 225, 230], started + 10)
+        writer.write_modbus("10.9.9.9:502", 7, 0, [1, 2], started + 20) # not in the sensor registry
+        writer.close()
+    stats = asyncio.run(Replay.replay(path, speed=0, publisher=None))
+    assert stats["sessions"] == 2
+    assert stats["skipped"] == 2
+    assert stats["readings"] > 0
+    assert stats["recorded_seconds"] == 20 # 10 s per session, not the 4000 s between them
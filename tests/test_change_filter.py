@@ -0,0 +1,39 @@
+import numpy as np
+
+from iot_gateway.change_filter import DeadbandFilter
+
+
+def test_first_reading_changes_and_heartbeat_pass():
+    deadband = DeadbandFilter()
+    row = deadband.register("temp", threshold=0.5, heartbeat=10)
+    assert deadband.evaluate([row], [20.0], [0.0]).tolist() == [True] # never sent
+    assert deadband.evaluate([row], [20.4], [1.0]).tolist() == [False] # within the deadband
+    assert deadband.evaluate([row], [20.6], [2.0]).tolist() == [True] # moved more than the threshold
+    assert deadband.evaluate([row], [20.6], [11.0]).tolist() == [False] # compared with the last sent reading at 2.0
+    assert deadband.evaluate([row], [20.6], [12.0]).tolist() == [True] # heartbeat
+
+
+def test_repeated_sensor_in_one_batch_is_evaluated_in_order():
+    deadband = DeadbandFilter()
+    row = deadband.register("temp", threshold=1.0, heartbeat=60)
+    other = deadband.register("rot", threshold=0.1, heartbeat=60)
+    mask = deadband.evaluate([row, row, other, row, row], [10.0, 10.5, 1.0, 11.5, 12.0], [0, 1, 1, 2, 3])
+    assert mask.tolist() == [True, False, True, True, False]
+    assert deadband.last_value[row] == 11.5
+
+
+def test_register_updates_limits_and_rows_grow():
+    deadband = DeadbandFilter(capacity=2)
+    rows = [deadband.register(f"sensor_{index}", 1.0, 60) for index in range(5)]
+    assert rows == [0, 1, 2, 3, 4]
+    assert deadband.register("sensor_1", 5.0, 30) == 1
+    assert deadband.threshold[1] == 5.0 and deadband.heartbeat[1] == 30
+    assert np.all(deadband.evaluate(rows, np.zeros(5), np.zeros(5)))
+
+
+def test_pass_and_drop_counters():
+    deadband = DeadbandFilter(name="test-counters")
+    row = deadband.register("temp", 1.0, 60)
+    passed, dropped = deadband.passed.value, deadband.dropped.value
+    deadband.evaluate([row, row, row], [1.0, 1.5, 3.0], [0, 1, 2])
+    assert (deadband.passed.value - passed, deadband.dropped.value - dropped) == (2, 1)
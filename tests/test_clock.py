@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+import pytest
+
+from utils import clock
+from utils.clock import GatewayClock
+
+STEP_NS = -5_000_000_000 # the wall clock is set back by 5 s, eg. by an NTP correction
+
+
+def step_wall_clock(monkeypatch, step_ns: int) -> None:
+    time_ns = time.time_ns
+    monkeypatch.setattr(time, "time_ns", lambda: time_ns() + step_ns)
+
+
+def test_epoch_stamps_follow_the_wall_clock_and_never_go_back():
+    gateway_clock = GatewayClock()
+    assert abs(gateway_clock.now_ns() - time.time_ns()) < 50_000_000
+    stamps = [time.monotonic_ns() for _ in range(1000)]
+    epochs = [gateway_clock.to_epoch_ns(stamp) for stamp in stamps]
+    assert epochs == sorted(epochs)
+    assert [epoch - stamp for stamp, epoch in zip(stamps, epochs)] == [gateway_clock.offset_ns] * len(stamps)
+
+
+def test_wall_clock_step_is_only_taken_at_a_sync(monkeypatch):
+    gateway_clock = GatewayClock()
+    before = gateway_clock.now_ns()
+    step_wall_clock(monkeypatch, STEP_NS)
+    assert gateway_clock.now_ns() >= before # the step is not seen between two syncs
+    offset_ns = gateway_clock.offset_ns
+    step = gateway_clock.sync()
+    assert step == pytest.approx(STEP_NS, abs=50_000_000)
+    assert gateway_clock.offset_ns == offset_ns + step
+    assert clock.CLOCK_STEP.value == step / 1e9
+    assert abs(gateway_clock.now_ns() - time.time_ns()) < 50_000_000 # follows the stepped wall clock again
+    assert gateway_clock.sync() == pytest.approx(0, abs=50_000_000) # no further step
+
+
+def test_discipline_applies_a_step_at_the_next_sync(monkeypatch):
+    async def run(gateway_clock: GatewayClock) -> list:
+        task = asyncio.create_task(gateway_clock.discipline(interval=0.01))
+        offsets = [gateway_clock.offset_ns]
+        try:
+            step_wall_clock(monkeypatch, STEP_NS)
+            while abs(gateway_clock.offset_ns - offsets[0]) < abs(STEP_NS) // 2:
+                await asyncio.sleep(0.005)
+            offsets.append(gateway_clock.offset_ns)
+            await asyncio.sleep(0.05) # later syncs find no further step
+            offsets.append(gateway_clock.offset_ns)
+        finally:
+            task.cancel()
+        return offsets
+
+    first, stepped, later = asyncio.run(asyncio.wait_for(run(GatewayClock()), 5))
+    assert stepped - first == pytest.approx(STEP_NS, abs=50_000_000)
+    assert later == pytest.approx(stepped, abs=50_000_000)
@@ -0,0 +1,79 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+
+from configs import config
+from iot_gateway.gateway import Gateway
+from simulators.modbus_server import ModbusSimulator
+from simulators.mqtt_broker import MqttBrokerStub
+from simulators.nmea_streamer import NmeaStreamer
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+CONSTRUCTION_PROBE = """
+import json, sys, threading
+import Main
+from iot_gateway.sensor_registry import REGISTRY
+loaded = "names" in REGISTRY.__dict__
+events = []
+sys.addaudithook(lambda event, args: events.append(event) if event in ("open", "os.mkdir", "socket.connect", "socket.bind") else None)
+Main.Gateway()
+print(json.dumps({"registry_loaded": loaded, "events": events, "threads": threading.active_count()}))
+"""
+
+
+def test_import_and_construction_do_no_io(tmp_path):
+    output = subprocess.run([sys.executable, "-c", CONSTRUCTION_PROBE], cwd=tmp_path, check=True, capture_output=True,
+                            text=True, env={**os.environ, "PYTHONPATH": ROOT_DIR}).stdout
+    assert json.loads(output.strip().splitlines()[-1]) == {"registry_loaded": False, "events": [], "threads": 1}
+    assert os.listdir(tmp_path) == []
+
+
+def test_run_connects_and_publishes_the_first_reading(tmp_path, monkeypatch):
+    async def run() -> None:
+        modbus, nmea, broker = ModbusSimulator(), NmeaStreamer(rate=50), MqttBrokerStub()
+        ports = await modbus.start(), await nmea.start(), await broker.start()
+        for name, value in (("MODBUS_HOST", "127.0.0.1"), ("NMEA_HOST", "127.0.0.1"), ("MQTT_BROKER_HOST", "127.0.0.1"),
+                            ("MODUBS_PORT", ports[0]), ("NMEA_PORT", ports[1]), ("MQTT_BROKER_PORT", ports[2]),
+                            ("MQTT_USE_TLS", False), ("METRICS_PORT", None), ("CAPTURE_PATH", None),
+                            ("HISTORY_STORE_PATH", str(tmp_path / "history")),
+                            ("OFFLINE_QUEUE_PATH", str(tmp_path / "outbound_queue.db"))):
+            monkeypatch.setattr(config, name, value)
+        gateway = Gateway()
+        task = asyncio.create_task(gateway.run())
+        try:
+            while gateway.first_publish is None:
+                assert not task.done(), task.exception()
+                await asyncio.sleep(0.01)
+            assert gateway.publisher.connected
+            assert gateway.modbus_client.cnx.is_open
+            assert any(topic.endswith("/rot") for _, topic, _ in broker.received)
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            gateway.publisher.stop()
+            await gateway.modbus_client.close() # gives the connection back to the CLIENT_POOL
+            for server in (modbus, nmea, broker):
+                await server.stop()
+
+    asyncio.run(asyncio.wait_for(run(), 10))
+
+
+def test_failing_optional_service_does_not_stop_the_others():
+    async def fail():
+        raise OSError(98, "address already in use")
+
+    async def run() -> list:
+        gateway = Gateway()
+        finished = []
+
+        async def poller():
+            await asyncio.sleep(0.05)
+            finished.append("poller")
+
+        await asyncio.gather(poller(), gateway._optional("metrics endpoint", fail()))
+        return finished
+
+    assert asyncio.run(run()) == ["poller"]
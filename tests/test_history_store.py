@@ -0,0 +1,87 @@
+import os
+import time
+
+import numpy as np
+
+from iot_gateway.history_store import HistoryStore, history_name, sensor_directory
+from iot_gateway.readings import Reading
+
+
+def store_with(tmp_path, readings, **kwargs) -> HistoryStore:
+    store = HistoryStore(str(tmp_path), **{"segment_records": 100, "max_age": 0, **kwargs})
+    store.extend(readings)
+    store.flush()
+    return store
+
+
+def segment_files(tmp_path, sensor: str) -> list:
+    return sorted(os.listdir(tmp_path / sensor_directory(sensor)))
+
+
+def test_sensor_directory_keeps_similar_names_apart():
+    assert sensor_directory("TI:ROT") != sensor_directory("TI ROT")
+    assert sensor_directory("TI:ROT") == sensor_directory("TI:ROT")
+    assert sensor_directory("Luffing motor 1 temperature (PS Winch)").startswith("Luffing_motor_1_temperature_PS_Winch-")
+
+
+def test_similar_sensor_names_are_stored_separately(tmp_path):
+    store_with(tmp_path, [Reading("TI:ROT", 1.0, "deg", timestamp=1000.0), Reading("TI ROT", 2.0, "deg", timestamp=1000.0)])
+    reopened = HistoryStore(str(tmp_path), segment_records=100, max_age=0)
+    assert np.array_equal(reopened.query("TI:ROT", 0, 2000)["value"], [1.0])
+    assert np.array_equal(reopened.query("TI ROT", 0, 2000)["value"], [2.0])
+
+
+def test_talkers_of_the_same_sensor_keep_separate_series(tmp_path):
+    readings = [Reading("ROT", 1.0, "deg", source="HE", timestamp=1.0), Reading("ROT", -1.0, "deg", source="TI", timestamp=2.0),
+                Reading("HE:ROT", 3.0, "deg", source="HE", timestamp=3.0), Reading("temp", 20.0, "C", timestamp=1.0)]
+    assert [history_name(reading) for reading in readings] == ["HE:ROT", "TI:ROT", "HE:ROT", "temp"]
+    store = store_with(tmp_path, readings)
+    assert store.query("HE:ROT", 0, 10)["value"].tolist() == [1.0, 3.0]
+    assert store.query("TI:ROT", 0, 10)["value"].tolist() == [-1.0]
+    assert store.query("temp", 0, 10)["value"].tolist() == [20.0]
+
+
+def test_query_includes_start_and_excludes_end(tmp_path):
+    store = store_with(tmp_path, [Reading("temp", float(second), "C", timestamp=second) for second in range(10)])
+    assert store.query("temp", 2, 5)["timestamp"].tolist() == [2.0, 3.0, 4.0]
+    assert len(store.query("temp", 10, 20)) == 0
+    assert len(store.query("unknown", 0, 20)) == 0
+
+
+def test_segments_roll_over_and_reopen(tmp_path):
+    store_with(tmp_path, [Reading("temp", float(second), "C", timestamp=second) for second in range(10)], segment_records=4)
+    assert len(segment_files(tmp_path, "temp")) == 3
+    with open(tmp_path / sensor_directory("temp") / segment_files(tmp_path, "temp")[-1], "ab") as file:
+        file.write(b"\x00" * 5) # a record torn by a crash
+    reopened = HistoryStore(str(tmp_path), segment_records=4, max_age=0)
+    assert reopened.query("temp", 0, 100)["timestamp"].tolist() == [float(second) for second in range(10)]
+    reopened.append(Reading("temp", 10.0, "C", timestamp=10))
+    assert reopened.query("temp", 9, 100)["timestamp"].tolist() == [9.0, 10.0]
+
+
+def test_out_of_order_readings_start_overlapping_segments(tmp_path):
+    store = store_with(tmp_path, [Reading("temp", value, "C", timestamp=value) for value in (1.0, 5.0, 3.0, 4.0, 2.0)])
+    assert len(segment_files(tmp_path, "temp")) == 3 # 1-5, 3-4 and 2
+    assert store.query("temp", 0, 10)["timestamp"].tolist() == [1.0, 2.0, 3.0, 4.0, 5.0]
+    assert store.query("temp", 2.5, 4.5)["timestamp"].tolist() == [3.0, 4.0]
+
+
+def test_downsample_buckets_valid_readings(tmp_path):
+    readings = [Reading("temp", float(second), "C", timestamp=100 + second) for second in range(10)]
+    readings.append(Reading("temp", 1000.0, "C", "V", timestamp=101.5)) # invalid, not aggregated
+    buckets = store_with(tmp_path, readings).downsample("temp", 100, 110, 4)
+    assert buckets["timestamp"].tolist() == [100.0, 104.0, 108.0]
+    assert buckets["count"].tolist() == [4, 4, 2]
+    assert buckets["min"].tolist() == [0.0, 4.0, 8.0]
+    assert buckets["max"].tolist() == [3.0, 7.0, 9.0]
+    assert buckets["mean"].tolist() == [1.5, 5.5, 8.5]
+
+
+def test_expired_segments_are_deleted_except_the_open_one(tmp_path):
+    now = time.time()
+    old = [Reading("temp", 1.0, "C", timestamp=now - 7200 + second) for second in range(4)]
+    store = store_with(tmp_path, old, segment_records=2, max_age=3600)
+    assert len(segment_files(tmp_path, "temp")) == 1 # the open segment is kept
+    store.extend([Reading("temp", 2.0, "C", timestamp=now + second) for second in range(3)])
+    store.flush()
+    assert store.query("temp", 0, now + 10)["timestamp"].tolist() == [now, now + 1, now + 2]
@@ -0,0 +1,31 @@
+import logging
+
+from utils.logger import RateLimitFilter
+
+
+def record(message: str, created: float, level: int = logging.ERROR, name: str = "test") -> logging.LogRecord:
+    entry = logging.LogRecord(name, level, __file__, 1, message, None, None)
+    entry.created = created
+    return entry
+
+
+def test_burst_per_template_and_suppressed_count():
+    limiter = RateLimitFilter(interval=60, burst=2)
+    passed = [limiter.filter(record("checksum %s", 1.0 + index)) for index in range(5)]
+    assert passed == [True, True, False, False, False]
+    first = record("checksum %s", 70.0)
+    assert limiter.filter(first)
+    assert first.suppressed == 3
+
+
+def test_info_records_are_not_limited():
+    limiter = RateLimitFilter(interval=60, burst=1)
+    assert all(limiter.filter(record("poll", 1.0, level=logging.INFO)) for _ in range(5))
+
+
+def test_expired_windows_are_dropped():
+    limiter = RateLimitFilter(interval=60, burst=10)
+    for index in range(1000):
+        limiter.filter(record(f"retention removed {index}", 1.0))
+    limiter.filter(record("later", 62.0))
+    assert len(limiter._windows) == 1
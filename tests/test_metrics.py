@@ -0,0 +1,86 @@
+import asyncio
+import math
+import socket
+
+import pytest
+
+from utils.metrics import Histogram, MetricsRegistry, MetricsServer
+
+
+def test_histogram_quantile_interpolates_inside_the_bucket():
+    histogram = Histogram("latency", buckets=(1.0, 2.0, 4.0))
+    assert math.isnan(histogram.quantile(0.5))
+    for value in (0.5, 1.5, 1.5, 3.0):
+        histogram.observe(value)
+    assert histogram.counts == [1, 2, 1, 0]
+    assert histogram.quantile(0.25) == 1.0 # the whole first bucket
+    assert histogram.quantile(0.5) == 1.5 # half way through the second bucket
+    assert histogram.quantile(1.0) == 4.0
+    assert (histogram.sum, histogram.count) == (6.5, 4)
+
+
+def test_histogram_quantile_in_the_inf_bucket_is_the_highest_bound():
+    histogram = Histogram("latency", buckets=(1.0, 2.0))
+    histogram.observe(10.0)
+    assert histogram.quantile(0.99) == 2.0
+
+
+def test_render_escapes_labels_and_writes_histogram_series():
+    registry = MetricsRegistry()
+    registry.counter("gateway_errors_total", "Errors\nby \\ reason", reason='bad "quote"\\\n').inc(2)
+    histogram = registry.histogram("gateway_rtt_seconds", "Round trip time", buckets=(0.1, 1.0), device="plc")
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5.0)
+    assert registry.counter("gateway_errors_total", "", reason='bad "quote"\\\n').value == 2 # same metric
+    with pytest.raises(ValueError):
+        registry.gauge("gateway_errors_total", "")
+    assert registry.render().splitlines() == [
+        "# HELP gateway_errors_total Errors\\nby \\\\ reason",
+        "# TYPE gateway_errors_total counter",
+        'gateway_errors_total{reason="bad \\"quote\\"\\\\\\n"} 2',
+        "# HELP gateway_rtt_seconds Round trip time",
+        "# TYPE gateway_rtt_seconds histogram",
+        'gateway_rtt_seconds_bucket{device="plc",le="0.1"} 1',
+        'gateway_rtt_seconds_bucket{device="plc",le="1.0"} 2',
+        'gateway_rtt_seconds_bucket{device="plc",le="+Inf"} 3',
+        'gateway_rtt_seconds_sum{device="plc"} 5.55',
+        'gateway_rtt_seconds_count{device="plc"} 3',
+    ]
+
+
+def test_server_on_port_zero_is_scraped():
+    async def get(port: int, path: str) -> bytes:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+        response = await reader.read()
+        writer.close()
+        return response
+
+    async def run() -> None:
+        registry = MetricsRegistry()
+        registry.gauge("gateway_inflight", "Messages in flight").set(3)
+        server = MetricsServer("127.0.0.1", 0, registry)
+        serving = asyncio.create_task(server.serve())
+        while not server.port:
+            await asyncio.sleep(0.01)
+        try:
+            headers, body = (await get(server.port, "/metrics")).split(b"\r\n\r\n", 1)
+            assert headers.startswith(b"HTTP/1.1 200 OK")
+            assert b"Content-Type: text/plain; version=0.0.4" in headers
+            assert body.decode() == registry.render()
+            assert b"gateway_inflight 3" in body
+            assert (await get(server.port, "/other")).startswith(b"HTTP/1.1 404")
+        finally:
+            serving.cancel()
+            await asyncio.gather(serving, return_exceptions=True)
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_serve_returns_when_the_port_is_in_use():
+    with socket.socket() as busy:
+        busy.bind(("127.0.0.1", 0))
+        busy.listen()
+        server = MetricsServer("127.0.0.1", busy.getsockname()[1], MetricsRegistry())
+        asyncio.run(asyncio.wait_for(server.serve(), 5)) # logged, does not raise
@@ -0,0 +1,25 @@
+from iot_gateway.modbus_scheduler import coalesce_registers
+
+
+def test_adjacent_and_close_registers_are_merged():
+    assert coalesce_registers([0, 1, 2, 3]) == [(0, 4)]
+    assert coalesce_registers([10, 0, 3], max_gap=2) == [(0, 4), (10, 1)]
+
+
+def test_gap_larger_than_max_gap_starts_a_new_request():
+    assert coalesce_registers([0, 4], max_gap=2) == [(0, 1), (4, 1)]
+    assert coalesce_registers([0, 3], max_gap=2) == [(0, 4)]
+
+
+def test_requests_stay_within_max_count():
+    assert coalesce_registers(range(300), max_gap=0, max_count=125) == [(0, 125), (125, 125), (250, 50)]
+
+
+def test_multi_register_values_are_not_split():
+    assert coalesce_registers([0, 2], max_gap=0, sizes={0: 2, 2: 2}) == [(0, 4)]
+    assert coalesce_registers([0, 2], max_gap=0, max_count=3, sizes={0: 2, 2: 2}) == [(0, 2), (2, 2)]
+
+
+def test_duplicates_and_empty_input():
+    assert coalesce_registers([5, 5, 5]) == [(5, 1)]
+    assert coalesce_registers([]) == []
@@ -0,0 +1,19 @@
+import asyncio
+
+from iot_gateway.async_modbus import CLIENT_POOL
+from iot_gateway.modubs_tcp import ModbusClientHandler
+
+
+def test_asyncio_handler_uses_the_pooled_client_and_releases_it():
+    async def run() -> None:
+        handler = ModbusClientHandler("127.0.0.1", 15020, 1, use_asyncio=True)
+        other = ModbusClientHandler("127.0.0.1", 15020, 2, use_asyncio=True)
+        assert not hasattr(handler, "breaker") # the breaker of the endpoint belongs to the AsyncModbusClient
+        assert handler.cnx is other.cnx
+        await handler.close()
+        await handler.close()
+        assert len(CLIENT_POOL) == 1
+        await other.close()
+        assert len(CLIENT_POOL) == 0
+
+    asyncio.run(run())
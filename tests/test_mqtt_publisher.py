@@ -0,0 +1,150 @@
+import asyncio
+
+from iot_gateway.mqtt_publisher import InflightWindow, MQTTPublisher
+from iot_gateway.outbound_queue import OutboundQueue
+from iot_gateway.readings import Reading
+
+
+def test_readings_kept_in_the_outbound_queue_do_not_count_as_published(tmp_path):
+    queue = OutboundQueue(str(tmp_path / "outbound.db"), max_bytes=1 << 20, max_age=3600)
+    publisher = MQTTPublisher("127.0.0.1", 1, "", "", outbound_queue=queue, payload_format="text") # nothing listens on port 1
+    try:
+        reading = Reading("Luffing motor 1 temperature (PS Winch)", 21.5, "C")
+        assert not asyncio.run(publisher.publish_async(reading))
+        assert not publisher.publish(reading)
+        assert len(queue) == 2
+    finally:
+        publisher.stop()
+
+
+def test_batch_refused_by_a_full_window_is_not_published():
+    publisher = MQTTPublisher("127.0.0.1", 1, "", "", max_inflight=1, backpressure_policy="drop", payload_format="json")
+    try:
+        publisher.connected = True # as if the broker was up, nothing is queued
+        assert publisher.window.try_acquire() # the only slot is taken by an unacknowledged message
+        readings = [Reading("Luffing motor 1 temperature (PS Winch)", 20 + index, "C") for index in range(publisher.batcher.max_readings)]
+        assert all(publisher.publish(reading) for reading in readings[:-1]) # added to the batch
+        assert not publisher.publish(readings[-1]) # completes the batch, which the window drops
+        assert publisher.window.dropped == 1
+    finally:
+        publisher.connected = False
+        publisher.stop()
+
+
+def test_window_blocks_until_an_acknowledgement_frees_a_slot():
+    async def run() -> None:
+        window = InflightWindow(1, "block")
+        assert await window.acquire()
+        window.track(1)
+        waiter = asyncio.create_task(window.acquire())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        window.acknowledge(1) # PUBACK from the paho thread, the slot goes to the waiting producer
+        assert await asyncio.wait_for(waiter, 1)
+        assert window.inflight == 1
+
+    asyncio.run(run())
+
+
+def test_window_drops_when_full():
+    async def run() -> None:
+        window = InflightWindow(1, "drop")
+        assert await window.acquire()
+        assert not await window.acquire()
+        assert not window.try_acquire()
+        assert window.dropped == 2
+        waiter = asyncio.create_task(window.acquire(wait=True)) # replayed messages wait even with the drop policy
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        window.release()
+        assert await asyncio.wait_for(waiter, 1)
+
+    asyncio.run(run())
+
+
+def test_acknowledgement_before_track_releases_the_slot():
+    async def run() -> None:
+        window = InflightWindow(2)
+        assert await window.acquire()
+        window.acknowledge(7) # the broker answered before client.publish() returned the mid
+        assert window.inflight == 1
+        window.track(7)
+        assert window.inflight == 0
+
+    asyncio.run(run())
+
+
+def test_reset_on_disconnect_frees_the_slots_and_ignores_late_acknowledgements():
+    async def run() -> None:
+        window = InflightWindow(2)
+        for mid in (1, 2):
+            assert await window.acquire()
+            window.track(mid)
+        assert window.is_full
+        window.reset()
+        await asyncio.sleep(0) # the slots are given back on the event loop
+        assert window.inflight == 0
+        window.acknowledge(1) # the message was sent again after the reconnect
+        await asyncio.sleep(0)
+        assert window.inflight == 0
+        assert await window.acquire()
+        window.track(1) # paho reused the mid
+        window.acknowledge(1)
+        await asyncio.sleep(0)
+        assert window.inflight == 0
+
+    asyncio.run(run())
+
+
+class FakePaho:
+    """
+    Stands in for the paho client: records the published messages, the test acknowledges them.
+    """
+    def __init__(self) -> None:
+        self.published: list = [] # (mid, topic, payload)
+
+    def publish(self, topic, payload=None, qos=0, properties=None):
+        mid = len(self.published) + 1
+        self.published.append((mid, topic, payload))
+        return type("MessageInfo", (), {"rc": 0, "mid": mid})()
+
+
+def test_replayed_messages_stay_queued_until_acknowledged(tmp_path):
+    async def wait_until(condition) -> None:
+        while not condition():
+            await asyncio.sleep(0.005)
+
+    async def run(publisher: MQTTPublisher, queue: OutboundQueue, fake: FakePaho) -> None:
+        replay = asyncio.create_task(publisher.replay_outbound_queue(rate=300, interval=0.01))
+        try:
+            await wait_until(lambda: len(fake.published) == 3)
+            await asyncio.sleep(0.05)
+            assert len(fake.published) == 3 # handed to paho once
+            assert len(queue) == 3 # nothing acknowledged yet
+            publisher.on_publish(None, None, 1) # PUBACK of the first message
+            await wait_until(lambda: len(queue) == 2)
+            publisher.on_disconnect(None, None, 0) # the other two are lost with the connection
+            publisher.connected = True # reconnected
+            await wait_until(lambda: len(fake.published) == 5)
+            assert [payload for _, _, payload in fake.published[3:]] == [b"1", b"2"]
+            publisher.on_publish(None, None, 2) # late PUBACK of a message lost with the connection, ignored
+            publisher.on_publish(None, None, 4)
+            publisher.on_publish(None, None, 5)
+            await wait_until(lambda: len(queue) == 0)
+            assert publisher.window.inflight == 0
+        finally:
+            replay.cancel()
+            await asyncio.gather(replay, return_exceptions=True)
+
+    queue = OutboundQueue(str(tmp_path / "outbound.db"), max_bytes=1 << 20, max_age=3600)
+    for index in range(3):
+        queue.put("crane/luffing/temp-mot-1", str(index).encode())
+    publisher = MQTTPublisher("127.0.0.1", 1, "", "", outbound_queue=queue, payload_format="text")
+    publisher.client.loop_stop() # no network thread, the connection state is set by the test
+    fake, client = FakePaho(), publisher.client
+    publisher.client, publisher.connected = fake, True
+    try:
+        asyncio.run(asyncio.wait_for(run(publisher, queue, fake), 5))
+    finally:
+        publisher.connected, publisher.client = False, client
+        publisher.stop()
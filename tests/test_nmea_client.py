@@ -0,0 +1,34 @@
+from iot_gateway.nmea_client import NmeaSentenceFramer
+
+
+def test_sentence_split_across_chunks_is_reassembled():
+    framer = NmeaSentenceFramer()
+    assert framer.feed(b"$HEROT,1.0,A*00\r\n$HERO") == [b"$HEROT,1.0,A*00"]
+    assert framer.feed(b"T,2.0,A*00\r\n") == [b"$HEROT,2.0,A*00"]
+    assert framer.buffer == b""
+
+
+def test_next_dollar_closes_a_sentence_without_line_ending():
+    framer = NmeaSentenceFramer()
+    assert framer.feed(b"$HEROT,1.0,A*00$HEROT,2.0,A*00\r\n") == [b"$HEROT,1.0,A*00", b"$HEROT,2.0,A*00"]
+
+
+def test_garbage_before_the_first_sentence_is_skipped():
+    framer = NmeaSentenceFramer()
+    assert framer.feed(b"\x00\xffnoise$HEROT,1.0,A*00\r\n") == [b"$HEROT,1.0,A*00"]
+
+
+def test_unframed_bytes_are_dropped_above_max_buffer():
+    framer = NmeaSentenceFramer(max_buffer=16)
+    assert framer.feed(b"$" + b"x" * 32) == []
+    assert framer.buffer == b""
+    assert framer.feed_block(b"y" * 32) == b"y" * 32 # returned to the parser, which skips it
+    assert framer.buffer == b""
+
+
+def test_feed_block_keeps_the_unfinished_sentence():
+    framer = NmeaSentenceFramer()
+    assert framer.feed_block(b"$HEROT,1.0,A*00\r\n$HEROT,2.") == b"$HEROT,1.0,A*00\r\n"
+    assert framer.feed_block(b"0,A*00\r\n") == b"$HEROT,2.0,A*00\r\n"
+    assert framer.feed_block(b"\r\nno sentence yet") == b""
+    assert framer.buffer == b"\r\nno sentence yet"
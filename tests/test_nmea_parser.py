@@ -0,0 +1,55 @@
+from functools import reduce
+
+from iot_gateway import nmea_parser
+from iot_gateway.nmea_parser import nmea_checksum, parse_buffer, parse_sentence
+
+
+def sentence(body: bytes) -> bytes:
+    return b"$" + body + b"*" + f"{reduce(lambda a, b: a ^ b, body, 0):02X}".encode("ascii") + b"\r\n"
+
+
+def test_checksum_matches_bytewise_xor_for_all_lengths():
+    for length in (0, 1, 7, 8, 9, 63, 64, 65, 128, 129, 500, 4096):
+        data = bytes((index * 37 + 11) % 256 for index in range(length))
+        assert nmea_checksum(data) == reduce(lambda a, b: a ^ b, data, 0)
+
+
+def test_parse_sentence_rot():
+    assert parse_sentence(sentence(b"HEROT,-3.5,A")) == ("HE", "ROT", [("ROT", -3.5, "deg", "A")])
+
+
+def test_parse_sentence_rejects_bad_checksum():
+    assert parse_sentence(b"$HEROT,-3.5,A*7F") is None
+
+
+def test_parse_sentence_overlong_line_does_not_raise():
+    line = sentence(b"HEROT," + b"1" * 300 + b",A").rstrip(b"\r\n")
+    assert parse_sentence(line) is None # longer than the NMEA 0183 limit, logged and skipped
+
+
+def test_parse_buffer_skips_corrupt_and_unknown_sentences():
+    block = sentence(b"HEROT,1.0,A") + b"$HEROT,2.0,A*00\r\n" + sentence(b"GPXXX,1") + sentence(b"TIROT,3.0,V")
+    assert parse_buffer(block) == [("HE", "ROT", [("ROT", 1.0, "deg", "A")]), ("TI", "ROT", [("ROT", 3.0, "deg", "V")])]
+
+
+def test_parse_buffer_filters_sentence_types():
+    block = sentence(b"HEROT,1.0,A") + sentence(b"HEHDT,90.0,T")
+    assert [entry[1] for entry in parse_buffer(block, {b"HDT"})] == ["HDT"]
+    assert b"ROT" in nmea_parser.SENTENCE_HANDLERS
+
+
+def test_parse_buffer_skips_overlong_sentence():
+    assert parse_buffer(sentence(b"HEROT," + b"1" * 300 + b",A") + sentence(b"HEROT,1.0,A")) == [("HE", "ROT", [("ROT", 1.0, "deg", "A")])]
+
+
+def test_parse_sentence_rejects_invalid_talker_id():
+    assert parse_sentence(sentence(b"h\xe9ROT,-3.5,A")) is None
+    assert parse_sentence(sentence(b"ROT,-3.5,A")) is None
+
+
+def test_address_cache_is_bounded():
+    talkers = [f"{index:04d}".encode("ascii") for index in range(2 * nmea_parser.MAX_CACHED_ADDRESSES)]
+    for talker in talkers:
+        assert parse_sentence(sentence(talker + b"ROT,1.0,A"))[0] == talker.decode("ascii")
+    assert parse_buffer(b"".join(sentence(talker + b"HDT,1.0,T") for talker in talkers))[-1][0] == talkers[-1].decode("ascii")
+    assert len(nmea_parser._ADDRESSES) <= nmea_parser.MAX_CACHED_ADDRESSES
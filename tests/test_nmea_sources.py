@@ -0,0 +1,63 @@
+import socket
+import time
+
+from iot_gateway.nmea_sources import SourceSelector, receive_datagrams, tag_source
+
+SECOND = 1_000_000_000
+
+
+def test_first_source_owns_talker_and_duplicates_are_dropped():
+    selector = SourceSelector(timeout=5)
+    assert selector.accept("a", "HE", "ROT", 0)
+    assert not selector.accept("b", "HE", "ROT", 1 * SECOND)
+    assert selector.accept("a", "HE", "ROT", 2 * SECOND)
+    assert selector.accept("b", "HE", "HDT", 2 * SECOND) # another sentence type has its own owner
+
+
+def test_next_source_takes_over_after_timeout():
+    selector = SourceSelector(timeout=5)
+    assert selector.accept("a", "HE", "ROT", 0)
+    assert not selector.accept("b", "HE", "ROT", 5 * SECOND)
+    assert selector.accept("b", "HE", "ROT", 6 * SECOND)
+    assert not selector.accept("a", "HE", "ROT", 7 * SECOND)
+
+
+def test_devices_with_the_same_talker_are_kept_apart_by_tag_source():
+    selector = SourceSelector(timeout=5)
+    assert selector.accept("10.0.0.1:60001", "GP", "VTG", 0, "GP0001")
+    assert selector.accept("10.0.0.2:60001", "GP", "VTG", 0, "GP0002")
+    assert not selector.accept("10.0.1.1:60001", "GP", "VTG", 0, "GP0001") # same device over the second LAN
+
+
+def test_zero_timeout_accepts_every_source():
+    selector = SourceSelector(timeout=0)
+    assert selector.accept("a", "HE", "ROT", 0)
+    assert selector.accept("b", "HE", "ROT", 0)
+
+
+def test_tag_source():
+    assert tag_source(b"UdPbC\x00\\s:GP0001,n:12*5C\\$GPVTG,1.0*00\r\n") == "GP0001"
+    assert tag_source(b"\\g:1-2-73,s:TI0002*11\\$TIROT,1.0,A*00\r\n") == "TI0002"
+    assert tag_source(b"\\n:12*00\\$GPVTG,1.0*00\r\n") == ""
+    assert tag_source(b"$GPVTG,1.0*00\r\n\\s:GP0001*00\\") == "" # only a TAG block before the first sentence counts
+
+
+def test_receive_datagrams_groups_by_sender_and_tag_source():
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        receiver.bind(("127.0.0.1", 0))
+        receiver.setblocking(False)
+        sender.bind(("127.0.0.1", 0))
+        datagrams = [b"\\s:GP0001*00\\$GPVTG,1*00", b"\\s:GP0002*00\\$GPVTG,2*00", b"\\s:GP0001*00\\$GPVTG,3*00"]
+        for datagram in datagrams:
+            sender.sendto(datagram, receiver.getsockname())
+        time.sleep(0.05)
+        address = "%s:%d" % sender.getsockname()
+        assert receive_datagrams(receiver) == {
+            (address, "GP0001"): datagrams[0] + b"\r\n" + datagrams[2] + b"\r\n",
+            (address, "GP0002"): datagrams[1] + b"\r\n",
+        }
+    finally:
+        receiver.close()
+        sender.close()
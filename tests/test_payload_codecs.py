@@ -0,0 +1,43 @@
+import pytest
+
+from iot_gateway.payload_codecs import CODECS, OPTIONAL_DEPENDENCIES, StructCodec, get_codec
+from iot_gateway.readings import Reading
+
+AVAILABLE = [name for name in CODECS if name != "text" and OPTIONAL_DEPENDENCIES.get(name, (None, True))[1] is not None]
+
+
+def readings() -> list:
+    return [Reading("temp_1", 21.5, "C", "A", timestamp=1_700_000_000.0),
+            Reading("counter", 4_294_967_295, "", "A", timestamp=1_700_000_000.25), # uint32 max
+            Reading("temp_1", 21.75, "C", "V", timestamp=1_700_000_001.5),
+            Reading("position", -2_147_483_647, "", "A", timestamp=1_700_000_002.0)] # int32
+
+
+@pytest.mark.parametrize("name", AVAILABLE)
+def test_batch_codecs_round_trip(name):
+    codec = get_codec(name)
+    decoded = sorted(codec.decode(codec.encode(readings())))
+    expected = sorted([("temp_1", 21.5, "C", True, 1_700_000_000.0),
+                       ("temp_1", 21.75, "C", False, 1_700_000_001.5),
+                       ("counter", 4_294_967_295, "", True, 1_700_000_000.25),
+                       ("position", -2_147_483_647, "", True, 1_700_000_002.0)])
+    assert [entry[:4] for entry in decoded] == [entry[:4] for entry in expected] # int32/uint32 values are exact
+    assert [entry[4] for entry in decoded] == pytest.approx([entry[4] for entry in expected], abs=1e-3)
+
+
+def test_struct_codec_holds_more_than_255_sensor_groups():
+    codec = StructCodec()
+    batch = [Reading(f"sensor_{index}", index, "C", "A", timestamp=1_700_000_000.0) for index in range(300)]
+    decoded = codec.decode(codec.encode(batch))
+    assert len(decoded) == 300
+    assert decoded[299][:2] == ("sensor_299", 299)
+
+
+def test_struct_codec_rejects_other_payloads():
+    with pytest.raises(ValueError):
+        StructCodec().decode(b"XX\x01\x00\x00")
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        get_codec("xml")
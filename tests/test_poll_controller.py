@@ -0,0 +1,49 @@
+import warnings
+
+import numpy as np
+
+from iot_gateway.poll_controller import AdaptivePollInterval
+
+
+def controller(deadbands, **kwargs):
+    return AdaptivePollInterval(2.0, 0.5, 30.0, deadbands, deadband_fraction=0.5, backoff=1.5, **kwargs)
+
+
+def test_interval_grows_by_backoff_while_values_are_steady():
+    poll = controller([1.0])
+    poll.update([10.0], 0.0)
+    assert poll.update([10.0], 2.0) == 3.0
+    assert poll.update([10.0], 5.0) == 4.5
+
+
+def test_interval_drops_when_values_move():
+    poll = controller([1.0])
+    poll.update([10.0], 0.0)
+    assert poll.update([12.0], 2.0) == 0.5 # one deadband per second -> half a deadband every 0.5 s
+
+
+def test_zero_deadband_counts_any_change_as_a_full_deadband():
+    poll = controller([0.0, 1.0])
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        poll.update([3.0, 10.0], 0.0)
+        assert poll.update([4.0, 10.0], 2.0) == 1.0
+        assert poll.update([5.0, 10.0], 3.0) == 0.5
+    assert np.isfinite(poll.rate)
+
+
+def test_zero_deadband_without_change_backs_off():
+    poll = controller([0.0])
+    poll.update([3.0], 0.0)
+    assert poll.update([3.0], 2.0) == 3.0
+
+
+def test_nan_and_inf_values_do_not_poison_the_rate():
+    poll = controller([1.0, 1.0])
+    poll.update([np.nan, 1.0], 0.0)
+    assert poll.update([np.nan, 1.0], 2.0) == 3.0
+    poll.update([np.inf, 1.0], 3.0)
+    assert np.isfinite(poll.rate)
+    poll.update([1.0, 1.0], 4.0)
+    assert np.isfinite(poll.rate)
+    assert 0.5 <= poll.interval <= 30.0
@@ -0,0 +1,51 @@
+import struct
+
+import numpy as np
+import pytest
+
+from iot_gateway.register_decoding import RegisterDecoder, register_count
+
+
+def words(fmt: str, *values) -> list:
+    """
+    Big endian bytes of the values as a list of 16 bit registers.
+    """
+    data = struct.pack(">" + fmt, *values)
+    return list(struct.unpack(f">{len(data) // 2}H", data))
+
+
+def test_plain_registers_are_integers():
+    decoder = RegisterDecoder([{"address": 10}, {"address": 12}], start=10)
+    decoded = decoder.decode([215, 0, 65535])
+    assert decoded.dtype == np.int64
+    assert decoded.tolist() == [215, 65535]
+
+
+def test_signed_and_32_bit_types():
+    registers = [{"address": 0, "type": "int16"}, {"address": 1, "type": "int32"}, {"address": 3, "type": "uint32"},
+                 {"address": 5, "type": "float32"}]
+    decoded = RegisterDecoder(registers, start=0).decode(words("hiIf", -5, -2_147_483_647, 4_294_967_295, 21.5))
+    assert decoded.tolist() == [-5, -2_147_483_647, 4_294_967_295, 21.5]
+
+
+def test_byte_and_word_order():
+    low_word_first = words("i", 123_456)[::-1]
+    swapped_bytes = [int.from_bytes(word.to_bytes(2, "big"), "little") for word in words("h", -2)]
+    registers = [{"address": 0, "type": "int32", "word_order": "little"}, {"address": 2, "type": "int16", "byte_order": "little"}]
+    assert RegisterDecoder(registers, start=0).decode(low_word_first + swapped_bytes).tolist() == [123_456, -2]
+
+
+def test_mask_scale_and_offset():
+    registers = [{"address": 0, "mask": 0b0100}, {"address": 0, "mask": 0b1000}, {"address": 1, "scale": 0.1, "offset": -40}]
+    decoded = RegisterDecoder(registers, start=0).decode([0b0100, 650])
+    assert decoded[:2].tolist() == [1, 0]
+    assert decoded[2] == pytest.approx(25.0)
+
+
+def test_register_count_validates_descriptors():
+    assert register_count({"address": 0}) == 1
+    assert register_count({"address": 0, "type": "float32"}) == 2
+    for descriptor in ({"address": 0, "type": "int64"}, {"address": 0, "word_order": "middle"},
+                       {"address": 0, "type": "float32", "mask": 1}):
+        with pytest.raises(ValueError):
+            register_count(descriptor)
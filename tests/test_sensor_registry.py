@@ -0,0 +1,143 @@
+import asyncio
+import os
+
+import numpy as np
+import pytest
+
+from configs import config
+from iot_gateway.sensor_registry import DEFAULT_POLL_INTERVAL, SensorRegistry
+
+REGISTRY_FILE = """
+static_text = "crane"
+
+[[devices]]
+host = "plc"
+port = 502
+unit_id = 3
+
+[[devices.registers]]
+address = 0
+sensor = "Motor temperature"
+topic = "motor/temp"
+poll_interval = 1
+deadband = 0.5
+
+[[devices.registers]]
+address = 4
+sensor = "Hydraulic pressure"
+topic = "hydraulic/pressure"
+unit = "bar"
+type = "float32"
+scale = 0.1
+
+[[devices.registers]]
+address = 8
+sensor = "Spare input"
+
+[[sensors]]
+sensor = "ROT"
+topic = "rot"
+heartbeat = 30
+"""
+
+
+def write(path, text: str, mtime_ns: int) -> None:
+    path.write_text(text)
+    os.utime(path, ns=(mtime_ns, mtime_ns)) # explicit times, a rewrite within the clock resolution is still seen
+
+
+@pytest.fixture
+def registry_file(tmp_path):
+    path = tmp_path / "sensors.toml"
+    write(path, REGISTRY_FILE, 1_000_000_000)
+    return path
+
+
+def test_registry_file_is_compiled_into_tables(registry_file):
+    registry = SensorRegistry(str(registry_file))
+    assert registry.names == ["Motor temperature", "Hydraulic pressure", "Spare input", "ROT"]
+    assert registry.ids == {name: sensor_id for sensor_id, name in enumerate(registry.names)}
+    assert registry.units == ["C", "bar", "C", ""]
+    assert registry.topics == ["crane/motor/temp", "crane/hydraulic/pressure", None, "crane/rot"]
+    assert registry.topic("ROT") == "crane/rot" and registry.topic("unknown") is None
+    np.testing.assert_array_equal(registry.deadband, [0.5, config.MIN_TEMPERATURE_CHANGE, config.MIN_TEMPERATURE_CHANGE, config.MIN_ROT_CHANGE])
+    np.testing.assert_array_equal(registry.heartbeat, [config.MIN_ELAPSED_TIME * 60] * 3 + [30])
+    assert registry.registers == {("plc", 502, 3): {0: 0, 4: 1, 8: 2}}
+    device = registry.devices[0]
+    assert (device["host"], device["port"], device["unit_id"]) == ("plc", 502, 3)
+    assert [register["poll_interval"] for register in device["registers"]] == [1, DEFAULT_POLL_INTERVAL, DEFAULT_POLL_INTERVAL]
+    assert device["registers"][1]["type"] == "float32" and device["registers"][1]["scale"] == 0.1
+
+
+def test_reload_keeps_the_ids_of_known_sensors(registry_file):
+    registry = SensorRegistry(str(registry_file))
+    ids = dict(registry.ids)
+    changed = REGISTRY_FILE.replace('sensor = "Spare input"', 'sensor = "Brake temperature"\ntopic = "brake/temp"')
+    changed = changed.replace('topic = "motor/temp"', 'topic = "motor/temperature"')
+    write(registry_file, changed, 2_000_000_000)
+    assert registry.reload_if_changed()
+    assert {name: registry.ids[name] for name in ids} == ids
+    assert registry.ids["Brake temperature"] == len(ids) # new sensors are appended
+    assert registry.topics[ids["Spare input"]] is None # a removed sensor keeps its row without a topic
+    assert registry.topic("Motor temperature") == "crane/motor/temperature"
+    assert registry.registers[("plc", 502, 3)][8] == registry.ids["Brake temperature"]
+    assert not registry.reload_if_changed() # unchanged file
+
+
+def test_versions_follow_the_changes(registry_file):
+    registry = SensorRegistry(str(registry_file))
+    version, devices_version = registry.version, registry.devices_version
+    write(registry_file, REGISTRY_FILE.replace("heartbeat = 30", "heartbeat = 60"), 2_000_000_000)
+    assert registry.reload_if_changed()
+    assert (registry.version, registry.devices_version) == (version + 1, devices_version) # the devices did not change
+    write(registry_file, REGISTRY_FILE.replace("poll_interval = 1", "poll_interval = 0.5"), 3_000_000_000)
+    assert registry.reload_if_changed()
+    assert (registry.version, registry.devices_version) == (version + 2, devices_version + 1)
+    registry.sensor_id("HE:HDT") # sensors added at runtime change the tables, not the devices
+    assert (registry.version, registry.devices_version) == (version + 3, devices_version + 1)
+
+
+def test_watch_rejects_an_invalid_file_and_keeps_the_tables(registry_file):
+    async def run(registry) -> None:
+        watcher = asyncio.create_task(registry.watch(interval=0.01))
+        try:
+            write(registry_file, REGISTRY_FILE.replace("poll_interval = 1", "poll_interval = 0"), 2_000_000_000)
+            while registry._mtime != 2_000_000_000:
+                await asyncio.sleep(0.01)
+            assert (registry.version, registry.topics) == (version, topics)
+            write(registry_file, REGISTRY_FILE + "[[sensors]\n", 3_000_000_000) # TOML syntax error
+            while registry._mtime != 3_000_000_000:
+                await asyncio.sleep(0.01)
+            assert (registry.version, registry.topics) == (version, topics)
+            write(registry_file, REGISTRY_FILE.replace('topic = "rot"', 'topic = "gyro/rot"'), 4_000_000_000)
+            while registry.version == version: # a valid file is loaded again
+                await asyncio.sleep(0.01)
+            assert registry.topic("ROT") == "crane/gyro/rot"
+        finally:
+            watcher.cancel()
+
+    registry = SensorRegistry(str(registry_file))
+    version, topics = registry.version, list(registry.topics)
+    asyncio.run(asyncio.wait_for(run(registry), 5))
+
+
+def test_invalid_file_on_first_use_raises_every_time(registry_file):
+    write(registry_file, REGISTRY_FILE.replace('sensor = "Spare input"', 'sensor = "ROT"'), 2_000_000_000)
+    registry = SensorRegistry(str(registry_file)) # nothing is read yet
+    for _ in range(2):
+        with pytest.raises(ValueError, match="defined twice"):
+            registry.names
+
+
+def document(**register) -> dict:
+    return {"static_text": "crane", "devices": [{"registers": [{"address": 0, "sensor": "T1", "topic": "t1", **register}]}]}
+
+
+@pytest.mark.parametrize("register", [{"poll_interval": 0}, {"poll_interval": -1}, {"poll_interval": "2"},
+                                      {"poll_interval": float("nan")}, {"min_interval": 0}, {"max_interval": 0}])
+def test_invalid_poll_intervals_are_rejected(register):
+    registry = SensorRegistry()
+    version = registry.version
+    with pytest.raises(ValueError, match="_interval"):
+        registry.compile(document(**register))
+    assert registry.version == version # the previous tables are kept
@@ -0,0 +1,27 @@
+from iot_gateway.sharded_runtime import assign_shards
+
+
+def device(host: str, *intervals: float) -> dict:
+    return {"host": host, "port": 502, "unit_id": 1,
+            "registers": [{"address": address, "sensor": f"{host} {address}", "poll_interval": interval}
+                          for address, interval in enumerate(intervals)]}
+
+
+def test_sources_are_balanced_by_expected_readings():
+    busy, quiet, idle = device("busy", 0.1, 0.1), device("quiet", 1, 1), device("idle", 10)
+    stream = {"port": 10110, "rate": 5}
+    shards = assign_shards([idle, quiet, busy], [stream], 2)
+    assert [shard["load"] for shard in shards] == [20.0, 7.1]
+    assert shards[0]["devices"] == [busy] and shards[0]["streams"] == []
+    assert shards[1]["devices"] == [quiet, idle] and shards[1]["streams"] == [stream]
+
+
+def test_stream_rate_defaults_to_ten_readings_per_second():
+    shards = assign_shards([device("slow", 1)], [{"port": 10110}], 1)
+    assert shards[0]["load"] == 11.0
+
+
+def test_workers_without_sources_are_left_out():
+    shards = assign_shards([device("only", 2)], [], 4)
+    assert len(shards) == 1
+    assert assign_shards([], [], 0) == []
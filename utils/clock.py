@@ -0,0 +1,98 @@
+"""
+Gateway clock: readings are stamped with the monotonic clock when their bytes arrive and mapped to UTC epoch
+nanoseconds.
+
+time.monotonic_ns() never jumps, so intervals measured between two stamps (change filter heartbeats, end to end
+latency, the publish timeout) are not disturbed by NTP corrections or a manual change of the system time. The
+monotonic stamps are turned into UTC epoch nanoseconds with an offset (wall clock - monotonic clock) that is
+measured at start and again every CLOCK_SYNC_INTERVAL seconds by GatewayClock.discipline(), so a step of the wall
+clock moves the epoch timestamps once per sync instead of between two readings.
+
+CLOCK_MONOTONIC is shared by all processes of a host, so the stamps can be passed between the processes of the
+sharded runtime.
+"""
+import asyncio
+import time
+from configs import config
+from utils import metrics
+from utils.logger import get_logger
+
+logger = get_logger("iot_gatway_logger", file_name='logs/iot_gatway.log')
+
+STEP_LOG_THRESHOLD_NS = 1_000_000 # wall clock steps above 1 ms are logged
+CLOCK_STEP = metrics.gauge("gateway_clock_step_seconds", "Wall clock step found by the last clock sync")
+READING_LATENCY = metrics.histogram("gateway_reading_latency_seconds",
+                                    "Time from receiving a reading at the socket until it is handed to the MQTT client or the outbound queue",
+                                    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 10.0))
+
+
+class GatewayClock:
+    """
+    Maps monotonic nanoseconds to UTC epoch nanoseconds.
+
+    Attributes:
+    - offset_ns(int): UTC epoch nanoseconds minus monotonic nanoseconds, as measured by the last sync().
+    """
+    monotonic_ns = staticmethod(time.monotonic_ns)
+
+    def __init__(self) -> None:
+        self.offset_ns = self._measure()
+
+    @staticmethod
+    def _measure() -> int:
+        # The wall clock is read between two monotonic reads and compared with their midpoint, so a preemption
+        # between the calls does not skew the offset by more than half of it.
+        before = time.monotonic_ns()
+        wall = time.time_ns()
+        after = time.monotonic_ns()
+        return wall - (before + after) // 2
+
+    def to_epoch_ns(self, monotonic_ns: int) -> int:
+        """
+        Returns the UTC epoch nanoseconds of a monotonic stamp.
+        """
+        return monotonic_ns + self.offset_ns
+
+    def now_ns(self) -> int:
+        """
+        Returns the current time as UTC epoch nanoseconds.
+        """
+        return time.monotonic_ns() + self.offset_ns
+
+    def sync(self) -> int:
+        """
+        Measure the offset between the wall clock and the monotonic clock again.
+
+        Returns:
+        --------
+        int: The step of the wall clock since the last sync in nanoseconds.
+        """
+        offset_ns = self._measure()
+        step = offset_ns - self.offset_ns
+        self.offset_ns = offset_ns
+        CLOCK_STEP.set(step / 1e9)
+        if abs(step) > STEP_LOG_THRESHOLD_NS:
+            logger.warning("The wall clock moved %.3f ms against the monotonic clock", step / 1e6)
+        return step
+
+    async def discipline(self, interval: float = config.CLOCK_SYNC_INTERVAL) -> None:
+        """
+        Sync the clock every interval seconds, runs until cancelled.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            self.sync()
+
+
+def observe_latency(readings) -> None:
+    """
+    Record the time since the readings were received in the gateway_reading_latency_seconds histogram, readings
+    without a receive stamp (replays) are skipped.
+    """
+    now = time.monotonic_ns()
+    for reading in readings:
+        if reading.received_ns:
+            READING_LATENCY.observe((now - reading.received_ns) / 1e9)
+
+
+CLOCK = GatewayClock()
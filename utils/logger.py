@@ -1,13 +1,287 @@
 import logging
+import logging.handlers
+import atexit
+import queue
+import threading
+import time
 import os
+import sys
+from configs import config
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets at most `burst` warnings or errors of the same message template through per `interval` seconds.
+
+    The key is the logger name and the unformatted message (record.msg), so a repeated error such as a checksum
+    mismatch logged with %-style arguments is limited as one message whatever its arguments are. The first record
+    after a suppressed period carries the number of suppressed records, which is added to the log line. Expired
+    windows without suppressed records are dropped once per interval, so templates that are built per call (f-strings)
+    do not grow the table.
+
+    Attributes:
+    - interval(float): Length of the rate limit window in seconds.
+    - burst(int): Records of the same template allowed per window, 0 disables the limit.
+    """
+    def __init__(self, interval: float = 60, burst: int = 10) -> None:
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self._windows: dict = {} # (logger name, template) -> [window start, records in window, suppressed]
+        self._swept = 0.0 # record time of the last removal of expired windows
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not self.burst or record.levelno < logging.WARNING:
+            return True
+        key = (record.name, record.msg)
+        now = record.created
+        if now - self._swept >= self.interval:
+            self._sweep(now)
+        window = self._windows.get(key)
+        if window is None or now - window[0] >= self.interval:
+            suppressed = window[2] if window else 0
+            self._windows[key] = [now, 1, 0]
+            if suppressed:
+                record.suppressed = suppressed
+            return True
+        if window[1] < self.burst:
+            window[1] += 1
+            return True
+        window[2] += 1
+        return False
+
+    def _sweep(self, now: float) -> None:
+        self._swept = now
+        self._windows = {key: window for key, window in self._windows.items()
+                         if window[2] or now - window[0] < self.interval}
+
+
+class SuppressedCountFormatter(logging.Formatter):
+    """
+    The gateway log format, adds the number of records dropped by the RateLimitFilter to the line.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            line += f" ({suppressed} similar messages suppressed)"
+        return line
+
+
+class BatchingRotatingFile:
+    """
+    A log file written in batches, rotated by size and by age.
+
+    Attributes:
+    - file_name(str): Path of the log file.
+    - max_bytes(int): Rotate when the next batch would grow the file beyond this size (a single batch is never split),
+      0 disables size rotation.
+    - rotate_interval(float): Rotate when the file is older than this many seconds, 0 disables time rotation.
+    - backup_count(int): Number of rotated files kept as file_name.1 .. file_name.N.
+    """
+    def __init__(self, file_name: str, max_bytes: int = 0, rotate_interval: float = 0, backup_count: int = 5) -> None:
+        self.file_name = file_name
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self.formatter = SuppressedCountFormatter(LOG_FORMAT)
+        self.pending: list[str] = []
+        self._stream = None
+        self._opened = 0.0
+
+    def _open(self) -> None:
+        directory = os.path.dirname(self.file_name)
+        if directory:
+            os.makedirs(directory, exist_ok=True) # created with the first write, not when the logger is set up
+        self._stream = open(self.file_name, mode='a', encoding='utf-8')
+        self._opened = time.time()
+
+    def add(self, record: logging.LogRecord) -> None:
+        try:
+            self.pending.append(self.formatter.format(record)) # the message is formatted here, on the writer thread
+        except Exception as e: # eg. arguments that do not match the message, must not stop the writer thread
+            print(f"Unable to format log record {record.msg!r}: {e}", file=sys.stderr)
+
+    def _should_rotate(self, size: int) -> bool:
+        written = self._stream.tell()
+        if not written:
+            return False
+        if self.max_bytes and written + size > self.max_bytes:
+            return True
+        return bool(self.rotate_interval) and time.time() - self._opened >= self.rotate_interval
+
+    def _rotate(self) -> None:
+        self._stream.close()
+        if self.backup_count:
+            for index in range(self.backup_count - 1, 0, -1):
+                source = f"{self.file_name}.{index}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.file_name}.{index + 1}")
+            os.replace(self.file_name, f"{self.file_name}.1")
+        else:
+            os.remove(self.file_name)
+        self._open()
+
+    def flush(self) -> None:
+        """
+        Write all pending lines with a single write() call.
+        """
+        if not self.pending:
+            return
+        data = "\n".join(self.pending) + "\n"
+        self.pending.clear()
+        if self._stream is None:
+            self._open()
+        if self._should_rotate(len(data)):
+            self._rotate()
+        self._stream.write(data)
+        self._stream.flush()
+
+    def close(self) -> None:
+        self.flush()
+        if self._stream:
+            self._stream.close()
+            self._stream = None
+
+
+class LogFileQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records of a logger to the LogWriter thread without formatting them.
+
+    The standard QueueHandler formats the message in prepare() on the calling thread, here the record is only
+    tagged with its log file, so the cost on the hot path is a queue put. The writer thread is started by the first
+    record, so importing a module that sets up a logger starts no thread and creates no file.
+    """
+    def __init__(self, writer: "LogWriter", file_name: str) -> None:
+        super().__init__(writer.queue)
+        self.writer = writer
+        self.file_name = file_name
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.log_file = self.file_name
+        if not self.writer.started:
+            self.writer.ensure_started()
+        return record
+
+
+class LogWriter(threading.Thread):
+    """
+    Background thread writing the queued log records to their files.
+
+    Records are collected for up to `flush_interval` seconds (or `batch_size` records) and written with one write()
+    per file, so the producers never wait for disk I/O. Records at ERROR or above are written at the end of the
+    current batch without waiting for the interval.
+    """
+    def __init__(self, flush_interval: float = 1.0, batch_size: int = 500) -> None:
+        super().__init__(name="log-writer", daemon=True)
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.files: dict[str, BatchingRotatingFile] = {} # file name given to get_logger() -> file
+        self.process_name: str | None = None
+        self.started = False
+        self._start_lock = threading.Lock()
+
+    def ensure_started(self) -> None:
+        """
+        Start the thread with the first record, the remaining records are written at exit.
+        """
+        with self._start_lock:
+            if not self.started:
+                self.started = True
+                self.start()
+                atexit.register(self.stop)
+
+    def path_of(self, file_name: str) -> str:
+        if self.process_name is None:
+            return file_name
+        return with_suffix(file_name, self.process_name)
+
+    def add_file(self, file_name: str) -> None:
+        if file_name not in self.files:
+            self.files[file_name] = BatchingRotatingFile(
+                self.path_of(file_name), max_bytes=config.LOG_MAX_BYTES,
+                rotate_interval=config.LOG_ROTATE_INTERVAL * 3600, backup_count=config.LOG_BACKUP_COUNT)
+
+    def run(self) -> None:
+        running = True
+        while running:
+            record = self.queue.get()
+            deadline = time.monotonic() + self.flush_interval
+            count = 0
+            while True:
+                if record is None: # stop() was called
+                    running = False
+                    break
+                self.files[record.log_file].add(record)
+                count += 1
+                if count >= self.batch_size or record.levelno >= logging.ERROR:
+                    break
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    record = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+            for log_file in list(self.files.values()): # loggers may add files while the thread runs
+                try:
+                    log_file.flush()
+                except OSError as e:
+                    print(f"Unable to write log file '{log_file.file_name}': {e}", file=sys.stderr)
+
+    def stop(self) -> None:
+        """
+        Write the remaining records and close the files.
+        """
+        if self.is_alive():
+            self.queue.put(None)
+            self.join()
+        for log_file in self.files.values():
+            log_file.close()
+
+
+def with_suffix(path: str, suffix: str) -> str:
+    """
+    Insert a suffix before the file extension, eg. logs/nmea_client.log -> logs/nmea_client.worker-0.log
+    """
+    root, extension = os.path.splitext(path)
+    return f"{root}.{suffix}{extension}"
+
+
+_writer: LogWriter | None = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> LogWriter:
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = LogWriter(flush_interval=config.LOG_FLUSH_INTERVAL) # started by the first record
+    return _writer
+
+
+def set_process_name(name: str) -> None:
+    """
+    Give the log files of this process their own names (see with_suffix), so several gateway processes never
+    append to and rotate the same file. Call it at the start of the process, before anything is logged.
+    """
+    writer = get_writer()
+    writer.process_name = name
+    for file_name, log_file in writer.files.items():
+        log_file.close()
+        log_file.file_name = writer.path_of(file_name)
+
 
 def get_logger(name, file_name):
-    os.makedirs(os.path.dirname(file_name), exist_ok=True)
     logger = logging.getLogger(name)
-    logger.setLevel(logging.INFO)
+    logger.setLevel(config.LOG_LEVEL)
     if not logger.handlers:
-        file_handler = logging.FileHandler(file_name, mode='a')
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
-    return logger
\ No newline at end of file
+        writer = get_writer()
+        writer.add_file(file_name)
+        queue_handler = LogFileQueueHandler(writer, file_name)
+        queue_handler.addFilter(RateLimitFilter(config.LOG_RATE_LIMIT_INTERVAL, config.LOG_RATE_LIMIT_BURST))
+        logger.addHandler(queue_handler)
+    return logger
@@ -0,0 +1,277 @@
+"""
+Low overhead in-process metrics for the gateway hot paths.
+
+Counters, gauges and histograms are plain Python objects updated with a single addition (histograms add a bisect
+over the bucket bounds), so they can stay enabled on every reading. The values are read only when they are
+scraped from the Prometheus text endpoint (MetricsServer) or published as a JSON snapshot to MQTT.
+"""
+import asyncio
+import bisect
+import math
+from utils.logger import get_logger
+
+logger = get_logger("iot_gatway_logger", file_name='logs/iot_gatway.log')
+
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0) # seconds
+
+
+def escape_label_value(value) -> str:
+    """
+    Escape a label value for the text format: backslash, double quote and line feed.
+    """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label_value(value)}"' for key, value in sorted(labels.items())) + "}"
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    A monotonically increasing value, eg. number of checksum failures.
+
+    Attributes:
+    - name(str): Metric name.
+    - labels(str): Rendered label set, eg. '{reason="timeout"}'.
+    """
+    kind = "counter"
+    __slots__ = ("name", "labels", "value", "function")
+
+    def __init__(self, name: str, labels: str = "") -> None:
+        self.name = name
+        self.labels = labels
+        self.value = 0
+        self.function = None
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def set_function(self, function) -> None:
+        """
+        Read the value from a callable at scrape time, for values that are already counted elsewhere.
+        """
+        self.function = function
+
+    def get(self) -> float:
+        return self.function() if self.function else self.value
+
+    def samples(self):
+        yield self.name, self.labels, self.get()
+
+
+class Gauge(Counter):
+    """
+    A value that goes up and down, eg. number of messages in flight.
+    """
+    kind = "gauge"
+    __slots__ = ()
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+
+class Histogram:
+    """
+    Distribution of observed values in fixed buckets, eg. Modbus round trip times.
+
+    Attributes:
+    - name(str): Metric name.
+    - labels(str): Rendered label set.
+    - bounds(tuple): Upper bounds of the buckets, the +Inf bucket is implicit.
+    """
+    kind = "histogram"
+    __slots__ = ("name", "labels", "bounds", "counts", "sum", "count")
+
+    def __init__(self, name: str, labels: str = "", buckets: tuple = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.labels = labels
+        self.bounds = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, fraction: float) -> float:
+        """
+        Estimate a quantile by linear interpolation inside the bucket that holds it (like histogram_quantile()).
+        """
+        if not self.count:
+            return math.nan
+        rank = fraction * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if cumulative + count >= rank and count:
+                if index == len(self.bounds): # +Inf bucket, the highest finite bound is the best estimate
+                    return self.bounds[-1]
+                lower = self.bounds[index - 1] if index else 0.0
+                return lower + (self.bounds[index] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.bounds[-1]
+
+    def samples(self):
+        label_prefix = self.labels[1:-1] + "," if self.labels else ""
+        cumulative = 0
+        for bound, count in zip(self.bounds + (math.inf,), self.counts):
+            cumulative += count
+            yield f"{self.name}_bucket", f'{{{label_prefix}le="{format_value(bound)}"}}', cumulative
+        yield f"{self.name}_sum", self.labels, self.sum
+        yield f"{self.name}_count", self.labels, self.count
+
+
+class MetricsRegistry:
+    """
+    Holds every metric of the process by name and label set and renders them.
+
+    Asking twice for the same name and labels returns the same metric, so modules can declare their metrics at
+    import time without coordinating.
+    """
+    def __init__(self) -> None:
+        self._families: dict = {} # name -> [kind, help, {labels: metric}]
+
+    def _get(self, cls, name: str, help_text: str, labels: dict, **kwargs):
+        family = self._families.setdefault(name, [cls.kind, help_text, {}])
+        if family[0] != cls.kind:
+            raise ValueError(f"Metric '{name}' is already registered as a {family[0]}")
+        rendered = format_labels(labels)
+        metric = family[2].get(rendered)
+        if metric is None:
+            metric = family[2][rendered] = cls(name, rendered, **kwargs)
+        return metric
+
+    def counter(self, name: str, help_text: str, **labels) -> Counter:
+        return self._get(Counter, name, help_text, labels)
+
+    def gauge(self, name: str, help_text: str, **labels) -> Gauge:
+        return self._get(Gauge, name, help_text, labels)
+
+    def histogram(self, name: str, help_text: str, buckets: tuple = DEFAULT_BUCKETS, **labels) -> Histogram:
+        return self._get(Histogram, name, help_text, labels, buckets=buckets)
+
+    def render(self) -> str:
+        """
+        Returns:
+        --------
+        str: All metrics in the Prometheus text exposition format (version 0.0.4).
+        """
+        lines = []
+        for name, (kind, help_text, metrics) in sorted(self._families.items()):
+            help_text = help_text.replace("\\", "\\\\").replace("\n", "\\n")
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for metric in metrics.values():
+                for sample_name, labels, value in metric.samples():
+                    lines.append(f"{sample_name}{labels} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        """
+        Returns:
+        --------
+        dict: A compact view of all metrics for JSON, histograms are reduced to count, sum, p50 and p99.
+        """
+        snapshot = {}
+        for name, (_, _, metrics) in sorted(self._families.items()):
+            for labels, metric in metrics.items():
+                if isinstance(metric, Histogram):
+                    empty = not metric.count # NaN is not valid JSON
+                    snapshot[name + labels] = {"count": metric.count, "sum": metric.sum,
+                                               "p50": None if empty else metric.quantile(0.5),
+                                               "p99": None if empty else metric.quantile(0.99)}
+                else:
+                    snapshot[name + labels] = metric.get()
+        return snapshot
+
+
+REGISTRY = MetricsRegistry()
+
+
+def counter(name: str, help_text: str, **labels) -> Counter:
+    return REGISTRY.counter(name, help_text, **labels)
+
+
+def gauge(name: str, help_text: str, **labels) -> Gauge:
+    return REGISTRY.gauge(name, help_text, **labels)
+
+
+def histogram(name: str, help_text: str, buckets: tuple = DEFAULT_BUCKETS, **labels) -> Histogram:
+    return REGISTRY.histogram(name, help_text, buckets, **labels)
+
+
+class MetricsServer:
+    """
+    A minimal asyncio HTTP server answering GET /metrics with the Prometheus text format.
+
+    Attributes:
+    - host(str): Interface to listen on, keep it on localhost unless the port is firewalled.
+    - port(int): Port to listen on, 0 picks a free port.
+    - registry(MetricsRegistry): The metrics to expose.
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 9108, registry: MetricsRegistry = REGISTRY) -> None:
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self._server: asyncio.AbstractServer | None = None
+
+    async def start(self) -> int:
+        """
+        Start serving and return the port that is listened on.
+        """
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def serve(self) -> None:
+        """
+        Start serving and run until cancelled, to be gathered with the other gateway tasks.
+
+        A port that is in use or an address that is not available is logged and the method returns, the endpoint is
+        optional and must not stop the tasks it is gathered with.
+        """
+        try:
+            await self.start()
+        except OSError as e:
+            logger.error("Metrics endpoint not started on %s:%s: %s", self.host, self.port, e)
+            return
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def stop(self) -> None:
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""): # skip the headers
+                pass
+            parts = request_line.split()
+            if len(parts) >= 2 and parts[0] == b"GET" and parts[1].split(b"?")[0] in (b"/metrics", b"/"):
+                status, body = "200 OK", self.registry.render().encode()
+            else:
+                status, body = "404 Not Found", b"Not Found\n"
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()